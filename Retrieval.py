@@ -3,58 +3,74 @@
 
 import os
 import json
+import queue
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any, Optional
 from sentence_transformers import SentenceTransformer
-from pinecone import Pinecone
-import google.generativeai as genai
 import time
+from vector_index import create_vector_index, get_backend_name
+from clients import get_pinecone_client, get_gemini_model
+from llm_client import LLMClient, LLMError
 
 class RAGRetriever:
     """
     RAG (Retrieval-Augmented Generation) 檢索器
-    結合Pinecone向量搜尋和Gemini LLM生成回答
+    結合向量搜尋（Pinecone或本地索引）和Gemini LLM生成回答
     """
     
     def __init__(self, 
-                 pinecone_api_key: str,
+                 pinecone_api_key: Optional[str],
                  gemini_api_key: str,
                  pinecone_env: str = "us-east-1",
-                 index_name: str = "text-chunks-index"):
+                 index_name: str = "text-chunks-index",
+                 vector_backend: Optional[str] = None,
+                 local_index_path: Optional[str] = None):
         """
         初始化RAG檢索器
         
         Args:
-            pinecone_api_key: Pinecone API金鑰
+            pinecone_api_key: Pinecone API金鑰（本地後端可為None）
             gemini_api_key: Gemini API金鑰
             pinecone_env: Pinecone環境
             index_name: Pinecone索引名稱
+            vector_backend: 向量後端 "pinecone" 或 "local"，預設讀取環境變數VECTOR_BACKEND
+            local_index_path: 本地索引目錄，預設讀取環境變數LOCAL_INDEX_PATH
         """
         self.pinecone_api_key = pinecone_api_key
         self.gemini_api_key = gemini_api_key
         self.pinecone_env = pinecone_env
         self.index_name = index_name
+        self.vector_backend = get_backend_name(vector_backend)
+        self.local_index_path = local_index_path
         
         # 初始化組件
-        self._initialize_pinecone()
+        self._initialize_vector_store()
         self._initialize_gemini()
         self._initialize_embedding_model()
     
-    def _initialize_pinecone(self):
-        """初始化Pinecone客戶端"""
+    def _initialize_vector_store(self):
+        """初始化向量索引（Pinecone或本地索引）"""
         try:
-            self.pc = Pinecone(api_key=self.pinecone_api_key)
-            self.index = self.pc.Index(self.index_name)
-            print(f"✅ Pinecone初始化成功，連接到索引: {self.index_name}")
+            self.pc = None
+            if self.vector_backend == "pinecone":
+                self.pc = get_pinecone_client(self.pinecone_api_key)
+            self.index = create_vector_index(
+                self.vector_backend,
+                index_name=self.index_name,
+                pinecone_api_key=self.pinecone_api_key,
+                local_index_path=self.local_index_path
+            )
+            print(f"✅ 向量索引初始化成功 ({self.vector_backend})，連接到索引: {self.index_name}")
         except Exception as e:
-            print(f"❌ Pinecone初始化失敗: {str(e)}")
+            print(f"❌ 向量索引初始化失敗: {str(e)}")
             raise
     
     def _initialize_gemini(self):
         """初始化Gemini LLM"""
         try:
-            genai.configure(api_key=self.gemini_api_key)
-            # 使用免費的gemini-1.5-flash模型
-            self.model = genai.GenerativeModel('gemini-1.5-flash')
+            # 使用免費的gemini-1.5-flash模型（同一程序內共用）
+            self.model = get_gemini_model(self.gemini_api_key, 'gemini-1.5-flash')
+            self.llm = LLMClient.from_env(lambda: self.model)
             print("✅ Gemini LLM初始化成功")
         except Exception as e:
             print(f"❌ Gemini初始化失敗: {str(e)}")
@@ -72,7 +88,7 @@ class RAGRetriever:
     
     def retrieve_similar_chunks(self, query: str, top_k: int = 3) -> List[Dict[str, Any]]:
         """
-        從Pinecone檢索最相似的文字塊
+        從向量索引檢索最相似的文字塊
         
         Args:
             query: 查詢文字
@@ -86,24 +102,7 @@ class RAGRetriever:
             query_embedding = self.embedding_model.encode([query]).tolist()[0]
             
             # 執行向量搜尋
-            results = self.index.query(
-                vector=query_embedding,
-                top_k=top_k,
-                include_metadata=True
-            )
-            
-            # 提取相關信息
-            retrieved_chunks = []
-            for match in results['matches']:
-                chunk_info = {
-                    'id': match['id'],
-                    'score': match['score'],
-                    'text': match['metadata'].get('text', ''),
-                    'source_file': match['metadata'].get('source_file', 'Unknown'),
-                    'chunk_index': match['metadata'].get('chunk_index', -1),
-                    'metadata': match['metadata']
-                }
-                retrieved_chunks.append(chunk_info)
+            retrieved_chunks = self.search_by_vector(query_embedding, top_k)
             
             print(f"✅ 成功檢索到 {len(retrieved_chunks)} 個相關文字塊")
             return retrieved_chunks
@@ -112,6 +111,37 @@ class RAGRetriever:
             print(f"❌ 檢索過程中發生錯誤: {str(e)}")
             return []
     
+    def search_by_vector(self, query_embedding: List[float], top_k: int = 3) -> List[Dict[str, Any]]:
+        """
+        以查詢向量執行向量搜尋
+        
+        Args:
+            query_embedding: 查詢向量
+            top_k: 檢索的文字塊數量
+        
+        Returns:
+            相似文字塊列表
+        """
+        results = self.index.query(
+            vector=query_embedding,
+            top_k=top_k,
+            include_metadata=True
+        )
+        
+        # 提取相關信息
+        retrieved_chunks = []
+        for match in results['matches']:
+            chunk_info = {
+                'id': match['id'],
+                'score': match['score'],
+                'text': match['metadata'].get('text', ''),
+                'source_file': match['metadata'].get('source_file', 'Unknown'),
+                'chunk_index': match['metadata'].get('chunk_index', -1),
+                'metadata': match['metadata']
+            }
+            retrieved_chunks.append(chunk_info)
+        return retrieved_chunks
+    
     def format_context(self, chunks: List[Dict[str, Any]]) -> str:
         """
         格式化檢索到的文字塊作為上下文
@@ -177,22 +207,12 @@ class RAGRetriever:
         Returns:
             Gemini的回答
         """
-        for attempt in range(max_retries):
-            try:
-                print(prompt)
-                response = self.model.generate_content(prompt)
-                
-                if response.text:
-                    return response.text
-                else:
-                    print(f"⚠️ Gemini回應為空，嘗試 {attempt + 1}/{max_retries}")
-                    
-            except Exception as e:
-                print(f"❌ Gemini查詢失敗 (嘗試 {attempt + 1}/{max_retries}): {str(e)}")
-                if attempt < max_retries - 1:
-                    time.sleep(2)  # 等待2秒後重試
-                    
-        return "抱歉，無法從Gemini獲取回答。請稍後再試。"
+        print(prompt)
+        try:
+            return self.llm.generate(prompt, operation='retrieval_query', max_attempts=max_retries)
+        except LLMError as e:
+            print(f"❌ Gemini查詢失敗: {str(e)}")
+            return "抱歉，無法從Gemini獲取回答。請稍後再試。"
     
     def rag_query(self, query: str, top_k: int = 3, verbose: bool = True) -> Dict[str, Any]:
         """
@@ -215,7 +235,10 @@ class RAGRetriever:
         if verbose:
             print("📖 正在檢索相關文字塊...")
         retrieved_chunks = self.retrieve_similar_chunks(query, top_k)
-        
+        return self._answer(query, retrieved_chunks, verbose)
+    
+    def _answer(self, query: str, retrieved_chunks: List[Dict[str, Any]], verbose: bool = False) -> Dict[str, Any]:
+        """依檢索結果組裝上下文並查詢Gemini"""
         if not retrieved_chunks:
             return {
                 'query': query,
@@ -263,55 +286,121 @@ class RAGRetriever:
         
         return result
     
-    def batch_query(self, queries: List[str], top_k: int = 3) -> List[Dict[str, Any]]:
+    def batch_query(self, queries: List[str], top_k: int = 3, output_file: Optional[str] = None,
+                    search_workers: int = None, llm_workers: int = None,
+                    encode_batch_size: int = 64) -> List[Dict[str, Any]]:
         """
         批量執行RAG查詢
+        所有查詢以一次批次encode生成向量，向量搜尋與Gemini呼叫分別在兩個執行緒池中並行執行；
+        Gemini呼叫的速率由共用的速率限制器控制（見rate_limiter.py），完成的結果依完成順序寫入output_file
         
         Args:
             queries: 查詢列表
             top_k: 每個查詢檢索的文字塊數量
+            output_file: 逐筆寫入結果的JSONL檔案（每行含index欄位對應查詢順序，不論副檔名皆為JSONL），None表示不寫入
+            search_workers: 同時進行的向量搜尋數，預設讀取環境變數BATCH_SEARCH_CONCURRENCY
+            llm_workers: 同時進行的Gemini呼叫數，預設讀取環境變數BATCH_LLM_CONCURRENCY
+            encode_batch_size: 嵌入模型每批編碼的查詢數
         
         Returns:
-            查詢結果列表
+            查詢結果列表（與queries順序相同）
         """
-        results = []
-        for i, query in enumerate(queries, 1):
-            print(f"\n處理查詢 {i}/{len(queries)}: {query}")
-            result = self.rag_query(query, top_k, verbose=False)
-            results.append(result)
-            time.sleep(1)  # 避免API速率限制
+        if not queries:
+            return []
+        if search_workers is None:
+            search_workers = int(os.getenv('BATCH_SEARCH_CONCURRENCY', '8'))
+        if llm_workers is None:
+            llm_workers = int(os.getenv('BATCH_LLM_CONCURRENCY', '8'))
+        started = time.perf_counter()
+        
+        print(f"🔢 正在為 {len(queries)} 個查詢生成向量...")
+        embeddings = self.embedding_model.encode(queries, batch_size=encode_batch_size, convert_to_numpy=True)
         
+        # 結果檔只開啟一次，每完成一題寫入一行JSONL並立即flush（不論副檔名，中途中斷也保留已完成的結果）
+        output = open(output_file, 'w', encoding='utf-8') if output_file else None
+        
+        completed = queue.Queue()
+        search_pool = ThreadPoolExecutor(max_workers=search_workers, thread_name_prefix='batch-search')
+        llm_pool = ThreadPoolExecutor(max_workers=llm_workers, thread_name_prefix='batch-llm')
+        
+        def answer(index: int, search_future):
+            try:
+                result = self._answer(queries[index], search_future.result())
+            except Exception as e:
+                result = {
+                    'query': queries[index],
+                    'retrieved_chunks': [],
+                    'context': "",
+                    'answer': f"查詢過程中發生錯誤: {str(e)}",
+                    'success': False
+                }
+            result['index'] = index
+            completed.put(result)
+        
+        def on_searched(index: int, search_future):
+            # 檢索完成即送出Gemini呼叫，不必等待其他查詢的檢索
+            llm_pool.submit(answer, index, search_future)
+        
+        results: List[Optional[Dict[str, Any]]] = [None] * len(queries)
+        try:
+            for index, embedding in enumerate(embeddings):
+                future = search_pool.submit(self.search_by_vector, embedding.tolist(), top_k)
+                future.add_done_callback(lambda f, index=index: on_searched(index, f))
+            
+            for done in range(1, len(queries) + 1):
+                result = completed.get()
+                results[result['index']] = result
+                if output:
+                    output.write(json.dumps(self._clean_result(result), ensure_ascii=False) + "\n")
+                    output.flush()
+                print(f"✅ 完成查詢 {done}/{len(queries)}: {result['query']}")
+        finally:
+            search_pool.shutdown(wait=True, cancel_futures=True)
+            llm_pool.shutdown(wait=True, cancel_futures=True)
+            if output:
+                output.close()
+        
+        elapsed = time.perf_counter() - started
+        print(f"🏁 批量查詢完成：{len(queries)} 個查詢，耗時 {elapsed:.1f}s（{len(queries) / elapsed:.2f} 個/秒）")
         return results
     
+    def _clean_result(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        """清理結果以便JSON序列化"""
+        clean_result = {
+            'query': result['query'],
+            'answer': result['answer'],
+            'retrieved_chunks': [
+                {
+                    'score': chunk['score'],
+                    'text': chunk['text'],
+                    'source_file': chunk['source_file']
+                }
+                for chunk in result['retrieved_chunks']
+            ],
+            'success': result['success']
+        }
+        if 'index' in result:
+            clean_result['index'] = result['index']
+        return clean_result
+    
     def save_results(self, results: List[Dict[str, Any]], filename: str = "rag_results.json"):
         """
         儲存查詢結果到JSON檔案
         
         Args:
             results: 查詢結果列表
-            filename: 儲存檔案名
+            filename: 儲存檔案名；副檔名為.jsonl時每個結果寫成一行
         """
         try:
-            # 清理結果以便JSON序列化
-            clean_results = []
-            for result in results:
-                clean_result = {
-                    'query': result['query'],
-                    'answer': result['answer'],
-                    'retrieved_chunks': [
-                        {
-                            'score': chunk['score'],
-                            'text': chunk['text'],
-                            'source_file': chunk['source_file']
-                        }
-                        for chunk in result['retrieved_chunks']
-                    ],
-                    'success': result['success']
-                }
-                clean_results.append(clean_result)
+            clean_results = [self._clean_result(result) for result in results]
             
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(clean_results, f, ensure_ascii=False, indent=2)
+            if filename.endswith('.jsonl'):
+                with open(filename, 'w', encoding='utf-8') as f:
+                    for clean_result in clean_results:
+                        f.write(json.dumps(clean_result, ensure_ascii=False) + "\n")
+            else:
+                with open(filename, 'w', encoding='utf-8') as f:
+                    json.dump(clean_results, f, ensure_ascii=False, indent=2)
             
             print(f"✅ 結果已儲存到 {filename}")
             
@@ -396,7 +485,8 @@ def example_usage():
         "人工智慧的發展趨勢如何？"
     ]
     
-    batch_results = rag.batch_query(queries, top_k=3)
+    # 結果完成後逐筆寫入batch_results.jsonl
+    batch_results = rag.batch_query(queries, top_k=3, output_file="batch_results.jsonl")
     rag.save_results(batch_results, "batch_results.json")
 
 if __name__ == "__main__":
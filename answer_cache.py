@@ -0,0 +1,150 @@
+# 語意回答快取
+# 對語意相近、且檢索到相同上下文的問題，直接返回先前 Gemini 生成的回答
+
+import time
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+
+class SemanticAnswerCache:
+    """
+    語意回答快取
+    儲存 (查詢向量, 檢索到的 chunk id, 回答)；新查詢的向量與快取項目的餘弦相似度達到門檻，
+    且檢索到的 chunk id 完全相同時，返回快取的回答。支援 TTL、容量上限（LRU）與索引版本失效
+    """
+
+    def __init__(self, similarity_threshold: float = 0.95, ttl_seconds: float = 600,
+                 maxsize: int = 256):
+        """
+        初始化快取
+
+        Args:
+            similarity_threshold: 視為相同問題的最低餘弦相似度
+            ttl_seconds: 快取項目的存活秒數
+            maxsize: 最多保留的回答數量，0 表示停用快取
+        """
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._by_context: Dict[Tuple[str, ...], set] = {}
+        self._next_id = 0
+        self._index_version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _context_key(chunk_ids: List[str]) -> Tuple[str, ...]:
+        return tuple(sorted(str(chunk_id) for chunk_id in chunk_ids))
+
+    @staticmethod
+    def _unit(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _remove(self, entry_id: int):
+        entry = self._entries.pop(entry_id)
+        ids = self._by_context.get(entry['context'])
+        if ids is not None:
+            ids.discard(entry_id)
+            if not ids:
+                del self._by_context[entry['context']]
+
+    def lookup(self, embedding, chunk_ids: List[str]) -> Optional[Dict[str, Any]]:
+        """
+        查找語意相同的快取回答
+
+        Args:
+            embedding: 查詢向量
+            chunk_ids: 本次檢索到的 chunk id 列表
+
+        Returns:
+            {'answer', 'query', 'similarity'}，未命中時返回 None
+        """
+        if self.maxsize <= 0:
+            return None
+        vector = self._unit(embedding)
+        now = time.monotonic()
+        with self._lock:
+            best_id, best_similarity = None, self.similarity_threshold
+            for entry_id in list(self._by_context.get(self._context_key(chunk_ids), ())):
+                entry = self._entries[entry_id]
+                if entry['expires_at'] <= now:
+                    self._remove(entry_id)
+                    self.evictions += 1
+                    continue
+                similarity = float(entry['embedding'] @ vector)
+                if similarity >= best_similarity:
+                    best_id, best_similarity = entry_id, similarity
+
+            if best_id is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_id)
+            self.hits += 1
+            entry = self._entries[best_id]
+            return {'answer': entry['answer'], 'query': entry['query'], 'similarity': best_similarity}
+
+    def store(self, embedding, chunk_ids: List[str], answer: str, query: str = ""):
+        """
+        寫入回答，超過容量時淘汰最久未使用的項目
+
+        Args:
+            embedding: 查詢向量
+            chunk_ids: 檢索到的 chunk id 列表
+            answer: LLM 回答
+            query: 原始查詢（僅供記錄）
+        """
+        if self.maxsize <= 0:
+            return
+        context = self._context_key(chunk_ids)
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = {
+                'embedding': self._unit(embedding),
+                'context': context,
+                'answer': answer,
+                'query': query,
+                'expires_at': time.monotonic() + self.ttl_seconds
+            }
+            self._by_context.setdefault(context, set()).add(entry_id)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self):
+        """清空所有快取回答（例如重新建立索引後）"""
+        with self._lock:
+            self._entries.clear()
+            self._by_context.clear()
+            self.invalidations += 1
+
+    def sync_index_version(self, version):
+        """記錄目前的索引版本；版本改變代表資料已重新匯入，快取的回答全部失效"""
+        if version is None or version == self._index_version:
+            return
+        if self._index_version is not None:
+            self.invalidate()
+        self._index_version = version
+
+    def stats(self) -> Dict[str, Any]:
+        """取得命中、未命中、淘汰與失效統計"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'hit_rate': self.hits / total if total else 0.0
+            }
@@ -1,31 +1,89 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context, g
 from dotenv import load_dotenv
 import os
 from rag_system import RAGSystem
+from embeddings import set_num_threads
+from document_cache import DocumentCache
+from question_bank import QuestionBank, QuestionBankBuilder, build_question_prompt, parse_questions_response
 import json
 import random
-from typing import List, Dict, Any
-import PyPDF2
-import pdfplumber
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Tuple, Optional
+from pdf_pages import iter_pdf_pages
+import metrics
+import clients
+from metrics import stage_timer
+from llm_client import LLMError
+from profiling import RequestProfiler
 
 # 載入環境變數
 load_dotenv()
 
 app = Flask(__name__)
 
-# 初始化 RAG 系統
+# 單一請求效能剖析（PROFILING_TOKEN 或 PROFILE_SAMPLE_RATE 未設定時停用）
+request_profiler = RequestProfiler.from_env()
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    if not request_profiler.enabled:
+        return
+    mode = request_profiler.requested_mode(request.headers, request.args)
+    if mode:
+        g.profile_session = request_profiler.start(mode, request.path)
+
+@app.after_request
+def record_request_duration(response):
+    """記錄請求耗時（串流回應為送出標頭前的時間，完整生成時間見 llm_stream 階段）"""
+    started = getattr(g, 'request_started', None)
+    if started is not None and request.url_rule is not None:
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=request.url_rule.rule,
+                                        method=request.method, status=response.status_code)
+    session = getattr(g, 'profile_session', None)
+    if session is not None:
+        response.headers['X-Profile-Path'] = session.path
+    return response
+
+@app.teardown_request
+def stop_request_profiler(exc):
+    """請求（含串流回應）結束後停止剖析並寫入檔案"""
+    session = g.pop('profile_session', None)
+    if session is not None:
+        try:
+            session.stop()
+        except Exception as e:
+            print(f"⚠️ 寫入剖析檔案失敗: {str(e)}")
+
+# 簡答題 AI 評分的共用工作池與每份考卷的評分期限
+GRADING_MAX_WORKERS = int(os.getenv('GRADING_MAX_WORKERS', '8'))
+GRADING_DEADLINE_SECONDS = float(os.getenv('GRADING_DEADLINE_SECONDS', '20'))
+grading_executor = ThreadPoolExecutor(max_workers=GRADING_MAX_WORKERS, thread_name_prefix='grading')
+
+# RAG 系統在第一次使用（或 warm_up()）時才建立，匯入 app 不會載入模型
 rag_system = None
-try:
-    rag_system = RAGSystem(
-        pinecone_api_key=os.getenv('PINECONE_API_KEY'),
-        gemini_api_key=os.getenv('GEMINI_API_KEY'),
-        pinecone_env=os.getenv('PINECONE_ENV', 'us-east-1'),
-        index_name='text-chunks-index'
-    )
-    print("✅ RAG 系統初始化成功")
-except Exception as e:
-    print(f"❌ RAG 系統初始化失敗: {str(e)}")
-    print("💡 請先執行 python init_db.py 來初始化資料庫")
+_rag_system_lock = threading.RLock()
+
+def get_rag_system() -> Optional[RAGSystem]:
+    """取得 RAG 系統，尚未建立時建立；建立失敗返回 None（下次呼叫會重試）"""
+    global rag_system
+    if rag_system is None:
+        with _rag_system_lock:
+            if rag_system is None:
+                try:
+                    rag_system = RAGSystem(
+                        pinecone_api_key=os.getenv('PINECONE_API_KEY'),
+                        gemini_api_key=os.getenv('GEMINI_API_KEY'),
+                        pinecone_env=os.getenv('PINECONE_ENV', 'us-east-1'),
+                        index_name='text-chunks-index'
+                    )
+                    print("✅ RAG 系統初始化成功")
+                except Exception as e:
+                    print(f"❌ RAG 系統初始化失敗: {str(e)}")
+                    print("💡 請先執行 python init_db.py 來初始化資料庫")
+    return rag_system
 
 @app.route('/')
 def index():
@@ -60,6 +118,7 @@ def query():
                 'error': '請輸入查詢內容'
             })
         
+        rag_system = get_rag_system()
         if not rag_system:
             return jsonify({
                 'success': False,
@@ -74,7 +133,10 @@ def query():
             'query': user_query,
             'answer': result['answer'],
             'retrieved_chunks': result['retrieved_chunks'],
-            'has_context': len(result['retrieved_chunks']) > 0
+            'has_context': len(result['retrieved_chunks']) > 0,
+            'cached': result.get('cached', False),
+            'fallback': result.get('fallback'),
+            'context_stats': result.get('context_stats')
         })
         
     except Exception as e:
@@ -83,6 +145,36 @@ def query():
             'error': f'查詢過程中發生錯誤: {str(e)}'
         })
 
+def format_sse(event: str, payload: Dict[str, Any]) -> str:
+    """將事件格式化為 Server-Sent Events 訊息"""
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+@app.route('/query/stream', methods=['POST'])
+def query_stream():
+    """以 Server-Sent Events 串流查詢結果：先送出檢索到的文字塊，再逐段送出回答"""
+    data = request.get_json() or {}
+    user_query = data.get('query', '').strip()
+    
+    def generate():
+        if not user_query:
+            yield format_sse('error', {'error': '請輸入查詢內容'})
+            return
+        rag_system = get_rag_system()
+        if not rag_system:
+            yield format_sse('error', {'error': 'RAG 系統未正確初始化。請先執行 python init_db.py 來初始化資料庫。'})
+            return
+        try:
+            for event, payload in rag_system.stream_query(user_query, top_k=3, similarity_threshold=0.4):
+                yield format_sse(event, payload)
+        except Exception as e:
+            yield format_sse('error', {'error': f'查詢過程中發生錯誤: {str(e)}'})
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/exam/files', methods=['GET'])
 def list_exam_files():
     """取得 data 目錄下所有支援的檔案名稱（txt 和 pdf）"""
@@ -92,64 +184,74 @@ def list_exam_files():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+def prepare_exam(file_name: str, num_questions: int) -> Dict[str, Any]:
+    """
+    出題的前置步驟：題庫抽題，不足時讀取教材片段並組裝出題提示詞（讀取 PDF 等阻塞操作都在這裡）
+    
+    Returns:
+        可直接回應的結果（含 'success'），或需要呼叫 Gemini 時的 {'prompt': 提示詞}
+    """
+    if not file_name:
+        return {'success': False, 'error': '請指定檔案名稱'}
+    file_path = os.path.join('data', file_name)
+    if not os.path.exists(file_path):
+        return {'success': False, 'error': '檔案不存在'}
+    # 題庫有足夠的預先生成題目時直接抽題
+    content_sha256 = document_cache.get_sha256(file_path)
+    question_bank_builder = get_question_bank_builder()
+    if question_bank_builder and content_sha256:
+        questions = question_bank.take(file_name, content_sha256, num_questions)
+        question_bank_builder.request_top_up(file_name)
+        if questions:
+            return {'success': True, 'questions': questions,
+                    'total_questions': len(questions), 'source': 'bank'}
+    # 取得檔案長度（解析結果已快取，不需重新讀取 PDF）
+    with stage_timer('file_read'):
+        total_chars = document_cache.get_length(file_path)
+        if not total_chars:
+            return {'success': False, 'error': '檔案內容為空或讀取失敗'}
+        # 隨機抽取 500 字的片段
+        offsets = list(range(0, total_chars, 500))
+        if len(offsets) > num_questions:
+            offsets = random.sample(offsets, num_questions)
+        chunks = [document_cache.get_slice(file_path, offset, 500) for offset in offsets]
+    if not get_rag_system():
+        return {'success': False, 'error': 'RAG 系統未正確初始化，無法出題'}
+    # 生成題目
+    content_text = "\n\n".join([f"內容 {i+1}: {chunk}" for i, chunk in enumerate(chunks)])
+    return {'prompt': build_question_prompt(content_text, num_questions)}
+
+def finish_exam(file_name: str, response_text: str) -> Dict[str, Any]:
+    """解析 Gemini 生成的題目，並在題庫不足時於背景補題（下次出題即可直接抽題）"""
+    question_bank_builder = get_question_bank_builder()
+    if question_bank_builder:
+        question_bank_builder.request_top_up(file_name)
+    try:
+        with stage_timer('json_parse'):
+            questions = parse_questions_response(response_text)
+        for i, question in enumerate(questions):
+            question['id'] = i + 1
+        return {'success': True, 'questions': questions, 'total_questions': len(questions)}
+    except Exception as e:
+        return {'success': False, 'error': f'題目解析失敗: {str(e)}', 'raw': response_text}
+
+def llm_unavailable_response(error: LLMError) -> Dict[str, Any]:
+    return {'success': False, 'error': f'AI 服務暫時無法使用，請稍後再試: {str(error)}'}
+
 @app.route('/exam/generate', methods=['POST'])
 def generate_exam():
     """根據指定檔案出題"""
     try:
         data = request.get_json()
         file_name = data.get('file_name')
-        num_questions = data.get('num_questions', 5)
-        if not file_name:
-            return jsonify({'success': False, 'error': '請指定檔案名稱'})
-        file_path = os.path.join('data', file_name)
-        if not os.path.exists(file_path):
-            return jsonify({'success': False, 'error': '檔案不存在'})
-        # 讀取檔案內容
-        file_text = read_file_content(file_path)
-        if not file_text:
-            return jsonify({'success': False, 'error': '檔案內容為空或讀取失敗'})
-        # 切分內容
-        chunks = [file_text[i:i+500] for i in range(0, len(file_text), 500)]
-        if len(chunks) > num_questions:
-            chunks = random.sample(chunks, num_questions)
-        # 生成題目
-        content_text = "\n\n".join([f"內容 {i+1}: {chunk}" for i, chunk in enumerate(chunks)])
-        prompt = f"""
-請基於以下內容生成 {num_questions} 道考試題目。每道題目包含：
-1. 題目內容
-2. 題目類型（choice: 選擇題, fill: 填空題, short: 簡答題, true_false: 是非題）
-3. 正確答案
-4. 選項（如果是選擇題）
-5. 解析
-內容：
-{content_text}
-請以 JSON 格式返回，格式如下：
-{{
-    "questions": [
-        {{
-            "id": 1,
-            "type": "choice",
-            "question": "題目內容",
-            "options": ["A. 選項1", "B. 選項2", "C. 選項3", "D. 選項4"],
-            "correct_answer": "A",
-            "explanation": "解析說明"
-        }}
-    ]
-}}
-"""
-        response = rag_system.model.generate_content(prompt)
-        response_text = response.text
+        prepared = prepare_exam(file_name, data.get('num_questions', 5))
+        if 'prompt' not in prepared:
+            return jsonify(prepared)
         try:
-            start_idx = response_text.find('{')
-            end_idx = response_text.rfind('}') + 1
-            json_str = response_text[start_idx:end_idx]
-            result = json.loads(json_str)
-            questions = result.get('questions', [])
-            for i, question in enumerate(questions):
-                question['id'] = i + 1
-            return jsonify({'success': True, 'questions': questions, 'total_questions': len(questions)})
-        except Exception as e:
-            return jsonify({'success': False, 'error': f'題目解析失敗: {str(e)}', 'raw': response_text})
+            response_text = get_rag_system().llm.generate(prepared['prompt'], operation='exam_generate')
+        except LLMError as e:
+            return jsonify(llm_unavailable_response(e))
+        return jsonify(finish_exam(file_name, response_text))
     except Exception as e:
         return jsonify({'success': False, 'error': f'生成考試時發生錯誤: {str(e)}'})
 
@@ -164,100 +266,111 @@ def grade_exam():
         if not questions:
             return jsonify({'success': False, 'error': '沒有題目可以評分'})
         
-        results = []
-        total_score = 0
-        correct_count = 0
+        # 簡答題先一起送出 AI 評分
+        short_scores = grade_short_answers(short_answer_items(questions, answers))
+        return jsonify(grade_answers(questions, answers, short_scores))
         
-        for question in questions:
-            question_id = question['id']
-            user_answer = answers.get(str(question_id), '').strip()
-            correct_answer = question['correct_answer']
-            question_type = question['type']
-            
-            # 評分邏輯
-            score = 0
-            is_correct = False
+    except Exception as e:
+        return jsonify({'success': False, 'error': f'評分時發生錯誤: {str(e)}'})
+
+def short_answer_items(questions: List[Dict[str, Any]], answers: Dict[str, str]) -> List[Tuple[int, str, str, str]]:
+    """取出需要 AI 評分的簡答題：[(題目位置, 題目, 標準答案, 學生答案), ...]"""
+    return [
+        (position, question['question'], question['correct_answer'],
+         answers.get(str(question['id']), '').strip())
+        for position, question in enumerate(questions)
+        if question['type'] == 'short'
+    ]
+
+def grade_answers(questions: List[Dict[str, Any]], answers: Dict[str, str],
+                  short_scores: Dict[int, Tuple[int, bool]]) -> Dict[str, Any]:
+    """
+    評分整份考卷
+    
+    Args:
+        questions: 題目列表
+        answers: {題目 ID: 學生答案}
+        short_scores: 簡答題的 AI 評分結果 {題目位置: (分數, 是否正確)}
+    
+    Returns:
+        評分結果與統計資訊
+    """
+    results = []
+    total_score = 0
+    correct_count = 0
+    
+    for position, question in enumerate(questions):
+        question_id = question['id']
+        user_answer = answers.get(str(question_id), '').strip()
+        correct_answer = question['correct_answer']
+        question_type = question['type']
+        
+        # 評分邏輯
+        score = 0
+        is_correct = False
+        
+        if question_type == 'choice':
+            # 選擇題：完全匹配
+            is_correct = user_answer == correct_answer
+            score = 10 if is_correct else 0
             
-            if question_type == 'choice':
-                # 選擇題：完全匹配
-                is_correct = user_answer == correct_answer
-                score = 10 if is_correct else 0
-                
-            elif question_type == 'true_false':
-                # 是非題：完全匹配
-                is_correct = user_answer == correct_answer
-                score = 10 if is_correct else 0
-                
-            elif question_type == 'fill':
-                # 填空題：模糊匹配
-                is_correct = fuzzy_match(user_answer, correct_answer)
-                score = 10 if is_correct else 0
-                
-            elif question_type == 'short':
-                # 簡答題：AI 評分
-                score, is_correct = ai_grade_short_answer(
-                    question['question'], 
-                    correct_answer, 
-                    user_answer
-                )
+        elif question_type == 'true_false':
+            # 是非題：完全匹配
+            is_correct = user_answer == correct_answer
+            score = 10 if is_correct else 0
             
-            if is_correct:
-                correct_count += 1
-            total_score += score
+        elif question_type == 'fill':
+            # 填空題：模糊匹配
+            is_correct = fuzzy_match(user_answer, correct_answer)
+            score = 10 if is_correct else 0
             
-            results.append({
-                'question': question,
-                'user_answer': user_answer,
-                'correct_answer': correct_answer,
-                'is_correct': is_correct,
-                'score': score,
-                'explanation': question.get('explanation', '')
-            })
-        
-        # 計算統計資訊
-        total_questions = len(questions)
-        accuracy = (correct_count / total_questions) * 100 if total_questions > 0 else 0
-        average_score = total_score / total_questions if total_questions > 0 else 0
+        elif question_type == 'short':
+            # 簡答題：AI 評分（已並行完成）
+            score, is_correct = short_scores[position]
         
-        statistics = {
-            'total_questions': total_questions,
-            'correct_answers': correct_count,
-            'accuracy': accuracy,
-            'average_score': average_score
-        }
+        if is_correct:
+            correct_count += 1
+        total_score += score
         
-        return jsonify({
-            'success': True,
-            'results': results,
-            'statistics': statistics
+        results.append({
+            'question': question,
+            'user_answer': user_answer,
+            'correct_answer': correct_answer,
+            'is_correct': is_correct,
+            'score': score,
+            'explanation': question.get('explanation', '')
         })
-        
-    except Exception as e:
-        return jsonify({'success': False, 'error': f'評分時發生錯誤: {str(e)}'})
+    
+    # 計算統計資訊
+    total_questions = len(questions)
+    accuracy = (correct_count / total_questions) * 100 if total_questions > 0 else 0
+    average_score = total_score / total_questions if total_questions > 0 else 0
+    
+    statistics = {
+        'total_questions': total_questions,
+        'correct_answers': correct_count,
+        'accuracy': accuracy,
+        'average_score': average_score
+    }
+    
+    return {
+        'success': True,
+        'results': results,
+        'statistics': statistics
+    }
 
 def read_file_content(file_path: str) -> str:
-    """根據檔案類型讀取檔案內容"""
+    """讀取檔案內容（經過解析快取，檔案未變更時不會重新解析）"""
+    return document_cache.get_text(file_path)
+
+def extract_file_content(file_path: str) -> str:
+    """根據檔案類型解析檔案內容"""
     file_extension = os.path.splitext(file_path)[1].lower()
     
     if file_extension == '.pdf':
         try:
-            content = ""
-            # 嘗試使用 pdfplumber
-            try:
-                with pdfplumber.open(file_path) as pdf:
-                    for page in pdf.pages:
-                        page_text = page.extract_text()
-                        if page_text:
-                            content += page_text + "\n"
-            except Exception as e:
-                # 備用方案：使用 PyPDF2
-                with open(file_path, 'rb') as file:
-                    pdf_reader = PyPDF2.PdfReader(file)
-                    for page in pdf_reader.pages:
-                        page_text = page.extract_text()
-                        if page_text:
-                            content += page_text + "\n"
-            return content.strip()
+            # 逐頁解析（pdfplumber 失敗的頁面改用 PyPDF2）
+            return "\n".join(page_text for _, page_text in iter_pdf_pages(file_path) if page_text).strip()
         except Exception as e:
             print(f"讀取 PDF 檔案時發生錯誤: {str(e)}")
             return ""
@@ -272,6 +385,90 @@ def read_file_content(file_path: str) -> str:
         print(f"不支援的檔案格式: {file_extension}")
         return ""
 
+# 文件解析快取（記憶體 + 磁碟）
+document_cache = DocumentCache(
+    extract_file_content,
+    cache_dir=os.getenv('DOCUMENT_CACHE_DIR', os.path.join('cache', 'documents'))
+)
+
+metrics.REGISTRY.register_collector('document_cache', lambda: metrics.cache_samples({
+    'document': document_cache.stats()
+}))
+clients.register_metrics()
+
+# 預先生成的題庫與背景補題器（需要 Gemini，第一次出題或 warm_up() 時啟動）
+question_bank = QuestionBank(os.getenv('QUESTION_BANK_DIR', 'question_bank'))
+question_bank_builder = None
+
+def generate_question_bank_text(rag_system: RAGSystem, prompt: str) -> str:
+    """背景補題的 Gemini 呼叫（不使用對沖請求，避免背景工作加重 Gemini 負載）"""
+    return rag_system.llm.generate(prompt, operation='question_bank', hedge=False)
+
+def get_question_bank_builder() -> Optional[QuestionBankBuilder]:
+    """取得背景補題器，尚未啟動時啟動；題庫停用或 RAG 系統無法使用時返回 None"""
+    global question_bank_builder
+    if question_bank_builder is None and os.getenv('QUESTION_BANK_ENABLED', 'true').lower() == 'true':
+        rag_system = get_rag_system()
+        if not rag_system:
+            return None
+        with _rag_system_lock:
+            if question_bank_builder is None:
+                question_bank_builder = QuestionBankBuilder(
+                    question_bank,
+                    document_cache,
+                    lambda prompt: generate_question_bank_text(rag_system, prompt),
+                    target_size=int(os.getenv('QUESTION_BANK_TARGET', '30')),
+                    low_watermark=int(os.getenv('QUESTION_BANK_LOW_WATERMARK', '10'))
+                )
+                if os.getenv('QUESTION_BANK_PREFILL', 'true').lower() == 'true':
+                    question_bank_builder.prefill()
+    return question_bank_builder
+
+def preload():
+    """
+    pre-fork 主程序：建立 RAG 系統並載入嵌入模型權重，fork 後各 worker 以 copy-on-write 共用。
+    不初始化 Gemini、不執行編碼、不啟動背景執行緒（執行緒與 gRPC 連線無法跨 fork 使用）
+    """
+    rag_system = get_rag_system()
+    if rag_system:
+        rag_system.warm_up(gemini=False, encode=False)
+
+def init_worker(torch_threads: int = 0):
+    """
+    fork 後在每個 worker 中執行：重建網路連線、設定 torch 執行緒數、開始寫入指標快照，並在背景預熱與啟動題庫補題
+    
+    Args:
+        torch_threads: 每個 worker 的 torch 運算執行緒數，0 表示不變更
+    """
+    set_num_threads(torch_threads)
+    if rag_system:
+        rag_system.reset_after_fork()
+    # 各 worker 的指標從 0 開始，合併時不會重複計入主程序預先載入時的數值
+    metrics.REGISTRY.reset()
+    metrics.start_snapshot_writer()
+    warm_up()
+
+def warm_up(background: bool = True):
+    """
+    建立 RAG 系統、載入模型並啟動題庫補題
+    
+    Args:
+        background: 是否在背景執行緒執行（伺服器可以先開始接受請求）
+    """
+    def run():
+        rag_system = get_rag_system()
+        if rag_system:
+            try:
+                rag_system.warm_up()
+            except Exception as e:
+                print(f"⚠️ 模型預熱失敗: {str(e)}")
+        get_question_bank_builder()
+    
+    if background:
+        threading.Thread(target=run, name='warm-up', daemon=True).start()
+    else:
+        run()
+
 @app.route('/read/content', methods=['POST'])
 def read_content():
     """讀取檔案內容"""
@@ -287,7 +484,8 @@ def read_content():
             return jsonify({'success': False, 'error': '檔案不存在'})
         
         # 讀取檔案內容
-        content = read_file_content(file_path)
+        with stage_timer('file_read'):
+            content = read_file_content(file_path)
         
         if not content:
             return jsonify({'success': False, 'error': '檔案內容為空或讀取失敗'})
@@ -326,10 +524,51 @@ def fuzzy_match(user_answer: str, correct_answer: str) -> bool:
     
     return False
 
-def ai_grade_short_answer(question: str, correct_answer: str, user_answer: str) -> tuple:
-    """使用 AI 評分簡答題"""
-    try:
-        prompt = f"""
+def grade_short_answers(items: List[Tuple[int, str, str, str]],
+                        deadline_seconds: float = None) -> Dict[int, Tuple[int, bool]]:
+    """
+    並行評分簡答題
+    
+    Args:
+        items: [(題目位置, 題目, 標準答案, 學生答案), ...]
+        deadline_seconds: 整份考卷的評分期限，逾時的題目改用簡單評分
+    
+    Returns:
+        {題目位置: (分數, 是否正確)}
+    """
+    if deadline_seconds is None:
+        deadline_seconds = GRADING_DEADLINE_SECONDS
+    deadline = time.monotonic() + deadline_seconds
+    
+    # LLM 熔斷中：不必送出評分工作，全部直接使用簡單評分
+    rag_system = get_rag_system()
+    if rag_system is None or not rag_system.llm.available:
+        scores = {}
+        for position, question, correct_answer, user_answer in items:
+            score = simple_grade_short_answer(question, correct_answer, user_answer)
+            scores[position] = (score, score >= 7)
+        return scores
+    
+    futures = {
+        position: grading_executor.submit(ai_grade_short_answer, question, correct_answer, user_answer, deadline)
+        for position, question, correct_answer, user_answer in items
+    }
+    
+    scores = {}
+    for position, question, correct_answer, user_answer in items:
+        future = futures[position]
+        try:
+            scores[position] = future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except Exception:
+            # 超過期限：放棄等待 AI 評分，改用簡單評分
+            future.cancel()
+            score = simple_grade_short_answer(question, correct_answer, user_answer)
+            scores[position] = (score, score >= 7)
+    return scores
+
+def build_grading_prompt(question: str, correct_answer: str, user_answer: str) -> str:
+    """簡答題評分提示詞"""
+    return f"""
 請評分以下簡答題：
 
 題目：{question}
@@ -346,21 +585,38 @@ def ai_grade_short_answer(question: str, correct_answer: str, user_answer: str)
 
 請只返回分數（0-10的整數），不要其他文字。
 """
-        
-        response = rag_system.model.generate_content(prompt)
-        score_text = response.text.strip()
-        
-        # 嘗試提取分數
-        try:
-            score = int(score_text)
-            score = max(0, min(10, score))  # 確保分數在0-10範圍內
-        except ValueError:
-            # 如果無法解析分數，使用簡單的關鍵詞匹配
-            score = simple_grade_short_answer(question, correct_answer, user_answer)
-        
-        is_correct = score >= 7  # 7分以上視為正確
-        
-        return score, is_correct
+
+def parse_grading_score(score_text: str, question: str, correct_answer: str, user_answer: str) -> tuple:
+    """將 AI 返回的分數轉為 (分數, 是否正確)，無法解析時使用簡單評分"""
+    # 嘗試提取分數
+    try:
+        score = int(score_text.strip())
+        score = max(0, min(10, score))  # 確保分數在0-10範圍內
+    except ValueError:
+        # 如果無法解析分數，使用簡單的關鍵詞匹配
+        score = simple_grade_short_answer(question, correct_answer, user_answer)
+    
+    is_correct = score >= 7  # 7分以上視為正確
+    
+    return score, is_correct
+
+def ai_grade_short_answer(question: str, correct_answer: str, user_answer: str,
+                          deadline_at: float = None) -> tuple:
+    """
+    使用 AI 評分簡答題
+    
+    Args:
+        deadline_at: 整份考卷評分期限的 time.monotonic() 時間點，未指定時為現在起 GRADING_DEADLINE_SECONDS 秒
+    """
+    try:
+        prompt = build_grading_prompt(question, correct_answer, user_answer)
+        # 重試只用整份考卷剩餘的評分時間（在執行緒池排隊的時間也算在內）；熔斷時立即失敗並改用簡單評分
+        remaining = (deadline_at - time.monotonic()) if deadline_at is not None else GRADING_DEADLINE_SECONDS
+        if remaining <= 0:
+            raise TimeoutError("評分期限已過")
+        score_text = get_rag_system().llm.generate(prompt, operation='grade_short_answer',
+                                                   deadline=remaining)
+        return parse_grading_score(score_text, question, correct_answer, user_answer)
         
     except Exception as e:
         # 如果 AI 評分失敗，使用簡單評分
@@ -397,13 +653,23 @@ def simple_grade_short_answer(question: str, correct_answer: str, user_answer: s
     else:
         return 2
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus 指標（各階段耗時、請求耗時、LLM 呼叫與 token 數、快取命中率）"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
 @app.route('/health')
 def health():
     """健康檢查端點"""
     return jsonify({
         'status': 'healthy',
-        'rag_system_ready': rag_system is not None
+        'rag_system_ready': rag_system is not None,
+        'models_loaded': rag_system is not None and rag_system.is_warm
     })
 
 if __name__ == '__main__':
+    # debug 模式下只在實際提供服務的重新載入子程序中預熱
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true' and \
+            os.getenv('WARM_UP_ON_START', 'true').lower() == 'true':
+        warm_up()
     app.run(debug=True, host='0.0.0.0', port=5002) 
\ No newline at end of file
@@ -0,0 +1,238 @@
+# ASGI 入口（python run.py --asgi，或 uvicorn asgi:app）
+# /query、/exam/generate、/exam/grade 以 asyncio 處理：Gemini 呼叫以非同步 API 等待、不佔用執行緒，
+# 嵌入編碼、向量搜尋與 PDF 解析等阻塞或 CPU 密集的工作交給執行緒池，
+# 因此單一程序可以同時等待數百個 Gemini 回應，不再受限於 worker 執行緒數。
+# 其餘路由（首頁、串流查詢、閱讀中心、/metrics…）原封不動交給 Flask app（a2wsgi 在執行緒池中執行）
+# 請求剖析（X-Profile）：Flask 路由沿用 app.py 的 before_request，非同步路由由 ProfilingMiddleware 處理
+
+import os
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Tuple
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.datastructures import MutableHeaders
+from starlette.middleware import Middleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+
+import app as web
+import metrics
+from llm_client import LLMError
+
+# 阻塞工作（檢索、讀取檔案）的執行緒數與 Flask 路由的執行緒數
+BLOCKING_THREADS = int(os.getenv('ASGI_BLOCKING_THREADS', '32'))
+WSGI_THREADS = int(os.getenv('ASGI_WSGI_THREADS', '16'))
+
+
+# 由非同步路由處理的路徑（其他路徑交給 Flask）
+ASYNC_PATHS = ('/query', '/exam/generate', '/exam/grade')
+
+
+class ProfilingMiddleware:
+    """
+    非同步路由的請求剖析（與 app.py 的 before_request 使用同一個 RequestProfiler）
+    剖析對象為事件迴圈執行緒與 asgi-blocking 執行緒；同時進行的其他非同步請求也會出現在取樣結果中
+    """
+
+    def __init__(self, app, profiler, paths=ASYNC_PATHS):
+        self.app = app
+        self.profiler = profiler
+        self.paths = set(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not self.profiler.enabled or scope['path'] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        request = Request(scope)
+        mode = self.profiler.requested_mode(request.headers, request.query_params)
+        if mode is None:
+            await self.app(scope, receive, send)
+            return
+
+        session = self.profiler.start(mode, scope['path'])
+
+        async def send_with_profile_path(message):
+            if message['type'] == 'http.response.start':
+                MutableHeaders(scope=message).append('X-Profile-Path', session.path)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_profile_path)
+        finally:
+            # cProfile 必須在啟動它的執行緒（事件迴圈）停止
+            try:
+                session.stop()
+            except Exception as e:
+                print(f"⚠️ 寫入剖析檔案失敗: {str(e)}")
+
+
+def timed(endpoint: str):
+    """記錄非同步路由的請求耗時（與 Flask 路由相同的 http_request_duration_seconds）"""
+    def decorator(handler):
+        async def wrapper(request: Request):
+            started = time.perf_counter()
+            response = await handler(request)
+            metrics.REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint,
+                                            method=request.method, status=response.status_code)
+            return response
+        return wrapper
+    return decorator
+
+
+async def read_json(request: Request) -> Dict[str, Any]:
+    try:
+        data = await request.json()
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+@timed('/query')
+async def query(request: Request) -> JSONResponse:
+    """處理查詢請求（非同步版）"""
+    try:
+        data = await read_json(request)
+        user_query = data.get('query', '').strip()
+
+        if not user_query:
+            return JSONResponse({'success': False, 'error': '請輸入查詢內容'})
+
+        rag_system = await asyncio.to_thread(web.get_rag_system)
+        if not rag_system:
+            return JSONResponse({
+                'success': False,
+                'error': 'RAG 系統未正確初始化。請先執行 python init_db.py 來初始化資料庫。'
+            })
+
+        result = await rag_system.aquery(user_query, top_k=3, similarity_threshold=0.4)
+
+        return JSONResponse({
+            'success': True,
+            'query': user_query,
+            'answer': result['answer'],
+            'retrieved_chunks': result['retrieved_chunks'],
+            'has_context': len(result['retrieved_chunks']) > 0,
+            'cached': result.get('cached', False),
+            'fallback': result.get('fallback'),
+            'context_stats': result.get('context_stats')
+        })
+    except Exception as e:
+        return JSONResponse({'success': False, 'error': f'查詢過程中發生錯誤: {str(e)}'})
+
+
+@timed('/exam/generate')
+async def generate_exam(request: Request) -> JSONResponse:
+    """根據指定檔案出題（非同步版）"""
+    try:
+        data = await read_json(request)
+        file_name = data.get('file_name')
+        prepared = await asyncio.to_thread(web.prepare_exam, file_name, data.get('num_questions', 5))
+        if 'prompt' not in prepared:
+            return JSONResponse(prepared)
+        try:
+            response_text = await web.get_rag_system().llm.agenerate(prepared['prompt'], operation='exam_generate')
+        except LLMError as e:
+            return JSONResponse(web.llm_unavailable_response(e))
+        return JSONResponse(await asyncio.to_thread(web.finish_exam, file_name, response_text))
+    except Exception as e:
+        return JSONResponse({'success': False, 'error': f'生成考試時發生錯誤: {str(e)}'})
+
+
+async def grade_short_answers(items: List[Tuple[int, str, str, str]],
+                              deadline_seconds: float = None) -> Dict[int, Tuple[int, bool]]:
+    """
+    並行評分簡答題（非同步版，與 app.grade_short_answers 相同的期限與備援）
+
+    Args:
+        items: [(題目位置, 題目, 標準答案, 學生答案), ...]
+        deadline_seconds: 整份考卷的評分期限，逾時的題目改用簡單評分
+
+    Returns:
+        {題目位置: (分數, 是否正確)}
+    """
+    if deadline_seconds is None:
+        deadline_seconds = web.GRADING_DEADLINE_SECONDS
+    deadline_at = time.monotonic() + deadline_seconds
+    rag_system = web.rag_system
+
+    def simple(question: str, correct_answer: str, user_answer: str) -> Tuple[int, bool]:
+        score = web.simple_grade_short_answer(question, correct_answer, user_answer)
+        return score, score >= 7
+
+    async def grade(question: str, correct_answer: str, user_answer: str) -> Tuple[int, bool]:
+        try:
+            prompt = web.build_grading_prompt(question, correct_answer, user_answer)
+            # 重試只用整份考卷剩餘的評分時間
+            score_text = await rag_system.llm.agenerate(prompt, operation='grade_short_answer',
+                                                        deadline=max(0.0, deadline_at - time.monotonic()))
+            return web.parse_grading_score(score_text, question, correct_answer, user_answer)
+        except Exception:
+            return simple(question, correct_answer, user_answer)
+
+    # LLM 熔斷中：全部直接使用簡單評分
+    if rag_system is None or not rag_system.llm.available:
+        return {position: simple(question, correct_answer, user_answer)
+                for position, question, correct_answer, user_answer in items}
+
+    tasks = {position: asyncio.ensure_future(grade(question, correct_answer, user_answer))
+             for position, question, correct_answer, user_answer in items}
+    if tasks:
+        await asyncio.wait(tasks.values(), timeout=max(0.0, deadline_at - time.monotonic()))
+    scores = {}
+    for position, question, correct_answer, user_answer in items:
+        task = tasks[position]
+        if task.done():
+            scores[position] = task.result()
+        else:
+            # 超過期限：放棄等待 AI 評分，改用簡單評分
+            task.cancel()
+            scores[position] = simple(question, correct_answer, user_answer)
+    return scores
+
+
+@timed('/exam/grade')
+async def grade_exam(request: Request) -> JSONResponse:
+    """評分考試（非同步版）"""
+    try:
+        data = await read_json(request)
+        questions = data.get('questions', [])
+        answers = data.get('answers', {})
+
+        if not questions:
+            return JSONResponse({'success': False, 'error': '沒有題目可以評分'})
+
+        if web.rag_system is None:
+            await asyncio.to_thread(web.get_rag_system)
+        short_scores = await grade_short_answers(web.short_answer_items(questions, answers))
+        return JSONResponse(web.grade_answers(questions, answers, short_scores))
+    except Exception as e:
+        return JSONResponse({'success': False, 'error': f'評分時發生錯誤: {str(e)}'})
+
+
+@asynccontextmanager
+async def lifespan(_app: Starlette):
+    # asyncio.to_thread 與 run_in_executor(None, ...) 使用的執行緒池
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=BLOCKING_THREADS, thread_name_prefix='asgi-blocking'))
+    # 多個 Uvicorn worker 時由 run.py 設定 METRICS_MULTIPROC_DIR，/metrics 合併各 worker 的指標
+    metrics.start_snapshot_writer()
+    if os.getenv('WARM_UP_ON_START', 'true').lower() == 'true':
+        web.warm_up()
+    yield
+
+
+app = Starlette(
+    routes=[
+        Route('/query', query, methods=['POST']),
+        Route('/exam/generate', generate_exam, methods=['POST']),
+        Route('/exam/grade', grade_exam, methods=['POST']),
+        Mount('/', app=WSGIMiddleware(web.app, workers=WSGI_THREADS)),
+    ],
+    middleware=[Middleware(ProfilingMiddleware, profiler=web.request_profiler)],
+    lifespan=lifespan
+)
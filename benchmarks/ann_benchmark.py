@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+近似最近鄰（IVF）索引基準測試
+以 vectorStore.chunk_text 切出的教材文字塊為語料，比較 IVF 與精確搜尋的 recall@k 與查詢延遲
+
+使用方式:
+    python benchmarks/ann_benchmark.py
+    python benchmarks/ann_benchmark.py --scale 200000 --nprobe 1,4,8,16,32
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from vector_index import LocalVectorIndex, IVFVectorIndex, _normalize_rows
+
+
+def load_corpus_embeddings(data_dir: str, chunk_size: int, chunk_overlap: int) -> np.ndarray:
+    """讀取 data 目錄下的教材，分塊並生成嵌入向量"""
+    from vectorStore import read_file, chunk_text, generate_embeddings
+
+    chunks = []
+    for file_name in sorted(os.listdir(data_dir)):
+        if file_name.endswith(('.txt', '.pdf')):
+            text = read_file(os.path.join(data_dir, file_name))
+            chunks.extend(chunk_text(text, chunk_size=chunk_size, chunk_overlap=chunk_overlap))
+    if not chunks:
+        raise SystemExit(f"❌ {data_dir} 中沒有可用的教材")
+    print(f"📚 共 {len(chunks)} 個文字塊，正在生成嵌入向量...")
+    return _normalize_rows(np.asarray(generate_embeddings(chunks), dtype=np.float32))
+
+
+def scale_corpus(base: np.ndarray, target: int, noise: float, rng) -> np.ndarray:
+    """以原始向量加上高斯雜訊擴充語料規模，模擬整份課程綱要的文字塊數量"""
+    if target <= base.shape[0]:
+        return base
+    extra = base[rng.integers(0, base.shape[0], size=target - base.shape[0])]
+    extra = extra + rng.normal(0, noise, size=extra.shape).astype(np.float32)
+    return np.vstack([base, _normalize_rows(extra)])
+
+
+def percentile_ms(samples, q: float) -> float:
+    return float(np.percentile(samples, q) * 1000)
+
+
+def run_queries(index, queries: np.ndarray, top_k: int, **kwargs):
+    """執行查詢並回傳 (每筆查詢結果 id 集合列表, 每筆延遲秒數列表)"""
+    results, latencies = [], []
+    for query_vector in queries:
+        start = time.perf_counter()
+        matches = index.query(query_vector, top_k=top_k, include_metadata=False, **kwargs)['matches']
+        latencies.append(time.perf_counter() - start)
+        results.append({match['id'] for match in matches})
+    return results, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="IVF 近似最近鄰索引基準測試")
+    parser.add_argument('--data-dir', default=os.path.join(ROOT_DIR, 'data'))
+    parser.add_argument('--chunk-size', type=int, default=500)
+    parser.add_argument('--chunk-overlap', type=int, default=50)
+    parser.add_argument('--scale', type=int, default=100000, help="擴充後的向量數量")
+    parser.add_argument('--noise', type=float, default=0.05, help="擴充向量的雜訊標準差")
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--nlist', type=int, default=0, help="群集數量，0 表示自動")
+    parser.add_argument('--nprobe', default="1,4,8,16,32", help="以逗號分隔的 nprobe 掃描值")
+    parser.add_argument('--train-iters', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', dest='json_path', help="將結果另存為 JSON")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    base = load_corpus_embeddings(args.data_dir, args.chunk_size, args.chunk_overlap)
+    vectors = scale_corpus(base, args.scale, args.noise, rng)
+    ids = [str(i) for i in range(vectors.shape[0])]
+    metadata = [{} for _ in ids]
+
+    # 查詢向量：從原始文字塊抽樣並加上雜訊，模擬與教材相近但不完全相同的問題
+    query_rows = rng.integers(0, base.shape[0], size=args.queries)
+    queries = _normalize_rows(base[query_rows] + rng.normal(
+        0, args.noise, size=(args.queries, base.shape[1])).astype(np.float32))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        exact = LocalVectorIndex(os.path.join(tmp_dir, 'exact'), dimension=vectors.shape[1])
+        exact.upsert_arrays(ids, vectors, metadata)
+        ivf = IVFVectorIndex(os.path.join(tmp_dir, 'ivf'), dimension=vectors.shape[1],
+                             nlist=args.nlist or None, train_iters=args.train_iters,
+                             exact_threshold=0, seed=args.seed)
+        ivf.upsert_arrays(ids, vectors, metadata)
+        ivf.flush()
+
+        start = time.perf_counter()
+        ivf.build()
+        build_seconds = time.perf_counter() - start
+        nlist = ivf.describe_index_stats()['nlist']
+        print(f"🧭 IVF 建立完成：{vectors.shape[0]} 個向量，nlist={nlist}，耗時 {build_seconds:.2f}s")
+
+        truth, exact_latencies = run_queries(exact, queries, args.top_k)
+        report = {
+            'vectors': int(vectors.shape[0]),
+            'dimension': int(vectors.shape[1]),
+            'queries': args.queries,
+            'top_k': args.top_k,
+            'nlist': int(nlist),
+            'build_seconds': build_seconds,
+            'exact': {
+                'p50_ms': percentile_ms(exact_latencies, 50),
+                'p99_ms': percentile_ms(exact_latencies, 99)
+            },
+            'ivf': []
+        }
+
+        print("=" * 60)
+        print(f"{'搜尋方式':<12}{'recall@' + str(args.top_k):>12}{'p50 (ms)':>12}{'p99 (ms)':>12}")
+        print("-" * 60)
+        print(f"{'exact':<12}{1.0:>12.4f}{report['exact']['p50_ms']:>12.3f}"
+              f"{report['exact']['p99_ms']:>12.3f}")
+        for nprobe in [int(value) for value in args.nprobe.split(',') if value]:
+            found, latencies = run_queries(ivf, queries, args.top_k, nprobe=nprobe)
+            recall = float(np.mean([len(f & t) / max(1, len(t)) for f, t in zip(found, truth)]))
+            row = {
+                'nprobe': nprobe,
+                'recall': recall,
+                'p50_ms': percentile_ms(latencies, 50),
+                'p99_ms': percentile_ms(latencies, 99)
+            }
+            report['ivf'].append(row)
+            print(f"{'ivf/' + str(nprobe):<12}{recall:>12.4f}{row['p50_ms']:>12.3f}{row['p99_ms']:>12.3f}")
+        print("=" * 60)
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"✅ 結果已儲存到 {args.json_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+元件微基準測試（離線）
+以 benchmarks/fakes.py 的假向量索引與假 Gemini 模型（可注入延遲）取代外部服務，量測：
+  chunk_text、generate_embeddings、read_pdf_file、retrieve_similar_chunks、format_context、
+  fuzzy_match、simple_grade_short_answer、grade_exam（/exam/grade）與完整的 RAG 查詢
+結果以 JSON 輸出，並與儲存的基準比較；任一項目的最小值（--statistic）比基準慢超過 --tolerance，
+且差距超過 --min-delta-ms 時以非零狀態碼結束（微秒級項目的排程雜訊不會被誤判為退步）
+
+使用方式:
+    python benchmarks/component_benchmark.py
+    python benchmarks/component_benchmark.py --embedder real --json results.json
+    python benchmarks/component_benchmark.py --save-baseline          # 更新 benchmarks/baseline.json
+    python benchmarks/component_benchmark.py --only chunk_text,fuzzy_match --tolerance 0.5
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import statistics
+import tempfile
+import contextlib
+from typing import Callable, Dict, Any, List
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+from fakes import FakeEmbeddingModel, FakeVectorIndex, FakeGeminiModel
+
+
+def install_embedder(kind: str) -> str:
+    """準備嵌入模型：real 為實際模型（無法載入時改用假模型），fake 為確定性的假模型"""
+    import embeddings
+    key = (embeddings.get_backend_name(), embeddings.EMBEDDING_MODEL_NAME)
+    if kind == 'real':
+        try:
+            embeddings.get_embedding_model()
+            return 'real'
+        except Exception as e:
+            print(f"⚠️ 無法載入嵌入模型，改用假模型: {str(e)}")
+    embeddings._models[key] = FakeEmbeddingModel()
+    return 'fake'
+
+
+def load_corpus(data_dir: str) -> Dict[str, Any]:
+    """讀取 data 目錄中的 TXT 教材並分塊，另記錄第一個 PDF 檔案"""
+    from vectorStore import read_text_file, chunk_text, make_chunk_ids
+
+    texts, chunks, pdf_path = {}, [], None
+    for file_name in sorted(os.listdir(data_dir)):
+        path = os.path.join(data_dir, file_name)
+        if file_name.endswith('.txt'):
+            texts[file_name] = read_text_file(path)
+            file_chunks = chunk_text(texts[file_name])
+            for i, (chunk_id, chunk) in enumerate(zip(make_chunk_ids(file_name, file_chunks), file_chunks)):
+                chunks.append({'id': chunk_id, 'text': chunk,
+                               'metadata': {'source_file': file_name, 'chunk_index': i, 'text': chunk}})
+        elif file_name.endswith('.pdf') and pdf_path is None:
+            pdf_path = path
+    if not chunks:
+        raise SystemExit(f"❌ {data_dir} 中沒有 TXT 教材")
+    return {'texts': texts, 'chunks': chunks, 'pdf_path': pdf_path}
+
+
+def build_rag_system(corpus: Dict[str, Any], work_dir: str, args):
+    """建立使用假索引與假 Gemini 的 RAGSystem（停用查詢向量快取，每次都實際編碼）"""
+    from rag_system import RAGSystem
+    from vectorStore import generate_embeddings
+    from embedding_cache import EmbeddingCache
+    from lexical_index import LexicalIndex
+
+    rag = RAGSystem(None, 'offline', vector_backend='local', local_index_path=os.path.join(work_dir, 'local'))
+    rag.index = FakeVectorIndex(latency_ms=args.index_latency_ms)
+    vectors = generate_embeddings([chunk['text'] for chunk in corpus['chunks']])
+    rag.index.upsert([{'id': chunk['id'], 'values': vector, 'metadata': chunk['metadata']}
+                      for chunk, vector in zip(corpus['chunks'], vectors)])
+    rag.model = FakeGeminiModel(latency_ms=args.llm_latency_ms, token_latency_ms=args.llm_token_latency_ms)
+    rag.embedding_cache = EmbeddingCache(maxsize=0)
+
+    rag.lexical_index = None
+    if not args.no_hybrid:
+        lexical_index = LexicalIndex(os.path.join(work_dir, 'lexical'))
+        by_file: Dict[str, List[Dict[str, Any]]] = {}
+        for chunk in corpus['chunks']:
+            by_file.setdefault(chunk['metadata']['source_file'], []).append(chunk)
+        for source_file, file_chunks in by_file.items():
+            lexical_index.set_file(source_file, [chunk['id'] for chunk in file_chunks],
+                                   [chunk['metadata'] for chunk in file_chunks])
+        lexical_index.save()
+        rag.lexical_index = lexical_index
+    return rag
+
+
+def make_exam(corpus: Dict[str, Any], rng: random.Random):
+    """以教材句子組成一份 10 題考卷（含 3 題簡答題）與作答"""
+    sentences = [chunk['text'][:60] for chunk in corpus['chunks']]
+    questions, answers = [], {}
+    for i, question_type in enumerate(['choice'] * 3 + ['true_false'] * 2 + ['fill'] * 2 + ['short'] * 3):
+        correct = {'choice': 'A', 'true_false': '是'}.get(question_type, rng.choice(sentences))
+        questions.append({'id': i + 1, 'type': question_type, 'question': f"第 {i + 1} 題",
+                          'correct_answer': correct, 'explanation': ''})
+        answers[str(i + 1)] = correct if rng.random() < 0.5 else rng.choice(sentences)
+    return questions, answers
+
+
+def define_cases(corpus: Dict[str, Any], rag, args) -> Dict[str, Dict[str, Any]]:
+    """
+    定義測試項目
+
+    Returns:
+        {名稱: {'fn': 執行一次的函式, 'number': 每次執行包含的操作數}}
+    """
+    import app as app_module
+    from vectorStore import chunk_text, generate_embeddings, read_pdf_file
+
+    rng = random.Random(0)
+    longest_text = max(corpus['texts'].values(), key=len)
+    chunk_texts = [chunk['text'] for chunk in corpus['chunks']]
+    embed_batch = chunk_texts[:args.embed_batch_size]
+    queries = [text[:30] for text in rng.sample(chunk_texts, min(50, len(chunk_texts)))]
+    query_cycle = {'next': 0}
+
+    def next_query() -> str:
+        query_cycle['next'] += 1
+        return queries[query_cycle['next'] % len(queries)]
+
+    retrieved = rag.retrieve_similar_chunks(queries[0], top_k=6)
+    pairs = [(rng.choice(chunk_texts)[:rng.randint(2, 20)], rng.choice(chunk_texts)[:rng.randint(2, 20)])
+             for _ in range(1000)]
+    short_answers = [(rng.choice(chunk_texts)[:80], rng.choice(chunk_texts)[:120]) for _ in range(1000)]
+
+    app_module.rag_system = rag  # /exam/grade 的 AI 評分使用假 Gemini
+    client = app_module.app.test_client()
+    questions, answers = make_exam(corpus, rng)
+
+    def grade_exam():
+        response = client.post('/exam/grade', json={'questions': questions, 'answers': answers})
+        assert response.get_json()['success']
+
+    def loop(fn: Callable[[], Any], number: int) -> Callable[[], None]:
+        # 單次只需微秒的項目，每次量測重複多次以降低計時誤差
+        def run():
+            for _ in range(number):
+                fn()
+        return run
+
+    cases = {
+        'chunk_text': {'fn': loop(lambda: chunk_text(longest_text), 50), 'number': 50},
+        'generate_embeddings': {'fn': lambda: generate_embeddings(embed_batch), 'number': len(embed_batch)},
+        'retrieve_similar_chunks': {'fn': lambda: rag.retrieve_similar_chunks(next_query(), top_k=3),
+                                    'number': 1},
+        'format_context': {'fn': loop(lambda: rag.format_context(retrieved), 1000), 'number': 1000},
+        'fuzzy_match': {'fn': lambda: [app_module.fuzzy_match(a, b) for a, b in pairs], 'number': len(pairs)},
+        'simple_grade_short_answer': {
+            'fn': lambda: [app_module.simple_grade_short_answer("題目", correct, user)
+                           for correct, user in short_answers],
+            'number': len(short_answers)
+        },
+        'grade_exam': {'fn': grade_exam, 'number': 1},
+        'rag_query': {'fn': lambda: rag.query(next_query(), top_k=3, similarity_threshold=0.0), 'number': 1},
+    }
+    if corpus['pdf_path']:
+        cases['read_pdf_file'] = {'fn': lambda: read_pdf_file(corpus['pdf_path']), 'number': 1}
+    return cases
+
+
+def run_case(fn: Callable[[], Any], number: int, repeat: int, warmup: int) -> Dict[str, float]:
+    """執行 warmup 次預熱後量測 repeat 次，返回每個操作的中位數與 p95（毫秒）"""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000 / number)
+    samples.sort()
+    return {
+        'median_ms': statistics.median(samples),
+        'p95_ms': samples[min(len(samples) - 1, int(round(0.95 * (len(samples) - 1))))],
+        'min_ms': samples[0],
+        'repeat': repeat,
+        'ops_per_sample': number
+    }
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float,
+            min_delta_ms: float = 0.02, statistic: str = 'min') -> List[str]:
+    """
+    與基準比較，返回退步超過容許比例的項目
+
+    Args:
+        results: 本次結果
+        baseline: 基準
+        tolerance: 可接受的退步比例
+        min_delta_ms: 視為退步的最小絕對差距（毫秒），低於此值的變化視為量測雜訊
+        statistic: 比較的統計量，min（受排程雜訊影響最小）或 median
+    """
+    if baseline.get('config') != results['config']:
+        print(f"⚠️ 基準的設定與本次不同，比較僅供參考\n   基準: {baseline.get('config')}\n   本次: {results['config']}")
+    key = f"{statistic}_ms"
+    regressions = []
+    print(f"\n{'項目':<28}{'基準 (ms)':>12}{'本次 (ms)':>12}{'變化':>10}    （比較 {statistic}）")
+    for name, result in results['cases'].items():
+        reference = baseline.get('cases', {}).get(name)
+        if not reference:
+            print(f"{name:<28}{'-':>12}{result[key]:>12.4f}{'新項目':>10}")
+            continue
+        ratio = result[key] / reference[key] if reference[key] else 1.0
+        flag = ""
+        if ratio > 1 + tolerance and result[key] - reference[key] > min_delta_ms:
+            regressions.append(name)
+            flag = " ❌"
+        print(f"{name:<28}{reference[key]:>12.4f}{result[key]:>12.4f}{ratio - 1:>+10.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="離線元件微基準測試")
+    parser.add_argument('--data-dir', default=os.path.join(ROOT_DIR, 'data'))
+    parser.add_argument('--embedder', choices=['real', 'fake'], default='fake',
+                        help="fake 為確定性的假模型（與儲存的基準相同），real 為實際嵌入模型")
+    parser.add_argument('--index-latency-ms', type=float, default=20.0, help="假向量索引每次呼叫的延遲")
+    parser.add_argument('--llm-latency-ms', type=float, default=300.0, help="假 Gemini 每次呼叫的固定延遲")
+    parser.add_argument('--llm-token-latency-ms', type=float, default=0.0, help="假 Gemini 每個 token 的延遲")
+    parser.add_argument('--no-hybrid', action='store_true', help="檢索時不使用關鍵字索引")
+    parser.add_argument('--embed-batch-size', type=int, default=64)
+    parser.add_argument('--repeat', type=int, default=7, help="每個項目的量測次數（取中位數）")
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--only', help="以逗號分隔，只執行指定項目")
+    parser.add_argument('--json', dest='json_path', help="將結果寫入 JSON 檔案")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="比較用的基準 JSON")
+    parser.add_argument('--save-baseline', action='store_true', help="將本次結果寫入 --baseline")
+    parser.add_argument('--tolerance', type=float, default=0.3, help="可接受的退步比例")
+    parser.add_argument('--min-delta-ms', type=float, default=0.02,
+                        help="視為退步的最小絕對差距（毫秒），避免微秒級項目的雜訊造成誤判")
+    parser.add_argument('--statistic', choices=['min', 'median'], default='min',
+                        help="與基準比較的統計量（min 受排程與 GC 雜訊影響最小）")
+    args = parser.parse_args()
+
+    embedder = install_embedder(args.embedder)
+    corpus = load_corpus(args.data_dir)
+    print(f"📚 {len(corpus['chunks'])} 個文字塊，嵌入模型: {embedder}")
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        rag = build_rag_system(corpus, work_dir, args)
+        cases = define_cases(corpus, rag, args)
+        selected = args.only.split(',') if args.only else list(cases)
+
+        results = {
+            'config': {
+                'embedder': embedder,
+                'index_latency_ms': args.index_latency_ms,
+                'llm_latency_ms': args.llm_latency_ms,
+                'llm_token_latency_ms': args.llm_token_latency_ms,
+                'hybrid': not args.no_hybrid,
+                'chunks': len(corpus['chunks'])
+            },
+            'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                            'cpu_count': os.cpu_count()},
+            'cases': {}
+        }
+        for name in selected:
+            if name not in cases:
+                print(f"⚠️ 略過不存在的項目: {name}")
+                continue
+            case = cases[name]
+            # 量測時隱藏檢索與查詢流程的日誌輸出
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = run_case(case['fn'], case['number'], args.repeat, args.warmup)
+            results['cases'][name] = result
+            print(f"⏱️  {name:<28}{result['median_ms']:>10.4f} ms/op (p95 {result['p95_ms']:.4f})")
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"💾 結果已寫入 {args.json_path}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"💾 基準已更新: {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"ℹ️ 找不到基準 {args.baseline}，以 --save-baseline 建立")
+        return
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance, args.min_delta_ms, args.statistic)
+    if regressions:
+        print(f"\n❌ {len(regressions)} 個項目退步超過 {args.tolerance:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+    print(f"\n✅ 沒有項目退步超過 {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main()
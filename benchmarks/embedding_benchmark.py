@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+嵌入後端一致性與效能基準測試
+以 data/ 教材切出的文字塊為語料，比較 PyTorch fp32（基準）與 ONNX Runtime fp32 / int8 的：
+  - 一致性：同一文字塊向量的餘弦相似度，以及以教材文字塊互相檢索的 top-k 重疊率
+  - 效能：批次編碼吞吐量（文字塊/秒，對應匯入時間）與單句查詢延遲 p50 / p99
+平均餘弦相似度低於 --min-cosine 時以非零狀態碼結束，可作為匯出/量化後的一致性檢查
+
+使用方式:
+    python embeddings.py --export                  # 先匯出 ONNX 模型
+    python benchmarks/embedding_benchmark.py
+    python benchmarks/embedding_benchmark.py --backends torch,onnx-int8 --min-cosine 0.99
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from embeddings import EMBEDDING_MODEL_NAME, OnnxEmbeddingModel, get_onnx_model_dir
+
+
+def load_corpus(data_dir: str, chunk_size: int, chunk_overlap: int):
+    """讀取 data 目錄下的教材並分塊"""
+    from vectorStore import read_file, chunk_text
+
+    chunks = []
+    for file_name in sorted(os.listdir(data_dir)):
+        if file_name.endswith(('.txt', '.pdf')):
+            text = read_file(os.path.join(data_dir, file_name))
+            chunks.extend(chunk_text(text, chunk_size=chunk_size, chunk_overlap=chunk_overlap))
+    if not chunks:
+        raise SystemExit(f"❌ {data_dir} 中沒有可用的教材")
+    return chunks
+
+
+def load_backend(name: str, model_dir: str):
+    if name == 'torch':
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(EMBEDDING_MODEL_NAME)
+    if name == 'onnx-fp32':
+        return OnnxEmbeddingModel(model_dir, quantized=False)
+    if name == 'onnx-int8':
+        return OnnxEmbeddingModel(model_dir, quantized=True)
+    raise SystemExit(f"❌ 不支援的後端: {name}")
+
+
+def unit_rows(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+
+
+def top_k_overlap(reference: np.ndarray, candidate: np.ndarray, top_k: int) -> float:
+    """以每個文字塊為查詢、在語料中檢索 top-k，計算兩個後端結果的平均重疊率"""
+    def neighbours(vectors):
+        scores = vectors @ vectors.T
+        np.fill_diagonal(scores, -np.inf)
+        return np.argsort(-scores, axis=1)[:, :top_k]
+    ref, cand = neighbours(reference), neighbours(candidate)
+    return float(np.mean([len(set(r) & set(c)) / top_k for r, c in zip(ref, cand)]))
+
+
+def measure(model, chunks, queries, batch_size: int, repeat: int):
+    """返回 (語料向量, 吞吐量, 單句延遲列表)"""
+    model.encode(chunks[:batch_size], batch_size=batch_size)  # 預熱
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        vectors = model.encode(chunks, batch_size=batch_size)
+        best = min(best, time.perf_counter() - start)
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        model.encode([query])
+        latencies.append(time.perf_counter() - start)
+    return unit_rows(vectors), len(chunks) / best, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="嵌入後端一致性與效能基準測試")
+    parser.add_argument('--data-dir', default=os.path.join(ROOT_DIR, 'data'))
+    parser.add_argument('--chunk-size', type=int, default=500)
+    parser.add_argument('--chunk-overlap', type=int, default=50)
+    parser.add_argument('--backends', default="torch,onnx-fp32,onnx-int8",
+                        help="以逗號分隔；第一個作為一致性比較的基準")
+    parser.add_argument('--model-dir', default=None, help="ONNX 模型目錄，預設讀取 ONNX_MODEL_DIR")
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--repeat', type=int, default=3, help="批次編碼重複次數（取最快）")
+    parser.add_argument('--queries', type=int, default=100, help="單句延遲量測的查詢數")
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--threads', type=int, default=0, help="運算執行緒數，0 表示預設")
+    parser.add_argument('--min-cosine', type=float, default=0.99, help="平均餘弦相似度下限")
+    parser.add_argument('--json', dest='json_path', help="將結果另存為 JSON")
+    args = parser.parse_args()
+
+    model_dir = args.model_dir or os.path.join(ROOT_DIR, get_onnx_model_dir())
+    chunks = load_corpus(args.data_dir, args.chunk_size, args.chunk_overlap)
+    rng = np.random.default_rng(0)
+    queries = [chunks[i][:40] for i in rng.integers(0, len(chunks), size=args.queries)]
+    print(f"📚 共 {len(chunks)} 個文字塊，{len(queries)} 個查詢")
+
+    report = {'chunks': len(chunks), 'batch_size': args.batch_size, 'backends': {}}
+    reference = None
+    failed = False
+    print("=" * 78)
+    print(f"{'後端':<12}{'文字塊/秒':>12}{'p50 (ms)':>10}{'p99 (ms)':>10}"
+          f"{'平均 cos':>10}{'最低 cos':>10}{'top-' + str(args.top_k) + ' 重疊':>12}")
+    print("-" * 78)
+    for name in [value for value in args.backends.split(',') if value]:
+        model = load_backend(name, model_dir)
+        if args.threads and isinstance(model, OnnxEmbeddingModel):
+            model.set_num_threads(args.threads)
+        elif args.threads:
+            import torch
+            torch.set_num_threads(args.threads)
+        vectors, throughput, latencies = measure(model, chunks, queries, args.batch_size, args.repeat)
+        row = {
+            'chunks_per_second': throughput,
+            'p50_ms': float(np.percentile(latencies, 50) * 1000),
+            'p99_ms': float(np.percentile(latencies, 99) * 1000)
+        }
+        if reference is None:
+            reference = vectors
+            row.update({'mean_cosine': 1.0, 'min_cosine': 1.0, 'top_k_overlap': 1.0})
+        else:
+            cosine = (reference * vectors).sum(axis=1)
+            row.update({'mean_cosine': float(cosine.mean()), 'min_cosine': float(cosine.min()),
+                        'top_k_overlap': top_k_overlap(reference, vectors, args.top_k)})
+            failed = failed or row['mean_cosine'] < args.min_cosine
+        report['backends'][name] = row
+        print(f"{name:<12}{row['chunks_per_second']:>12.1f}{row['p50_ms']:>10.2f}{row['p99_ms']:>10.2f}"
+              f"{row['mean_cosine']:>10.4f}{row['min_cosine']:>10.4f}{row['top_k_overlap']:>12.3f}")
+    print("=" * 78)
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 結果已寫入 {args.json_path}")
+
+    if failed:
+        print(f"❌ 一致性檢查未通過：平均餘弦相似度低於 {args.min_cosine}")
+        sys.exit(1)
+    print("✅ 一致性檢查通過")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+離線基準測試用的替身
+以確定性的假向量索引、假 Gemini 模型與假嵌入模型取代外部服務，並可注入固定延遲模擬網路往返，
+讓效能測試不需要 Pinecone / Gemini 金鑰，每次執行的結果也都相同
+"""
+
+import time
+import hashlib
+from typing import List, Dict, Any, Optional, Union
+
+import numpy as np
+
+DIMENSION = 384
+
+
+def _seed(text: str) -> int:
+    return int(hashlib.md5(text.encode('utf-8')).hexdigest()[:8], 16)
+
+
+class FakeEmbeddingModel:
+    """以文字雜湊產生固定單位向量的嵌入模型（介面與 SentenceTransformer.encode 相同）"""
+
+    def __init__(self, dimension: int = DIMENSION):
+        self.dimension = dimension
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+    def encode(self, sentences: Union[str, List[str]], batch_size: int = 32,
+               convert_to_numpy: bool = True, **kwargs) -> np.ndarray:
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            vector = np.random.default_rng(_seed(text)).standard_normal(self.dimension)
+            vectors[row] = vector / np.linalg.norm(vector)
+        return vectors[0] if single else vectors
+
+
+class FakeVectorIndex:
+    """
+    與 Pinecone Index 介面相容的記憶體內索引
+    查詢為精確的餘弦相似度，每次呼叫先等待 latency_ms 模擬網路往返
+    """
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency = latency_ms / 1000
+        self._ids: List[str] = []
+        self._vectors = np.zeros((0, DIMENSION), dtype=np.float32)
+        self._metadata: List[Dict[str, Any]] = []
+
+    def _wait(self):
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def upsert(self, vectors: List[Dict[str, Any]]) -> Dict[str, Any]:
+        self._wait()
+        values = np.asarray([vector['values'] for vector in vectors], dtype=np.float32)
+        values /= np.clip(np.linalg.norm(values, axis=1, keepdims=True), 1e-12, None)
+        self._ids.extend(str(vector['id']) for vector in vectors)
+        self._vectors = np.vstack([self._vectors, values])
+        self._metadata.extend(dict(vector.get('metadata') or {}) for vector in vectors)
+        return {'upserted_count': len(vectors)}
+
+    def query(self, vector: List[float], top_k: int = 3, include_metadata: bool = True) -> Dict[str, Any]:
+        self._wait()
+        if not self._ids:
+            return {'matches': []}
+        query = np.asarray(vector, dtype=np.float32)
+        scores = self._vectors @ (query / max(float(np.linalg.norm(query)), 1e-12))
+        rows = np.argsort(-scores, kind='stable')[:top_k]
+        return {'matches': [{'id': self._ids[row], 'score': float(scores[row]),
+                             'metadata': dict(self._metadata[row]) if include_metadata else {}}
+                            for row in rows]}
+
+    def delete(self, ids: Optional[List[str]] = None, delete_all: bool = False) -> Dict[str, Any]:
+        self._wait()
+        keep = [row for row, vector_id in enumerate(self._ids)
+                if not delete_all and vector_id not in set(ids or [])]
+        self._ids = [self._ids[row] for row in keep]
+        self._vectors = self._vectors[keep]
+        self._metadata = [self._metadata[row] for row in keep]
+        return {}
+
+    def describe_index_stats(self) -> Dict[str, Any]:
+        return {'dimension': DIMENSION, 'total_vector_count': len(self._ids)}
+
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeGeminiModel:
+    """
+    假 Gemini 模型：固定延遲後返回確定性的回答
+    評分提示詞返回分數，其他提示詞返回固定長度的回答；stream=True 時逐段返回
+    """
+
+    def __init__(self, latency_ms: float = 0.0, token_latency_ms: float = 0.0, answer_chars: int = 200):
+        self.latency = latency_ms / 1000
+        self.token_latency = token_latency_ms / 1000
+        self.answer_chars = answer_chars
+        self.calls = 0
+
+    def _answer(self, prompt: str) -> str:
+        if "請只返回分數" in prompt:
+            return str(_seed(prompt) % 11)
+        return ("根據教材內容，" * self.answer_chars)[:self.answer_chars]
+
+    def generate_content(self, prompt: str, stream: bool = False, **kwargs):
+        self.calls += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+        answer = self._answer(prompt)
+        if not stream:
+            if self.token_latency > 0:
+                time.sleep(self.token_latency * len(answer) / 4)
+            return FakeResponse(answer)
+        return self._stream(answer)
+
+    def _stream(self, answer: str, part_chars: int = 20):
+        for start in range(0, len(answer), part_chars):
+            if self.token_latency > 0:
+                time.sleep(self.token_latency * part_chars / 4)
+            yield FakeResponse(answer[start:start + part_chars])
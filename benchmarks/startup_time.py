@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+啟動時間基準測試
+在全新的子程序中匯入各個進入點，量測匯入時間、第一次健康檢查回應時間與模型載入完成（ready）時間，
+並列出匯入後已被載入的大型套件，確認 torch 等依賴只在需要時才匯入
+
+使用方式:
+    python benchmarks/startup_time.py
+    python benchmarks/startup_time.py --repeat 5 --entries app,init_db --skip-ready
+    python benchmarks/startup_time.py --json startup.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ['torch', 'sentence_transformers', 'pdfplumber', 'PyPDF2',
+                 'google.generativeai', 'pinecone', 'langchain_text_splitters']
+
+# 進入點: (匯入的模組, 健康檢查程式碼, 載入完成程式碼)
+ENTRY_POINTS = {
+    'vectorStore': ('vectorStore', None, 'vectorStore.generate_embeddings(["warm up"])'),
+    'init_db': ('init_db', None, None),
+    'rag_system': ('rag_system', None, None),
+    'app': ('app', 'app.app.test_client().get("/health")', 'app.warm_up(background=False)'),
+}
+
+MARKER = "__STARTUP_RESULT__"
+
+PROBE = """
+import sys, time, json
+started = time.perf_counter()
+import {module}
+imported = time.perf_counter()
+heavy = [name for name in {heavy!r} if name in sys.modules]
+health = None
+if {health_code!r}:
+    exec({health_code!r})
+    health = time.perf_counter() - started
+ready = None
+if {ready_code!r}:
+    exec({ready_code!r})
+    ready = time.perf_counter() - started
+print({marker!r} + json.dumps({{'import': imported - started, 'health': health, 'ready': ready,
+                                 'heavy_after_import': heavy}}))
+"""
+
+
+def probe(entry: str, skip_ready: bool) -> dict:
+    """在新的子程序中量測一次進入點的啟動時間"""
+    module, health_code, ready_code = ENTRY_POINTS[entry]
+    code = PROBE.format(module=module, heavy=HEAVY_MODULES, health_code=health_code or "",
+                        ready_code="" if skip_ready else (ready_code or ""), marker=MARKER)
+    started = time.perf_counter()
+    completed = subprocess.run([sys.executable, '-c', code], cwd=ROOT_DIR,
+                               capture_output=True, text=True)
+    wall = time.perf_counter() - started
+    for line in completed.stdout.splitlines():
+        if line.startswith(MARKER):
+            result = json.loads(line[len(MARKER):])
+            result['process'] = wall
+            return result
+    raise RuntimeError(f"{entry} 啟動失敗:\n{completed.stderr[-2000:]}")
+
+
+def summarize(samples: list) -> dict:
+    def median(key):
+        values = [sample[key] for sample in samples if sample[key] is not None]
+        return statistics.median(values) if values else None
+    return {
+        'import_s': median('import'),
+        'health_s': median('health'),
+        'ready_s': median('ready'),
+        'process_s': median('process'),
+        'heavy_after_import': samples[-1]['heavy_after_import']
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="量測各進入點的匯入與就緒時間")
+    parser.add_argument('--entries', default=",".join(ENTRY_POINTS), help="逗號分隔的進入點")
+    parser.add_argument('--repeat', type=int, default=3, help="每個進入點量測次數（取中位數）")
+    parser.add_argument('--skip-ready', action='store_true', help="不量測模型載入完成時間")
+    parser.add_argument('--json', help="將結果寫入 JSON 檔案")
+    args = parser.parse_args()
+
+    results = {}
+    for entry in args.entries.split(','):
+        samples = [probe(entry, args.skip_ready) for _ in range(args.repeat)]
+        results[entry] = summarize(samples)
+
+    def fmt(value):
+        return f"{value:.2f}s" if value is not None else "-"
+
+    print(f"\n{'entry':<12}{'import':>10}{'health':>10}{'ready':>10}{'process':>10}  heavy modules after import")
+    for entry, result in results.items():
+        print(f"{entry:<12}{fmt(result['import_s']):>10}{fmt(result['health_s']):>10}"
+              f"{fmt(result['ready_s']):>10}{fmt(result['process_s']):>10}  "
+              f"{', '.join(result['heavy_after_import']) or '-'}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 結果已寫入 {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+# 外部服務客戶端的共用與連線重用
+# Pinecone 與 Gemini 客戶端在同一程序內只建立一次，之後的請求沿用已建立的連線，不必重新做 TLS 握手：
+#   - Pinecone 客戶端依 (金鑰, 傳輸方式) 共用，索引 handle 依名稱快取；HTTP 資料平面使用 urllib3 連線池
+#     （PINECONE_POOL_MAXSIZE 條長連線），設定 PINECONE_TRANSPORT=grpc 時 upsert / query 改走 gRPC（需 pinecone[grpc]）
+#   - 已確認存在的索引名稱會記住，連接索引不必每次呼叫 list_indexes()
+#   - Gemini 只在金鑰改變時執行 genai.configure()，GenerativeModel 依模型名稱共用
+# 快取以程序 ID 區分，pre-fork 的 worker 第一次使用時自動建立自己的連線（連線與 gRPC channel 不能跨 fork 共用）
+# 連線池使用狀況以 vector_store_pool_* 指標輸出
+
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from metrics import REGISTRY
+
+TRANSPORTS = ('http', 'grpc')
+
+_lock = threading.RLock()
+_pid: Optional[int] = None
+_pinecone_clients: Dict[Tuple[str, str], Any] = {}
+_index_handles: Dict[Tuple[str, str, str], Any] = {}
+_known_indexes: Dict[str, set] = {}
+_gemini_key: Optional[str] = None
+_gemini_models: Dict[str, Any] = {}
+_stats = {'clients_created': 0, 'handles_created': 0, 'handle_reuses': 0, 'list_indexes_calls': 0,
+          'gemini_models_created': 0, 'gemini_model_reuses': 0}
+
+
+def _check_fork():
+    """程序 ID 改變（fork 出的 worker）時丟棄從主程序繼承的客戶端"""
+    global _pid, _gemini_key
+    if _pid != os.getpid():
+        _pid = os.getpid()
+        _pinecone_clients.clear()
+        _index_handles.clear()
+        _gemini_models.clear()
+        _gemini_key = None
+
+
+def pinecone_transport(transport: Optional[str] = None) -> str:
+    """取得 Pinecone 資料平面的傳輸方式（參數優先，其次為環境變數 PINECONE_TRANSPORT）"""
+    transport = (transport or os.getenv('PINECONE_TRANSPORT') or 'http').strip().lower()
+    if transport not in TRANSPORTS:
+        raise ValueError(f"不支援的 Pinecone 傳輸方式: {transport}（可用：http、grpc）")
+    return transport
+
+
+def get_pinecone_client(api_key: Optional[str] = None, transport: Optional[str] = None):
+    """
+    取得共用的 Pinecone 客戶端（首次呼叫時建立）
+
+    Args:
+        api_key: Pinecone API 金鑰，未指定時讀取環境變數 PINECONE_API_KEY
+        transport: http 或 grpc，未指定時讀取環境變數 PINECONE_TRANSPORT
+
+    Returns:
+        Pinecone（或 PineconeGRPC）客戶端
+    """
+    api_key = api_key or os.getenv('PINECONE_API_KEY')
+    transport = pinecone_transport(transport)
+    with _lock:
+        _check_fork()
+        key = (api_key, transport)
+        if key not in _pinecone_clients:
+            if transport == 'grpc':
+                from pinecone.grpc import PineconeGRPC as client_class
+            else:
+                from pinecone import Pinecone as client_class
+            _pinecone_clients[key] = client_class(api_key=api_key)
+            _stats['clients_created'] += 1
+        return _pinecone_clients[key]
+
+
+def get_pinecone_index(index_name: str, api_key: Optional[str] = None, transport: Optional[str] = None):
+    """
+    取得共用的索引 handle（同一程序內每個索引只建立一次連線池）
+
+    Args:
+        index_name: 索引名稱
+        api_key: Pinecone API 金鑰
+        transport: http 或 grpc
+
+    Returns:
+        Pinecone Index（或 GRPCIndex）
+    """
+    api_key = api_key or os.getenv('PINECONE_API_KEY')
+    transport = pinecone_transport(transport)
+    with _lock:
+        _check_fork()
+        key = (api_key, transport, index_name)
+        if key in _index_handles:
+            _stats['handle_reuses'] += 1
+            return _index_handles[key]
+        client = get_pinecone_client(api_key, transport)
+        options = {}
+        # 指定主機時不必先查詢索引描述
+        host = os.getenv('PINECONE_INDEX_HOST')
+        if host:
+            options['host'] = host
+        if transport == 'http':
+            options['pool_threads'] = int(os.getenv('PINECONE_POOL_THREADS', '4'))
+            options['connection_pool_maxsize'] = int(os.getenv('PINECONE_POOL_MAXSIZE', '32'))
+        _index_handles[key] = client.Index(index_name, **options)
+        _stats['handles_created'] += 1
+        return _index_handles[key]
+
+
+def index_exists(index_name: str, api_key: Optional[str] = None) -> bool:
+    """
+    檢查索引是否存在；確認存在過的索引直接返回 True，不再呼叫 list_indexes()
+
+    Args:
+        index_name: 索引名稱
+        api_key: Pinecone API 金鑰
+    """
+    api_key = api_key or os.getenv('PINECONE_API_KEY')
+    with _lock:
+        if index_name in _known_indexes.get(api_key, set()):
+            return True
+    names = [idx.name for idx in get_pinecone_client(api_key).list_indexes()]
+    with _lock:
+        _stats['list_indexes_calls'] += 1
+        _known_indexes[api_key] = set(names)
+    return index_name in names
+
+
+def remember_index(index_name: str, api_key: Optional[str] = None):
+    """記錄剛建立的索引（之後不必再呼叫 list_indexes() 確認）"""
+    api_key = api_key or os.getenv('PINECONE_API_KEY')
+    with _lock:
+        _known_indexes.setdefault(api_key, set()).add(index_name)
+
+
+def forget_index(index_name: str, api_key: Optional[str] = None):
+    """刪除索引後清除其快取的 handle 與存在紀錄"""
+    api_key = api_key or os.getenv('PINECONE_API_KEY')
+    with _lock:
+        _known_indexes.get(api_key, set()).discard(index_name)
+        for key in [key for key in _index_handles if key[0] == api_key and key[2] == index_name]:
+            del _index_handles[key]
+
+
+def get_gemini_model(api_key: str, model_name: str):
+    """
+    取得共用的 Gemini 模型（金鑰改變時才重新執行 genai.configure()）
+
+    Args:
+        api_key: Gemini API 金鑰
+        model_name: 模型名稱，例如 gemini-2.5-flash
+
+    Returns:
+        GenerativeModel
+    """
+    global _gemini_key
+    with _lock:
+        _check_fork()
+        if api_key != _gemini_key:
+            import google.generativeai as genai
+            options = {}
+            # rest 或 grpc（預設由 google-generativeai 決定）
+            transport = os.getenv('GEMINI_TRANSPORT')
+            if transport:
+                options['transport'] = transport
+            genai.configure(api_key=api_key, **options)
+            _gemini_key = api_key
+            _gemini_models.clear()
+        if model_name in _gemini_models:
+            _stats['gemini_model_reuses'] += 1
+        else:
+            import google.generativeai as genai
+            _gemini_models[model_name] = genai.GenerativeModel(model_name)
+            _stats['gemini_models_created'] += 1
+        return _gemini_models[model_name]
+
+
+def _pool_manager(handle):
+    """取出 Pinecone HTTP 索引 handle 底層的 urllib3 PoolManager（gRPC 或版本不同時為 None）"""
+    for path in (('_vector_api', 'api_client', 'rest_client', 'pool_manager'),
+                 ('_api_client', 'rest_client', 'pool_manager')):
+        target = handle
+        for attribute in path:
+            target = getattr(target, attribute, None)
+            if target is None:
+                break
+        if target is not None:
+            return target
+    return None
+
+
+def pool_stats() -> Dict[str, Any]:
+    """
+    客戶端重用與連線池使用狀況
+
+    Returns:
+        計數器與每個索引 handle 的連線池統計
+        （connections：已建立的連線數、idle：閒置可重用的連線數、maxsize：上限、requests：已送出的請求數）
+    """
+    with _lock:
+        handles = list(_index_handles.items())
+        stats: Dict[str, Any] = dict(_stats)
+    pools: List[Dict[str, Any]] = []
+    for (_, transport, index_name), handle in handles:
+        pool_manager = _pool_manager(handle) if transport == 'http' else None
+        entry = {'index': index_name, 'transport': transport,
+                 'connections': 0, 'idle': 0, 'maxsize': 0, 'requests': 0}
+        if pool_manager is not None:
+            for key in list(pool_manager.pools.keys()):
+                pool = pool_manager.pools.get(key)
+                if pool is None:
+                    continue
+                entry['connections'] += getattr(pool, 'num_connections', 0)
+                entry['requests'] += getattr(pool, 'num_requests', 0)
+                queue = getattr(pool, 'pool', None)
+                if queue is not None:
+                    # urllib3 以 None 佔位，實際連線才算閒置可重用
+                    entry['idle'] += sum(1 for conn in list(queue.queue) if conn is not None)
+                    entry['maxsize'] += queue.maxsize
+        pools.append(entry)
+    stats['pools'] = pools
+    return stats
+
+
+def register_metrics():
+    """登錄客戶端重用與連線池指標（同名 collector 會被取代）"""
+
+    def collect():
+        stats = pool_stats()
+        pools = stats['pools']
+
+        def per_pool(field):
+            return [({'index': pool['index'], 'transport': pool['transport']}, pool[field]) for pool in pools]
+
+        return [
+            ('vector_store_pool_connections', 'gauge', "Connections opened by the vector store HTTP pool",
+             per_pool('connections')),
+            ('vector_store_pool_idle_connections', 'gauge', "Idle keep-alive connections ready for reuse",
+             per_pool('idle')),
+            ('vector_store_pool_max_connections', 'gauge', "Maximum pooled connections per host",
+             per_pool('maxsize')),
+            ('vector_store_pool_requests_total', 'counter', "Requests sent through the vector store HTTP pool",
+             per_pool('requests')),
+            ('client_reuse_total', 'counter', "Shared client lookups served from the cache",
+             [({'client': 'pinecone_index'}, stats['handle_reuses']),
+              ({'client': 'gemini_model'}, stats['gemini_model_reuses'])]),
+            ('client_created_total', 'counter', "Clients created (each opens new connections)",
+             [({'client': 'pinecone'}, stats['clients_created']),
+              ({'client': 'pinecone_index'}, stats['handles_created']),
+              ({'client': 'gemini_model'}, stats['gemini_models_created'])]),
+            ('pinecone_list_indexes_total', 'counter', "list_indexes() calls made to check index existence",
+             [({}, stats['list_indexes_calls'])]),
+        ]
+
+    REGISTRY.register_collector('clients', collect)
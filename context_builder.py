@@ -0,0 +1,237 @@
+# 上下文組裝
+# 將檢索到的文字塊整理為送給 LLM 的上下文，縮短提示詞：
+#   1. 自適應 top_k：維持檢索結果的排序（混合檢索為 RRF 順序），向量相似度相對前一名驟降（score cliff）時
+#      停止加入後續文字塊
+#   2. 同一來源檔案中相鄰的文字塊合併，去除 chunk_overlap 造成的重複文字
+#   3. 超過 token 預算時，依句子與查詢的相似度挑選句子，保留原本的句子順序
+
+import re
+import threading
+from typing import List, Dict, Any, Optional, Tuple
+
+from lexical_index import tokenize
+
+_CJK_RE = re.compile(r'[㐀-䶿一-鿿豈-﫿぀-ヿ가-힯]')
+# 句子結尾：句號、問號、驚嘆號、分號（全形或半形）或換行
+_SENTENCE_RE = re.compile(r'[^。！？；!?;\n]+(?:[。！？；!?;]+|\n+|$)|[。！？；!?;\n]+')
+# 去除重疊文字時比對的最大長度（涵蓋 chunk_overlap 與分塊器在邊界的調整）
+MAX_OVERLAP_CHARS = 200
+# 視為重疊的最小長度：只有一兩個字相同（例如句號、換行）通常只是巧合，不是 chunk_overlap
+MIN_OVERLAP_CHARS = 10
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    估計 token 數（不需載入分詞器）：中日韓文字每字約 1 token，其他文字約每 4 個字元 1 token
+
+    Args:
+        text: 文字
+
+    Returns:
+        估計的 token 數
+    """
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def split_sentences(text: str) -> List[str]:
+    """將文字切為句子（保留標點與換行，空白併入前一句，串接後等於原文）"""
+    sentences: List[str] = []
+    for piece in _SENTENCE_RE.findall(text):
+        if sentences and not piece.strip():
+            sentences[-1] += piece
+        elif piece:
+            sentences.append(piece)
+    return sentences
+
+
+def merge_overlapping(first: str, second: str, max_overlap: int = MAX_OVERLAP_CHARS,
+                      min_overlap: int = MIN_OVERLAP_CHARS) -> str:
+    """
+    合併相鄰的兩個文字塊：first 的結尾與 second 的開頭重疊時只保留一份
+
+    Args:
+        first: 前一個文字塊
+        second: 後一個文字塊
+        max_overlap: 比對的最大重疊長度
+        min_overlap: 視為重疊的最小長度，較短的相同文字不刪除
+
+    Returns:
+        合併後的文字
+    """
+    for size in range(min(len(first), len(second), max_overlap), max(min_overlap, 1) - 1, -1):
+        if first.endswith(second[:size]):
+            return first + second[size:]
+    return first + "\n" + second
+
+
+class ContextBuilder:
+    """
+    依 token 預算組裝上下文
+    build() 返回合併後的區塊（與 retrieve_similar_chunks 的結果欄位相同，可直接交給 format_context）
+    與本次節省的 token 統計；累計統計由 stats() 取得
+    """
+
+    def __init__(self, max_tokens: int = 1500, score_cliff: float = 0.2, min_chunks: int = 1):
+        """
+        初始化組裝器
+
+        Args:
+            max_tokens: 上下文內容的 token 預算，0 表示不限制
+            score_cliff: 相似度低於前一個文字塊的 (1 - score_cliff) 倍時停止加入，1 以上表示停用
+            min_chunks: 至少保留的文字塊數
+        """
+        self.max_tokens = max_tokens
+        self.score_cliff = score_cliff
+        self.min_chunks = min_chunks
+        self._lock = threading.Lock()
+        self._totals = {'requests': 0, 'original_tokens': 0, 'context_tokens': 0,
+                        'chunks_dropped': 0, 'chunks_merged': 0, 'sentences_dropped': 0}
+
+    @staticmethod
+    def cliff_score(chunk: Dict[str, Any]) -> Optional[float]:
+        """
+        用來判斷分數驟降的相似度
+        混合檢索的 score 可能是餘弦相似度或關鍵字覆蓋率，彼此不能比較，因此使用 vector_score；
+        只由關鍵字找到的文字塊沒有向量相似度，返回 None（不參與判斷）
+        """
+        if 'rrf_score' in chunk:
+            return chunk.get('vector_score')
+        return chunk['score']
+
+    def select_chunks(self, chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """自適應 top_k：維持檢索結果的順序，在向量相似度驟降處截斷"""
+        selected = list(chunks[:self.min_chunks])
+        previous = next((score for score in map(self.cliff_score, reversed(selected)) if score is not None), None)
+        for chunk in chunks[self.min_chunks:]:
+            score = self.cliff_score(chunk)
+            if score is not None:
+                if (self.score_cliff < 1 and previous is not None
+                        and score < previous * (1 - self.score_cliff)):
+                    break
+                previous = score
+            selected.append(chunk)
+        return selected
+
+    def merge_adjacent(self, chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        合併同一來源檔案中 chunk_index 連續的文字塊
+
+        Returns:
+            區塊列表（依組成文字塊在檢索結果中的最前名次排序），每個區塊的 ids 記錄組成的文字塊
+        """
+        blocks: List[Dict[str, Any]] = []
+        rank = {id(chunk): position for position, chunk in enumerate(chunks)}
+        by_position = sorted(chunks, key=lambda chunk: (chunk['source_file'], chunk['chunk_index']))
+        for chunk in by_position:
+            previous = blocks[-1] if blocks else None
+            if (previous is not None and chunk['chunk_index'] >= 0
+                    and previous['source_file'] == chunk['source_file']
+                    and chunk['chunk_index'] == previous['last_index'] + 1):
+                previous['text'] = merge_overlapping(previous['text'], chunk['text'])
+                previous['score'] = max(previous['score'], chunk['score'])
+                previous['last_index'] = chunk['chunk_index']
+                previous['ids'].append(chunk['id'])
+                previous['rank'] = min(previous['rank'], rank[id(chunk)])
+                continue
+            blocks.append({
+                'id': chunk['id'],
+                'rank': rank[id(chunk)],
+                'ids': [chunk['id']],
+                'score': chunk['score'],
+                'score_type': chunk.get('score_type', 'cosine'),
+                'text': chunk['text'],
+                'source_file': chunk['source_file'],
+                'chunk_index': chunk['chunk_index'],
+                'last_index': chunk['chunk_index'],
+                'metadata': chunk.get('metadata', {})
+            })
+        return sorted(blocks, key=lambda block: block['rank'])
+
+    def trim_to_budget(self, query: str, blocks: List[Dict[str, Any]]) -> int:
+        """
+        超過 token 預算時，以句子與查詢共有的索引詞比例（加上所屬區塊的相似度）挑選句子，直到用完預算
+
+        Returns:
+            刪除的句子數
+        """
+        if not self.max_tokens or sum(estimate_tokens(block['text']) for block in blocks) <= self.max_tokens:
+            return 0
+
+        query_terms = set(tokenize(query))
+        candidates = []  # (分數, 區塊編號, 句子編號, token 數)
+        sentences_by_block = []
+        for block_number, block in enumerate(blocks):
+            sentences = split_sentences(block['text'])
+            sentences_by_block.append(sentences)
+            for sentence_number, sentence in enumerate(sentences):
+                terms = set(tokenize(sentence))
+                overlap = len(terms & query_terms) / len(query_terms) if query_terms else 0.0
+                candidates.append((overlap + block['score'], block_number, sentence_number,
+                                   estimate_tokens(sentence)))
+
+        kept, used = set(), 0
+        for score, block_number, sentence_number, tokens in sorted(candidates, key=lambda item: -item[0]):
+            if used + tokens > self.max_tokens and kept:
+                continue
+            kept.add((block_number, sentence_number))
+            used += tokens
+
+        dropped = 0
+        for block_number, (block, sentences) in enumerate(zip(blocks, sentences_by_block)):
+            parts, gap = [], False
+            for sentence_number, sentence in enumerate(sentences):
+                if (block_number, sentence_number) in kept:
+                    if gap and parts:
+                        parts.append("…")
+                    parts.append(sentence)
+                    gap = False
+                else:
+                    dropped += 1
+                    gap = True
+            block['text'] = "".join(parts).strip()
+        blocks[:] = [block for block in blocks if block['text']]
+        return dropped
+
+    def build(self, query: str, chunks: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        組裝上下文區塊
+
+        Args:
+            query: 用戶查詢
+            chunks: retrieve_similar_chunks 的結果
+
+        Returns:
+            (區塊列表, 統計)；統計包含原始與組裝後的 token 數、節省比例、刪除與合併的文字塊數、刪除的句子數
+        """
+        selected = self.select_chunks(chunks)
+        blocks = self.merge_adjacent(selected)
+        chunks_merged = len(selected) - len(blocks)
+        sentences_dropped = self.trim_to_budget(query, blocks)
+
+        original_tokens = sum(estimate_tokens(chunk['text']) for chunk in chunks)
+        context_tokens = sum(estimate_tokens(block['text']) for block in blocks)
+        stats = {
+            'original_tokens': original_tokens,
+            'context_tokens': context_tokens,
+            'saved_tokens': original_tokens - context_tokens,
+            'saved_ratio': (original_tokens - context_tokens) / original_tokens if original_tokens else 0.0,
+            'chunks_dropped': len(chunks) - len(selected),
+            'chunks_merged': chunks_merged,
+            'sentences_dropped': sentences_dropped
+        }
+        with self._lock:
+            self._totals['requests'] += 1
+            for key in ('original_tokens', 'context_tokens', 'chunks_dropped', 'chunks_merged',
+                        'sentences_dropped'):
+                self._totals[key] += stats[key]
+        return blocks, stats
+
+    def stats(self) -> Dict[str, Any]:
+        """取得累計統計"""
+        with self._lock:
+            totals = dict(self._totals)
+        totals['saved_tokens'] = totals['original_tokens'] - totals['context_tokens']
+        totals['saved_ratio'] = (totals['saved_tokens'] / totals['original_tokens']
+                                 if totals['original_tokens'] else 0.0)
+        return totals
@@ -0,0 +1,289 @@
+# 文件解析快取
+# 將 PDF / TXT 解析後的文字快取在記憶體與磁碟，以路徑、大小、修改時間與內容雜湊判斷是否有效
+# 磁碟快取由 pre-fork 的所有 worker 共用：暫存檔名稱各自唯一，清單在跨程序檔案鎖下與磁碟上的內容合併後寫回
+
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Any, Optional
+
+from question_bank import file_lock
+
+# 磁碟快取使用 UTF-32-LE：每個字元固定 4 bytes，可直接定位任意字元位置
+_ENCODING = 'utf-32-le'
+_BYTES_PER_CHAR = 4
+
+
+def file_sha256(file_path: str, block_size: int = 1 << 20) -> str:
+    """計算檔案內容的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DocumentCache:
+    """
+    文件解析快取
+    - 記憶體：LRU 保留最近使用的全文
+    - 磁碟：以內容雜湊命名的 UTF-32 文字檔，跨程序與重啟後仍有效
+    - 檔案大小或修改時間改變時重新計算雜湊，內容不同才重新解析
+    """
+
+    MANIFEST_FILE = "manifest.json"
+
+    def __init__(self, extractor: Callable[[str], str], cache_dir: str = "cache/documents",
+                 max_entries: int = 8):
+        """
+        初始化快取
+
+        Args:
+            extractor: 實際解析檔案的函式，輸入路徑返回文字（失敗時返回空字串）
+            cache_dir: 磁碟快取目錄
+            max_entries: 記憶體中最多保留的文件數量
+        """
+        self.extractor = extractor
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self._texts: "OrderedDict[str, str]" = OrderedDict()
+        # _lock 只保護記憶體快取、清單與統計；解析檔案時改持有該路徑自己的鎖，
+        # 同一檔案只解析一次，其他檔案的請求不必等待
+        self._lock = threading.RLock()
+        self._path_locks: Dict[str, threading.Lock] = {}
+        self._manifest = self._load_manifest()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    # ---- 快取鍵與清單 ----
+
+    @property
+    def _manifest_path(self) -> str:
+        return os.path.join(self.cache_dir, self.MANIFEST_FILE)
+
+    def _text_path(self, sha256: str) -> str:
+        return os.path.join(self.cache_dir, f"{sha256}.u32")
+
+    def _load_manifest(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self._manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _atomic_write(self, path: str, mode: str, write: Callable[[Any], None], **options):
+        """
+        寫入唯一的暫存檔後再取代目標檔案
+        其他 worker 同時寫入同一檔案時不會互相截斷，讀取端也不會讀到寫到一半的檔案
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=os.path.basename(path) + '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, mode, **options) as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def _save_entry(self, path: str, entry: Dict[str, Any]):
+        """在跨程序檔案鎖下重新讀取磁碟上的清單，合併本次的紀錄後寫回（保留其他 worker 寫入的紀錄）"""
+        with file_lock(self._manifest_path + ".lock"):
+            manifest = self._load_manifest()
+            manifest[path] = entry
+            self._atomic_write(self._manifest_path, 'w',
+                               lambda f: json.dump(manifest, f, ensure_ascii=False, indent=2), encoding='utf-8')
+        with self._lock:
+            self._manifest = manifest
+
+    def _known_length(self, sha256: str) -> Optional[int]:
+        """清單中相同內容雜湊的全文字元數（其他路徑或其他 worker 已解析過相同內容時）"""
+        with self._lock:
+            entries = list(self._manifest.values())
+        for entry in entries:
+            if entry.get('sha256') == sha256:
+                return entry['length']
+        return None
+
+    def _path_lock(self, path: str) -> threading.Lock:
+        with self._lock:
+            lock = self._path_locks.get(path)
+            if lock is None:
+                lock = self._path_locks[path] = threading.Lock()
+            return lock
+
+    @staticmethod
+    def _matches(entry: Optional[Dict[str, Any]], stat: os.stat_result) -> bool:
+        return bool(entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns)
+
+    def _valid_entry(self, path: str, stat: os.stat_result, reload: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        清單中與檔案大小、修改時間相符且磁碟快取仍存在的紀錄
+
+        Args:
+            reload: 記憶體中的清單不符時重新讀取磁碟上的清單（其他 worker 可能已解析並寫入）
+        """
+        with self._lock:
+            entry = self._manifest.get(path)
+        if reload and not self._matches(entry, stat):
+            manifest = self._load_manifest()
+            with self._lock:
+                self._manifest = manifest
+            entry = manifest.get(path)
+        if self._matches(entry, stat) and os.path.exists(self._text_path(entry['sha256'])):
+            return entry
+        return None
+
+    def _entry(self, file_path: str) -> Optional[Dict[str, Any]]:
+        """
+        取得檔案目前有效的快取紀錄，必要時解析並寫入磁碟
+
+        不可在持有 _lock 時呼叫：解析（pdfplumber 可達數百毫秒）只持有該路徑的鎖，
+        同時請求同一檔案的執行緒等待第一個解析完成後直接使用其結果
+
+        Returns:
+            {'size', 'mtime_ns', 'sha256', 'length'}；檔案無法解析時返回 None
+        """
+        path = os.path.abspath(file_path)
+        stat = os.stat(path)
+        entry = self._valid_entry(path, stat)
+        if entry:
+            return entry
+
+        with self._path_lock(path):
+            # 等待期間其他執行緒（或其他 worker）可能已完成解析
+            stat = os.stat(path)
+            entry = self._valid_entry(path, stat, reload=True)
+            if entry:
+                return entry
+
+            # 大小或修改時間改變：以內容雜湊判斷是否真的需要重新解析
+            sha256 = file_sha256(path)
+            text, length = None, None
+            if os.path.exists(self._text_path(sha256)):
+                # 字元數優先取自清單；清單中沒有相同內容的紀錄（例如清單遺失）時才由檔案大小推算
+                # （文字檔以取代方式寫入，存在時必定完整）
+                length = self._known_length(sha256)
+                if length is None:
+                    length = os.path.getsize(self._text_path(sha256)) // _BYTES_PER_CHAR
+            else:
+                text = self.extractor(path)
+                if not text:
+                    return None
+                self._write_text(sha256, text)
+                length = len(text)
+
+            entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                     'sha256': sha256, 'length': length}
+            with self._lock:
+                self._texts.pop(path, None)
+                if text is None:
+                    self.disk_hits += 1
+                else:
+                    self._remember(path, text)
+                    self.misses += 1
+            self._save_entry(path, entry)
+            return entry
+
+    def _write_text(self, sha256: str, text: str):
+        data = text.encode(_ENCODING)
+        self._atomic_write(self._text_path(sha256), 'wb', lambda f: f.write(data))
+
+    def _remember(self, path: str, text: str):
+        self._texts[path] = text
+        self._texts.move_to_end(path)
+        while len(self._texts) > self.max_entries:
+            self._texts.popitem(last=False)
+
+    # ---- 對外介面 ----
+
+    def get_text(self, file_path: str) -> str:
+        """
+        取得檔案全文
+
+        Args:
+            file_path: 檔案路徑
+
+        Returns:
+            解析後的文字，無法解析時返回空字串
+        """
+        path = os.path.abspath(file_path)
+        entry = self._entry(path)
+        if entry is None:
+            return ""
+        with self._lock:
+            text = self._texts.get(path)
+            if text is not None:
+                self._texts.move_to_end(path)
+                self.hits += 1
+                return text
+        with open(self._text_path(entry['sha256']), 'rb') as f:
+            text = f.read().decode(_ENCODING)
+        with self._lock:
+            self._remember(path, text)
+            self.disk_hits += 1
+        return text
+
+    def get_length(self, file_path: str) -> int:
+        """取得檔案全文的字元數"""
+        entry = self._entry(file_path)
+        return entry['length'] if entry else 0
+
+    def get_sha256(self, file_path: str) -> Optional[str]:
+        """取得檔案內容雜湊，檔案不存在或無法解析時返回 None"""
+        try:
+            entry = self._entry(file_path)
+        except OSError:
+            return None
+        return entry['sha256'] if entry else None
+
+    def get_slice(self, file_path: str, start: int, length: int) -> str:
+        """
+        讀取全文中 [start, start + length) 的字元，不需載入整份文件
+
+        Args:
+            file_path: 檔案路徑
+            start: 起始字元位置
+            length: 字元數
+
+        Returns:
+            文字片段
+        """
+        path = os.path.abspath(file_path)
+        entry = self._entry(path)
+        if entry is None:
+            return ""
+        with self._lock:
+            text = self._texts.get(path)
+            if text is not None:
+                self.hits += 1
+                return text[start:start + length]
+            self.disk_hits += 1
+        start = max(0, min(start, entry['length']))
+        length = max(0, min(length, entry['length'] - start))
+        with open(self._text_path(entry['sha256']), 'rb') as f:
+            f.seek(start * _BYTES_PER_CHAR)
+            return f.read(length * _BYTES_PER_CHAR).decode(_ENCODING)
+
+    def clear(self):
+        """清空記憶體快取（磁碟快取保留）"""
+        with self._lock:
+            self._texts.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """取得快取統計"""
+        with self._lock:
+            return {
+                'memory_entries': len(self._texts),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses
+            }
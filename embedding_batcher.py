@@ -0,0 +1,150 @@
+# 嵌入微批次處理
+# 多個請求執行緒同時需要查詢向量時，先放入佇列，湊滿批次或等待數毫秒後以一次 encode() 處理，
+# 再把結果分別交給各請求的 Future，避免每個執行緒各自以批次大小 1 呼叫模型
+# 等待超過 timeout（背景執行緒卡住或佇列過長）時放棄排隊，改為直接編碼
+
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, Any, List, Optional
+
+import numpy as np
+
+from metrics import Histogram
+
+
+class EmbeddingBatcher:
+    """
+    嵌入微批次處理器
+    背景執行緒取出佇列中的請求：第一個請求到達後最多再等待 max_wait_ms，
+    或湊滿 max_batch_size 時送出；同一批次中相同的文字只計算一次
+    """
+
+    def __init__(self, encode: Callable[[List[str]], Any], max_batch_size: int = 32,
+                 max_wait_ms: float = 5.0, timeout_ms: float = 2000.0):
+        """
+        初始化批次處理器
+
+        Args:
+            encode: 批次編碼函式（文字列表 → 向量陣列）
+            max_batch_size: 每批最多的文字數
+            max_wait_ms: 第一個請求到達後最多等待的毫秒數
+            timeout_ms: encode() 等待批次結果的上限毫秒數，逾時改為直接編碼（0 表示不限制）
+        """
+        self._encode = encode
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.timeout = timeout_ms / 1000 if timeout_ms > 0 else None
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread = None
+        self._thread_pid = None
+        self._start_lock = threading.Lock()
+        self.queue_depth = Histogram('embedding_batcher_queue_depth',
+                                     "Pending embedding requests seen when a request is queued",
+                                     buckets=[0, 1, 2, 4, 8, 16, 32, 64, 128])
+        self.batch_size = Histogram('embedding_batcher_batch_size', "Distinct texts per encode() call",
+                                    buckets=[1, 2, 4, 8, 16, 32, 64])
+        # 計數由背景執行緒與請求執行緒同時更新
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.requests = 0
+        self.errors = 0
+        self.timeouts = 0
+
+    def _ensure_started(self):
+        # 執行緒無法跨 fork 存活，pre-fork 的 worker 第一次使用時各自啟動
+        if self._thread is None or self._thread_pid != os.getpid():
+            with self._start_lock:
+                if self._thread is None or self._thread_pid != os.getpid():
+                    self._queue = queue.Queue()
+                    self._thread = threading.Thread(target=self._run, name='embedding-batcher', daemon=True)
+                    self._thread_pid = os.getpid()
+                    self._thread.start()
+
+    def submit(self, text: str) -> Future:
+        """
+        排入一個文字
+
+        Returns:
+            完成時結果為 float32 向量的 Future
+        """
+        self._ensure_started()
+        future: Future = Future()
+        self.queue_depth.observe(self._queue.qsize())
+        self._queue.put((text, future))
+        return future
+
+    def encode(self, text: str, timeout: Optional[float] = None) -> np.ndarray:
+        """
+        排入文字並等待向量
+
+        Args:
+            text: 文字
+            timeout: 等待批次結果的秒數，未指定時使用建構時的 timeout_ms；逾時改為直接編碼
+
+        Returns:
+            float32 向量
+        """
+        future = self.submit(text)
+        try:
+            return future.result(timeout=self.timeout if timeout is None else timeout)
+        except FutureTimeoutError:
+            # 批次仍未完成：取消還在排隊的請求（已開始編碼的批次照常完成，結果不使用），直接以批次大小 1 編碼
+            future.cancel()
+            with self._stats_lock:
+                self.timeouts += 1
+            print("⚠️ 查詢嵌入批次等待逾時，改為直接編碼")
+            return np.asarray(self._encode([text]), dtype=np.float32)[0]
+
+    def _collect(self) -> List:
+        """等待第一個請求，再收集到批次上限或等待時間用完"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            # 等待逾時而取消的請求不再編碼
+            batch = [(text, future) for text, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            texts = list(dict.fromkeys(text for text, _ in batch))
+            self.batch_size.observe(len(texts))
+            with self._stats_lock:
+                self.batches += 1
+                self.requests += len(batch)
+            try:
+                vectors = np.asarray(self._encode(texts), dtype=np.float32)
+            except Exception as e:
+                with self._stats_lock:
+                    self.errors += 1
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            rows = {text: row for row, text in enumerate(texts)}
+            for text, future in batch:
+                future.set_result(vectors[rows[text]])
+
+    def stats(self) -> Dict[str, Any]:
+        """取得批次數、請求數、錯誤數、逾時改為直接編碼的次數，以及佇列深度與批次大小的直方圖"""
+        with self._stats_lock:
+            counts = {'batches': self.batches, 'requests': self.requests,
+                      'errors': self.errors, 'timeouts': self.timeouts}
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000,
+            **counts,
+            'queue_depth': self.queue_depth.snapshot(),
+            'batch_size': self.batch_size.snapshot()
+        }
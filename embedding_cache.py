@@ -0,0 +1,103 @@
+# 查詢向量快取
+# 以正規化後的查詢字串為鍵，快取嵌入模型輸出的 float32 向量（LRU 淘汰）
+
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Dict, Any, Optional
+
+import numpy as np
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_query(text: str) -> str:
+    """
+    正規化查詢字串作為快取鍵
+    NFKC 會把全形英數與標點轉為半形，casefold 處理大小寫，並將連續空白壓縮為單一空格
+    """
+    text = unicodedata.normalize('NFKC', text or '')
+    return _WHITESPACE_RE.sub(' ', text).strip().casefold()
+
+
+class EmbeddingCache:
+    """
+    執行緒安全的 LRU 查詢向量快取
+    命中時直接返回快取的向量，完全略過 transformer 前向計算
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        """
+        初始化快取
+
+        Args:
+            maxsize: 最多保留的查詢數量，0 表示停用快取
+        """
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, query: str) -> Optional[np.ndarray]:
+        """取得快取的向量，未命中時返回 None"""
+        key = normalize_query(query)
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return embedding
+
+    def put(self, query: str, embedding) -> np.ndarray:
+        """寫入快取（向量轉為唯讀 float32），必要時淘汰最久未使用的項目"""
+        vector = np.array(embedding, dtype=np.float32).reshape(-1)
+        vector.setflags(write=False)
+        if self.maxsize <= 0:
+            return vector
+        key = normalize_query(query)
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return vector
+
+    def get_or_compute(self, query: str, compute: Callable[[str], Any]) -> np.ndarray:
+        """
+        取得查詢向量，未命中時呼叫 compute 計算並寫入快取
+
+        Args:
+            query: 查詢文字
+            compute: 以正規化後的查詢字串計算向量的函式
+
+        Returns:
+            float32 查詢向量
+        """
+        embedding = self.get(query)
+        if embedding is not None:
+            return embedding
+        return self.put(query, compute(normalize_query(query)))
+
+    def clear(self):
+        """清空快取（統計數字保留）"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """取得命中、未命中與淘汰統計"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / total if total else 0.0
+            }
@@ -0,0 +1,275 @@
+# 嵌入模型載入
+# 模型在第一次需要向量時才匯入並載入，同一程序內共用同一個模型實例。
+# 後端以 EMBEDDING_BACKEND 選擇：
+#   torch - sentence_transformers（fp32 PyTorch）
+#   onnx  - 匯出的 ONNX Runtime 模型（預設使用動態 int8 量化版本），只需 onnxruntime 與 tokenizers，不需匯入 torch
+# 兩者提供相同的 encode() 介面
+
+import os
+import sys
+import threading
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+EMBEDDING_MODEL_NAME = 'sentence-transformers/all-MiniLM-L6-v2'
+MAX_SEQ_LENGTH = 256  # all-MiniLM-L6-v2 的最大序列長度
+
+_models: Dict[Tuple[str, str], object] = {}
+_lock = threading.Lock()
+_num_threads = 0
+
+
+def get_backend_name(backend: Optional[str] = None) -> str:
+    """取得嵌入後端名稱（torch 或 onnx），未指定時讀取環境變數 EMBEDDING_BACKEND"""
+    backend = (backend or os.getenv('EMBEDDING_BACKEND', 'torch')).strip().lower()
+    if backend not in ('torch', 'onnx'):
+        raise ValueError(f"不支援的嵌入後端: {backend}（可用: torch, onnx）")
+    return backend
+
+
+def get_onnx_model_dir(model_name: str = EMBEDDING_MODEL_NAME) -> str:
+    """ONNX 模型目錄，預設讀取環境變數 ONNX_MODEL_DIR"""
+    return os.getenv('ONNX_MODEL_DIR') or os.path.join('models', model_name.split('/')[-1] + '-onnx')
+
+
+def get_embedding_model(model_name: str = EMBEDDING_MODEL_NAME, backend: Optional[str] = None):
+    """
+    取得嵌入模型（首次呼叫時載入）
+
+    Args:
+        model_name: SentenceTransformer 模型名稱
+        backend: "torch" 或 "onnx"，未指定時讀取環境變數 EMBEDDING_BACKEND
+
+    Returns:
+        具有 encode() 的嵌入模型；ONNX 後端無法使用時退回 SentenceTransformer
+    """
+    backend = get_backend_name(backend)
+    key = (backend, model_name)
+    model = _models.get(key)
+    if model is None:
+        with _lock:
+            model = _models.get(key)
+            if model is None:
+                model = _load_model(model_name, backend)
+                _models[key] = model
+    return model
+
+
+def _load_model(model_name: str, backend: str):
+    if backend == 'onnx':
+        model_dir = get_onnx_model_dir(model_name)
+        quantized = os.getenv('ONNX_QUANTIZED', 'true').lower() == 'true'
+        try:
+            model = OnnxEmbeddingModel(model_dir, quantized=quantized, num_threads=_num_threads)
+            print(f"✅ ONNX 嵌入模型載入完成 ({model.model_path})")
+            return model
+        except (ImportError, FileNotFoundError) as e:
+            print(f"⚠️ 無法使用 ONNX 嵌入後端，改用 PyTorch: {str(e)}")
+
+    from sentence_transformers import SentenceTransformer
+    print("正在載入嵌入模型...")
+    model = SentenceTransformer(model_name)
+    print("✅ 嵌入模型載入完成")
+    return model
+
+
+def is_loaded(model_name: str = EMBEDDING_MODEL_NAME) -> bool:
+    """模型是否已載入（不會觸發載入）"""
+    return (get_backend_name(), model_name) in _models
+
+
+def set_num_threads(num_threads: int):
+    """設定嵌入運算執行緒數（多個 worker 共用 CPU 時避免執行緒過量）；尚未載入的後端在建立時套用"""
+    global _num_threads
+    if num_threads <= 0:
+        return
+    _num_threads = num_threads
+    if 'torch' in sys.modules:
+        sys.modules['torch'].set_num_threads(num_threads)
+    for model in _models.values():
+        if isinstance(model, OnnxEmbeddingModel):
+            model.set_num_threads(num_threads)
+
+
+class OnnxEmbeddingModel:
+    """
+    ONNX Runtime 句子嵌入模型
+    與 sentence-transformers 的 all-MiniLM-L6-v2 流程相同：WordPiece 分詞 → Transformer → mean pooling → L2 正規化。
+    InferenceSession 依程序建立（ONNX Runtime 的執行緒池無法跨 fork 使用），pre-fork 的 worker 各自建立
+    """
+
+    def __init__(self, model_dir: str, quantized: bool = True, max_seq_length: int = MAX_SEQ_LENGTH,
+                 num_threads: int = 0):
+        """
+        初始化模型
+
+        Args:
+            model_dir: 由 export_onnx_model() 輸出的目錄（含 model.onnx / model_int8.onnx 與 tokenizer.json）
+            quantized: 是否使用動態 int8 量化的模型
+            max_seq_length: 最大 token 數，超過的部分截斷
+            num_threads: ONNX Runtime 運算執行緒數，0 表示由 ONNX Runtime 決定
+        """
+        import onnxruntime  # noqa: F401 - 缺少套件時在此拋出 ImportError
+        from tokenizers import Tokenizer
+
+        self.model_path = os.path.join(model_dir, 'model_int8.onnx' if quantized else 'model.onnx')
+        tokenizer_path = os.path.join(model_dir, 'tokenizer.json')
+        for path in (self.model_path, tokenizer_path):
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"找不到 {path}，請先執行 python embeddings.py --export")
+
+        self.max_seq_length = max_seq_length
+        self.num_threads = num_threads
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.tokenizer.enable_truncation(max_length=max_seq_length)
+        self.tokenizer.no_padding()
+        self._session = None
+        self._session_pid = None
+        self._session_lock = threading.Lock()
+
+    def set_num_threads(self, num_threads: int):
+        """變更執行緒數（下次建立 session 時生效）"""
+        with self._session_lock:
+            self.num_threads = num_threads
+            self._session = None
+
+    def _get_session(self):
+        if self._session is None or self._session_pid != os.getpid():
+            with self._session_lock:
+                if self._session is None or self._session_pid != os.getpid():
+                    import onnxruntime as ort
+                    options = ort.SessionOptions()
+                    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+                    if self.num_threads:
+                        options.intra_op_num_threads = self.num_threads
+                    self._session = ort.InferenceSession(self.model_path, options,
+                                                         providers=['CPUExecutionProvider'])
+                    self._input_names = {node.name for node in self._session.get_inputs()}
+                    self._session_pid = os.getpid()
+        return self._session
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return int(self._get_session().get_outputs()[0].shape[-1])
+
+    def _encode_batch(self, encodings) -> np.ndarray:
+        length = max(len(encoding.ids) for encoding in encodings)
+        input_ids = np.zeros((len(encodings), length), dtype=np.int64)
+        attention_mask = np.zeros((len(encodings), length), dtype=np.int64)
+        token_type_ids = np.zeros((len(encodings), length), dtype=np.int64)
+        for row, encoding in enumerate(encodings):
+            size = len(encoding.ids)
+            input_ids[row, :size] = encoding.ids
+            attention_mask[row, :size] = encoding.attention_mask
+            token_type_ids[row, :size] = encoding.type_ids
+
+        session = self._get_session()
+        feeds = {'input_ids': input_ids, 'attention_mask': attention_mask,
+                 'token_type_ids': token_type_ids}
+        hidden = session.run(None, {name: value for name, value in feeds.items()
+                                    if name in self._input_names})[0]
+
+        # mean pooling（只平均實際 token，不含 padding）
+        mask = attention_mask[:, :, None].astype(np.float32)
+        return (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+    def encode(self, sentences: Union[str, List[str]], batch_size: int = 32,
+               convert_to_numpy: bool = True, normalize_embeddings: bool = True,
+               show_progress_bar: bool = False, **kwargs) -> np.ndarray:
+        """
+        生成句子向量（介面與 SentenceTransformer.encode 相容）
+
+        Args:
+            sentences: 句子或句子列表
+            batch_size: 每批句子數；句子依 token 長度排序後分批，減少 padding
+            normalize_embeddings: 是否 L2 正規化（all-MiniLM-L6-v2 的輸出本身即經過正規化）
+
+        Returns:
+            float32 向量陣列；輸入單一字串時返回一維向量
+        """
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.zeros((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+
+        encodings = self.tokenizer.encode_batch(texts)
+        order = np.argsort([len(encoding.ids) for encoding in encodings], kind='stable')
+        embeddings = np.empty((len(texts), 0), dtype=np.float32)
+        for start in range(0, len(order), batch_size):
+            rows = order[start:start + batch_size]
+            batch = self._encode_batch([encodings[row] for row in rows]).astype(np.float32)
+            if embeddings.shape[1] == 0:
+                embeddings = np.zeros((len(texts), batch.shape[1]), dtype=np.float32)
+            embeddings[rows] = batch
+
+        if normalize_embeddings:
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings = embeddings / np.clip(norms, 1e-12, None)
+        return embeddings[0] if single else embeddings
+
+
+def export_onnx_model(model_name: str = EMBEDDING_MODEL_NAME, output_dir: Optional[str] = None,
+                      quantize: bool = True, opset: int = 14) -> str:
+    """
+    將 SentenceTransformer 的 Transformer 匯出為 ONNX，並以動態 int8 量化產生 model_int8.onnx
+    （只需執行一次；需要 torch、transformers、onnx 與 onnxruntime）
+
+    Args:
+        model_name: Hugging Face 模型名稱
+        output_dir: 輸出目錄，預設為 get_onnx_model_dir()
+        quantize: 是否產生 int8 量化模型
+        opset: ONNX opset 版本
+
+    Returns:
+        輸出目錄
+    """
+    import torch
+    from transformers import AutoTokenizer, AutoModel
+
+    output_dir = output_dir or get_onnx_model_dir(model_name)
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name)
+    model.config.return_dict = False
+    model.eval()
+
+    sample = tokenizer(["匯出範例", "export sample"], padding=True, return_tensors='pt')
+    input_names = ['input_ids', 'attention_mask', 'token_type_ids']
+    fp32_path = os.path.join(output_dir, 'model.onnx')
+    print(f"📦 正在匯出 ONNX 模型: {fp32_path}")
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(sample[name] for name in input_names),
+            fp32_path,
+            input_names=input_names,
+            output_names=['last_hidden_state'],
+            dynamic_axes={name: {0: 'batch', 1: 'sequence'} for name in input_names + ['last_hidden_state']},
+            opset_version=opset
+        )
+    tokenizer.backend_tokenizer.save(os.path.join(output_dir, 'tokenizer.json'))
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        int8_path = os.path.join(output_dir, 'model_int8.onnx')
+        print(f"🗜️  正在進行動態 int8 量化: {int8_path}")
+        quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+
+    print(f"✅ ONNX 模型匯出完成: {output_dir}")
+    return output_dir
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="嵌入模型工具")
+    parser.add_argument('--export', action='store_true', help="匯出 ONNX 模型並進行 int8 量化")
+    parser.add_argument('--model', default=EMBEDDING_MODEL_NAME)
+    parser.add_argument('--output-dir', help="輸出目錄，預設讀取 ONNX_MODEL_DIR")
+    parser.add_argument('--no-quantize', action='store_true', help="只匯出 fp32 模型")
+    args = parser.parse_args()
+
+    if args.export:
+        export_onnx_model(args.model, args.output_dir, quantize=not args.no_quantize)
+    else:
+        parser.print_help()
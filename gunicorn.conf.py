@@ -0,0 +1,65 @@
+# Gunicorn 設定（python run.py --production）
+# 主程序預先載入應用程式與嵌入模型後再 fork worker，模型權重以 copy-on-write 在 worker 間共用
+#
+# 平滑重啟：kill -HUP <主程序 PID>，以預先載入的主程序重新 fork worker，進行中的請求在 graceful_timeout 內完成
+# 更新程式碼後需重新啟動容器（或 USR2 + QUIT 切換新的主程序）
+
+import gc
+import os
+import tempfile
+
+bind = f"{os.getenv('APP_HOST', '0.0.0.0')}:{os.getenv('APP_PORT', '5002')}"
+workers = int(os.getenv('GUNICORN_WORKERS', '2'))
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+worker_class = 'gthread'
+preload_app = True
+
+# /query/stream 以 SSE 串流回答，逾時需涵蓋完整的 Gemini 生成時間
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = 5
+
+# 每個 worker 處理指定數量的請求後自動重啟（0 為停用），加上隨機抖動避免同時重啟
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '0'))
+max_requests_jitter = max_requests // 10
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+# 每個 worker 的 torch 運算執行緒數，預設為 CPU 核心數平均分給各 worker
+torch_threads = int(os.getenv('EMBEDDING_THREADS', '0')) or max(1, (os.cpu_count() or 1) // workers)
+
+# 多個 worker 時，/metrics 合併各 worker 寫入此目錄的指標快照（未指定時使用暫存目錄）
+if workers > 1:
+    os.environ['METRICS_MULTIPROC_DIR'] = (os.getenv('METRICS_MULTIPROC_DIR')
+                                           or os.path.join(tempfile.gettempdir(), 'rag-metrics'))
+
+
+def on_starting(server):
+    """主程序啟動：清除上次執行留下的 worker 指標快照"""
+    directory = os.getenv('METRICS_MULTIPROC_DIR')
+    if directory:
+        import metrics
+        metrics.reset_multiprocess_dir(directory)
+
+
+def when_ready(server):
+    """主程序：載入模型權重後凍結 GC，fork 出的 worker 不會因 GC 觸碰共用物件而複製記憶體頁"""
+    import app
+    app.preload()
+    gc.collect()
+    gc.freeze()
+    server.log.info("模型已預先載入，開始 fork %s 個 worker（每個 %s 執行緒）", workers, threads)
+
+
+def post_fork(server, worker):
+    """worker：重建網路連線並在背景預熱與啟動題庫補題"""
+    import app
+    app.init_worker(torch_threads=torch_threads)
+
+
+def child_exit(server, worker):
+    """worker 結束：刪除它的指標快照（重啟後的新 worker 從 0 開始計數）"""
+    import metrics
+    metrics.remove_snapshot(worker.pid)
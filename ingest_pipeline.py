@@ -0,0 +1,340 @@
+# 管線化資料匯入
+# 解析、分塊、嵌入與上傳以生產者/消費者方式重疊執行：
+#   檔案（多檔並行）→ PDF 逐頁解析（程序池）→ 分塊 → 依長度排序的批次嵌入 → 有上限的並行上傳
+
+import os
+import time
+import queue
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+from typing import Callable, Iterable, Iterator, List, Dict, Any, Optional, Tuple
+
+from pdf_pages import count_pdf_pages, iter_pdf_pages
+
+_DONE = object()
+
+
+def with_retries(action: Callable[[], Any], description: str, max_retries: int = 3):
+    """執行索引操作，失敗時以指數退避重試；重試耗盡後拋出例外"""
+    for attempt in range(max_retries):
+        try:
+            return action()
+        except Exception as e:
+            print(f"⚠️  {description}失敗 (嘗試 {attempt + 1}/{max_retries}): {str(e)}")
+            if attempt == max_retries - 1:
+                raise
+            time.sleep(2 ** attempt)
+
+
+def extract_pdf_page_range(file_path: str, start: int, end: int) -> List[Tuple[int, str]]:
+    """解析 PDF 中 [start, end) 頁的文字（在程序池中執行），返回 (頁碼, 文字) 列表"""
+    return list(iter_pdf_pages(file_path, start, end))
+
+
+class StageStats:
+    """單一階段的處理量與忙碌時間統計"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.calls = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, items: int, seconds: float):
+        with self._lock:
+            self.items += items
+            self.calls += 1
+            self.busy_seconds += seconds
+
+    def summary(self, wall_seconds: float) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'items': self.items,
+                'calls': self.calls,
+                'busy_seconds': self.busy_seconds,
+                'items_per_second': self.items / self.busy_seconds if self.busy_seconds else 0.0,
+                'utilization': self.busy_seconds / wall_seconds if wall_seconds else 0.0
+            }
+
+
+class IngestPipeline:
+    """
+    管線化匯入器
+    各階段透過有界佇列連接，下游較慢時上游自動等待（背壓），不會把整批資料堆在記憶體中
+    """
+
+    STAGES = ('extract', 'chunk', 'embed', 'upsert')
+
+    def __init__(self, index, chunk: Callable[[str], List[str]],
+                 chunk_pages: Callable[[Iterable[Tuple[int, str]]], Iterable[Tuple[str, int]]],
+                 embed: Callable[[List[str]], List[List[float]]],
+                 read_text: Callable[[str], str],
+                 file_workers: int = 2, extract_workers: Optional[int] = None,
+                 pages_per_task: int = 8, embed_batch_size: int = 64,
+                 embed_buffer_size: int = 512, embed_max_wait: float = 0.05,
+                 upsert_batch_size: int = 100, upsert_concurrency: int = 4,
+                 queue_size: int = 2048):
+        """
+        初始化匯入管線
+
+        Args:
+            index: 目標向量索引
+            chunk: 分塊函式（文字 → 文字塊列表），用於 TXT
+            chunk_pages: 逐頁分塊函式（(頁碼, 文字) → (文字塊, 頁碼)），用於 PDF
+            embed: 嵌入函式（文字塊列表 → 向量列表）
+            read_text: 讀取 TXT 檔案的函式
+            file_workers: 同時處理的檔案數
+            extract_workers: PDF 解析程序數，預設為 CPU 核心數（最多 4）
+            pages_per_task: 每個解析工作處理的頁數
+            embed_batch_size: 每次呼叫嵌入模型的文字塊數
+            embed_buffer_size: 依長度排序前最多累積的文字塊數
+            embed_max_wait: 等待湊滿批次的最長秒數
+            upsert_batch_size: 每次上傳的向量數
+            upsert_concurrency: 同時進行的上傳數
+            queue_size: 待嵌入佇列上限
+        """
+        self.index = index
+        self.chunk = chunk
+        self.chunk_pages = chunk_pages
+        self.embed = embed
+        self.read_text = read_text
+        self.file_workers = file_workers
+        self.extract_workers = extract_workers or min(4, os.cpu_count() or 1)
+        self.pages_per_task = pages_per_task
+        self.embed_batch_size = embed_batch_size
+        self.embed_buffer_size = embed_buffer_size
+        self.embed_max_wait = embed_max_wait
+        self.upsert_batch_size = upsert_batch_size
+        self.upsert_concurrency = upsert_concurrency
+        self.queue_size = queue_size
+
+    # ---- 解析與分塊（生產者） ----
+
+    def _iter_pages(self, file_path: str, page_pool: ProcessPoolExecutor,
+                    waited: List[float]) -> Iterator[Tuple[int, str]]:
+        """
+        PDF 依頁數切成多個範圍交給程序池平行解析，依頁序逐頁產出；
+        同時進行的範圍數有上限，已解析但尚未分塊的頁面不會無限累積。等待解析的秒數累加到 waited[0]
+        """
+        start = time.perf_counter()
+        num_pages = count_pdf_pages(file_path)
+        ranges = [(first, min(first + self.pages_per_task, num_pages))
+                  for first in range(0, num_pages, self.pages_per_task)]
+        in_flight = []
+        next_range = 0
+        while next_range < len(ranges) or in_flight:
+            while next_range < len(ranges) and len(in_flight) < self.extract_workers * 2:
+                in_flight.append(page_pool.submit(extract_pdf_page_range, file_path, *ranges[next_range]))
+                next_range += 1
+            pages = in_flight.pop(0).result()
+            elapsed = time.perf_counter() - start
+            waited[0] += elapsed
+            self.stats['extract'].record(len(pages), elapsed)
+            yield from pages
+            start = time.perf_counter()
+
+    def _chunk(self, file_path: str, page_pool: ProcessPoolExecutor) -> List[Tuple[str, Optional[int]]]:
+        """讀取並分塊；PDF 的頁面解析與分塊交錯進行"""
+        if not file_path.lower().endswith('.pdf'):
+            start = time.perf_counter()
+            text = self.read_text(file_path)
+            self.stats['extract'].record(1, time.perf_counter() - start)
+            start = time.perf_counter()
+            chunks = [(chunk, None) for chunk in self.chunk(text)] if text else []
+            self.stats['chunk'].record(len(chunks), time.perf_counter() - start)
+            return chunks
+
+        waited = [0.0]
+        start = time.perf_counter()
+        chunks = list(self.chunk_pages(self._iter_pages(file_path, page_pool, waited)))
+        # 分塊耗時 = 總耗時扣除等待解析的時間
+        self.stats['chunk'].record(len(chunks), time.perf_counter() - start - waited[0])
+        return chunks
+
+    def _produce(self, file_path: str, page_pool: ProcessPoolExecutor,
+                 plan: Callable[[str, List[Tuple[str, Optional[int]]]], List[Dict[str, Any]]],
+                 embed_queue: "queue.Queue"):
+        result = self.results[file_path]
+        try:
+            chunks = self._chunk(file_path, page_pool)
+            if not chunks:
+                raise ValueError("檔案內容為空或讀取失敗")
+
+            items = plan(file_path, chunks)
+            result['chunks'] = len(chunks)
+            result['planned'] = len(items)
+            for item in items:
+                embed_queue.put((file_path, item))
+        except Exception as e:
+            result['error'] = str(e)
+            print(f"❌ 處理 {file_path} 時發生錯誤: {str(e)}")
+
+    # ---- 嵌入（單一消費者，批次化） ----
+
+    def _embed_loop(self, embed_queue: "queue.Queue", upsert_pool: ThreadPoolExecutor,
+                    on_upserted: Callable[[List[Dict[str, Any]]], None]):
+        pending = []
+        finished = False
+        while not finished:
+            try:
+                entry = embed_queue.get(timeout=self.embed_max_wait)
+            except queue.Empty:
+                entry = None
+            if entry is _DONE:
+                finished = True
+            elif entry is not None:
+                pending.append(entry)
+
+            # 佇列暫時沒有資料、緩衝區已滿或輸入結束時送出
+            if pending and (finished or entry is None or len(pending) >= self.embed_buffer_size):
+                self._embed_and_dispatch(pending, upsert_pool, on_upserted)
+                pending = []
+
+    def _embed_and_dispatch(self, pending: List, upsert_pool: ThreadPoolExecutor,
+                            on_upserted: Callable[[List[Dict[str, Any]]], None]):
+        """依文字長度排序後分批嵌入（減少批次內的 padding），再切成上傳批次"""
+        pending.sort(key=lambda entry: len(entry[1]['text']))
+        vectors = []
+        for start in range(0, len(pending), self.embed_batch_size):
+            batch = pending[start:start + self.embed_batch_size]
+            began = time.perf_counter()
+            try:
+                embeddings = self.embed([item['text'] for _, item in batch])
+            except Exception as e:
+                self._fail([file_path for file_path, _ in batch], f"嵌入失敗: {str(e)}")
+                continue
+            self.stats['embed'].record(len(batch), time.perf_counter() - began)
+            vectors.extend(zip(batch, embeddings))
+
+        for start in range(0, len(vectors), self.upsert_batch_size):
+            self._upsert_slots.acquire()
+            future = upsert_pool.submit(self._upsert, vectors[start:start + self.upsert_batch_size],
+                                        on_upserted)
+            future.add_done_callback(lambda _: self._upsert_slots.release())
+
+    # ---- 上傳（有上限的並行） ----
+
+    def _upsert(self, batch: List, on_upserted: Callable[[List[Dict[str, Any]]], None]):
+        began = time.perf_counter()
+        try:
+            with_retries(lambda: self.index.upsert(vectors=[{
+                'id': item['id'],
+                'values': list(map(float, embedding)),
+                'metadata': {**item['metadata'], 'text': item['text']}
+            } for (_, item), embedding in batch]), "上傳批次")
+        except Exception as e:
+            self._fail([file_path for (file_path, _), _ in batch], f"上傳失敗: {str(e)}")
+            return
+        self.stats['upsert'].record(len(batch), time.perf_counter() - began)
+
+        with self._results_lock:
+            for (file_path, _), _ in batch:
+                self.results[file_path]['upserted'] += 1
+        # 回呼（記錄檢查點）在上傳執行緒中執行，future 的結果不會被讀取：例外必須在這裡轉為檔案錯誤
+        try:
+            on_upserted([item for (_, item), _ in batch])
+        except Exception as e:
+            self._fail([file_path for (file_path, _), _ in batch], f"記錄檢查點失敗: {str(e)}")
+
+    # ---- 元數據更新 ----
+
+    def update_metadata(self, ids: List[str], metadata_list: List[Dict[str, Any]]):
+        """
+        批次合併多個向量的部分元數據（在 plan 回呼中使用）
+        索引提供 update_metadata() 時一次完成（本地索引）；Pinecone 沒有批次更新 API，
+        改在上傳執行緒池並行送出 update()，全部完成後才返回
+
+        Raises:
+            Exception: 任一更新重試耗盡
+        """
+        if not ids:
+            return
+        bulk = getattr(self.index, 'update_metadata', None)
+        if bulk is not None:
+            with_retries(lambda: bulk(ids, metadata_list), "更新元數據")
+            return
+        pool = getattr(self, '_upsert_pool', None)
+        if pool is None:
+            # 不在 run() 期間呼叫時使用臨時的執行緒池
+            with ThreadPoolExecutor(max_workers=self.upsert_concurrency,
+                                    thread_name_prefix='ingest-upsert') as pool:
+                self._dispatch_updates(pool, ids, metadata_list)
+        else:
+            self._dispatch_updates(pool, ids, metadata_list)
+
+    def _dispatch_updates(self, pool: ThreadPoolExecutor, ids: List[str],
+                          metadata_list: List[Dict[str, Any]]):
+        futures = [pool.submit(with_retries, partial(self.index.update, id=vector_id, set_metadata=metadata),
+                               "更新元數據")
+                   for vector_id, metadata in zip(ids, metadata_list)]
+        for future in futures:
+            future.result()
+
+    def _fail(self, file_paths: List[str], message: str):
+        with self._results_lock:
+            for file_path in set(file_paths):
+                self.results[file_path]['error'] = message
+
+    # ---- 執行 ----
+
+    def run(self, file_paths: List[str],
+            plan: Callable[[str, List[str]], List[Dict[str, Any]]],
+            on_upserted: Callable[[List[Dict[str, Any]]], None]) -> Dict[str, Any]:
+        """
+        執行匯入
+
+        Args:
+            file_paths: 要處理的檔案
+            plan: 收到 (檔案路徑, 文字塊列表) 後返回需要嵌入的項目
+                  [{'id', 'text', 'metadata'}, ...]（可在此處理刪除，元數據更新使用 update_metadata()）
+            on_upserted: 每個上傳批次成功後以該批項目呼叫（用於記錄檢查點）
+
+        Returns:
+            {'files': 每個檔案的處理結果, 'stages': 各階段統計, 'wall_seconds': 總耗時}
+        """
+        self.stats = {name: StageStats(name) for name in self.STAGES}
+        self.results = {file_path: {'chunks': 0, 'planned': 0, 'upserted': 0, 'error': None}
+                        for file_path in file_paths}
+        self._results_lock = threading.Lock()
+        self._upsert_slots = threading.BoundedSemaphore(self.upsert_concurrency * 2)
+        embed_queue: "queue.Queue" = queue.Queue(maxsize=self.queue_size)
+
+        started = time.perf_counter()
+        # 解析程序以 spawn 啟動：此時嵌入與上傳執行緒已在執行、torch 可能已載入，fork 可能死結
+        with ProcessPoolExecutor(max_workers=self.extract_workers,
+                                 mp_context=multiprocessing.get_context('spawn')) as page_pool, \
+                ThreadPoolExecutor(max_workers=self.upsert_concurrency,
+                                   thread_name_prefix='ingest-upsert') as upsert_pool:
+            self._upsert_pool = upsert_pool
+            embed_thread = threading.Thread(target=self._embed_loop, name='ingest-embed',
+                                            args=(embed_queue, upsert_pool, on_upserted))
+            embed_thread.start()
+            try:
+                with ThreadPoolExecutor(max_workers=self.file_workers,
+                                        thread_name_prefix='ingest-file') as file_pool:
+                    list(file_pool.map(
+                        lambda file_path: self._produce(file_path, page_pool, plan, embed_queue),
+                        file_paths))
+            finally:
+                embed_queue.put(_DONE)
+                embed_thread.join()
+                self._upsert_pool = None
+        wall_seconds = time.perf_counter() - started
+
+        return {
+            'files': self.results,
+            'stages': {name: stats.summary(wall_seconds) for name, stats in self.stats.items()},
+            'wall_seconds': wall_seconds
+        }
+
+
+def print_stage_report(report: Dict[str, Any]):
+    """輸出各階段處理量，找出匯入時間花在哪裡"""
+    print(f"\n⏱️  匯入耗時 {report['wall_seconds']:.2f}s，各階段統計:")
+    print(f"   {'階段':<8}{'項目數':>10}{'忙碌秒數':>12}{'項目/秒':>12}{'使用率':>10}")
+    for name, stage in report['stages'].items():
+        print(f"   {name:<8}{stage['items']:>10}{stage['busy_seconds']:>12.2f}"
+              f"{stage['items_per_second']:>12.1f}{stage['utilization']:>10.0%}")
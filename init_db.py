@@ -1,38 +1,66 @@
 #!/usr/bin/env python3
 """
 資料庫初始化腳本
-用於將文件上傳到 Pinecone 向量資料庫
+用於將文件上傳到向量資料庫（Pinecone 或本地索引）
 """
 
 import os
 import sys
+import json
+import time
+import argparse
+import threading
+from typing import Callable, List, Dict, Any, Optional, Tuple
 from dotenv import load_dotenv
-from vectorStore import process_file, create_or_connect_index
-from pinecone import Pinecone
+from vectorStore import (create_or_connect_index, read_text_file, chunk_text, chunk_pages,
+                         generate_embeddings, make_chunk_ids, INDEX_NAME)
+from vector_index import get_backend_name, flush_index
+from clients import get_pinecone_client, get_pinecone_index, index_exists, forget_index
+from lexical_index import LexicalIndex, get_lexical_index_path
+from ingest_pipeline import IngestPipeline, with_retries, print_stage_report
+
+# 匯入清單：記錄已寫入索引的文字塊，用於增量同步與中斷後續傳
+MANIFEST_PATH = os.getenv('INGEST_MANIFEST', 'ingest_manifest.json')
+UPSERT_BATCH_SIZE = 100
+MANIFEST_LOCK = threading.RLock()
+# 本地索引的變更先留在記憶體，每隔此秒數寫入磁碟並記錄檢查點
+CHECKPOINT_SECONDS = float(os.getenv('INGEST_CHECKPOINT_SECONDS', '30'))
+_last_checkpoint = 0.0
 
 def clear_index():
-    """清除 Pinecone 索引中的所有向量"""
+    """清除向量索引中的所有向量"""
     print("🗑️  正在清除向量資料庫...")
     
     try:
         load_dotenv()
+        if get_backend_name() != "pinecone":
+            index = create_or_connect_index()
+            total_vectors = index.describe_index_stats().get('total_vector_count', 0)
+            if total_vectors == 0:
+                print("ℹ️  索引為空，無需清除")
+                return True
+            print(f"📊 發現 {total_vectors} 個向量，正在清除...")
+            index.delete(delete_all=True)
+            flush_index(index)
+            print("✅ 向量資料庫清除完成")
+            return True
+        
         pinecone_api_key = os.getenv('PINECONE_API_KEY')
         
         if not pinecone_api_key or pinecone_api_key == 'your_pinecone_api_key_here':
             print("❌ PINECONE_API_KEY 未設定")
             return False
         
-        pc = Pinecone(api_key=pinecone_api_key)
+        pc = get_pinecone_client(pinecone_api_key)
         index_name = "text-chunks-index"
         
         # 檢查索引是否存在
-        existing_indexes = pc.list_indexes()
-        if index_name not in [idx.name for idx in existing_indexes]:
+        if not index_exists(index_name, pinecone_api_key):
             print("ℹ️  索引不存在，無需清除")
             return True
         
         # 連接到索引
-        index = pc.Index(index_name)
+        index = get_pinecone_index(index_name, pinecone_api_key)
         
         # 獲取索引統計信息
         stats = index.describe_index_stats()
@@ -46,10 +74,10 @@ def clear_index():
         
         # 刪除索引並重新創建
         pc.delete_index(index_name)
+        forget_index(index_name, pinecone_api_key)
         print("✅ 索引已刪除")
         
         # 等待刪除完成
-        import time
         time.sleep(5)
         
         print("✅ 向量資料庫清除完成")
@@ -59,8 +87,153 @@ def clear_index():
         print(f"❌ 清除向量資料庫時發生錯誤: {str(e)}")
         return False
 
-def main():
-    """主函數"""
+def load_manifest(index_key: str) -> Dict[str, Any]:
+    """
+    載入匯入清單（記錄每個檔案已成功寫入索引的文字塊 ID）
+    
+    Args:
+        index_key: 目前的索引識別（後端 + 索引名稱或路徑），與清單不符時視為空清單
+    """
+    try:
+        with open(MANIFEST_PATH, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('index') == index_key:
+            return manifest
+        print("ℹ️  匯入清單屬於其他索引，將重新匯入所有文件")
+    except (OSError, ValueError):
+        pass
+    return {'index': index_key, 'files': {}}
+
+def save_manifest(manifest: Dict[str, Any]):
+    """寫入匯入清單（先寫暫存檔再原子替換，作為中斷後續傳的檢查點）"""
+    tmp_path = MANIFEST_PATH + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+def checkpoint(index, manifest: Dict[str, Any], force: bool = True):
+    """
+    記錄檢查點：先將本地索引的變更寫入磁碟，再寫入匯入清單，清單不會記錄尚未持久化的向量
+    
+    Args:
+        force: False 時本地索引距上次檢查點未滿 CHECKPOINT_SECONDS 秒則略過
+               （Pinecone 的寫入即時生效，每次都直接寫入清單）
+    """
+    global _last_checkpoint
+    with MANIFEST_LOCK:
+        if (not force and getattr(index, 'flush', None) is not None
+                and time.monotonic() - _last_checkpoint < CHECKPOINT_SECONDS):
+            return
+        flush_index(index)
+        save_manifest(manifest)
+        _last_checkpoint = time.monotonic()
+
+def plan_file(index, source_file: str, chunk_pairs: List[Tuple[str, Optional[int]]],
+              manifest: Dict[str, Any], chunk_size: int = 500,
+              chunk_overlap: int = 50, lexical_index: Optional[LexicalIndex] = None,
+              update_metadata: Optional[Callable[[List[str], List[Dict[str, Any]]], None]] = None
+              ) -> List[Dict[str, Any]]:
+    """
+    比對檔案的文字塊與匯入清單：位置變更的文字塊只更新 chunk_index，已不存在的文字塊從索引刪除，
+    新增或變更的文字塊交給匯入管線嵌入與上傳
+    
+    Args:
+        chunk_pairs: (文字塊, 頁碼) 列表，TXT 檔案的頁碼為 None
+        lexical_index: 關鍵字索引；不需嵌入，直接以檔案目前的全部文字塊更新
+        update_metadata: 批次更新元數據的函式（IngestPipeline.update_metadata，Pinecone 時並行送出），
+                         未指定時使用索引的 update_metadata()
+    
+    Returns:
+        需要嵌入的項目 [{'id', 'text', 'metadata'}, ...]
+    """
+    chunks = [chunk for chunk, _ in chunk_pairs]
+    pages = [page for _, page in chunk_pairs]
+    chunk_ids = make_chunk_ids(source_file, chunks)
+    desired = {chunk_id: i for i, chunk_id in enumerate(chunk_ids)}
+    
+    with MANIFEST_LOCK:
+        entry = manifest['files'].setdefault(source_file, {'chunks': {}})
+        existing = dict(entry['chunks'])
+    moved = [chunk_id for chunk_id in chunk_ids
+             if chunk_id in existing and existing[chunk_id] != desired[chunk_id]]
+    to_delete = [chunk_id for chunk_id in existing if chunk_id not in desired]
+    
+    # 內容未變但位置改變的文字塊：只更新 chunk_index 與頁碼，不重新嵌入（一次批次更新）
+    moved_metadata = []
+    for chunk_id in moved:
+        position = desired[chunk_id]
+        metadata = {"chunk_index": position}
+        if pages[position] is not None:
+            metadata["page"] = pages[position]
+        moved_metadata.append(metadata)
+    if moved:
+        if update_metadata is None:
+            update_metadata = lambda ids, metadata_list: with_retries(
+                lambda: index.update_metadata(ids, metadata_list), "更新元數據")
+        update_metadata(moved, moved_metadata)
+    
+    # 已不存在的文字塊：從索引刪除
+    for start in range(0, len(to_delete), UPSERT_BATCH_SIZE):
+        batch_ids = to_delete[start:start + UPSERT_BATCH_SIZE]
+        with_retries(lambda: index.delete(ids=batch_ids), "刪除向量")
+    
+    if moved or to_delete:
+        with MANIFEST_LOCK:
+            for chunk_id in moved:
+                entry['chunks'][chunk_id] = desired[chunk_id]
+            for chunk_id in to_delete:
+                entry['chunks'].pop(chunk_id, None)
+            checkpoint(index, manifest)
+    
+    metadata_list = [{
+        "source_file": source_file,
+        "chunk_size": chunk_size,
+        "chunk_overlap": chunk_overlap,
+        "text_length": len(chunk),
+        "chunk_index": position,
+        **({"page": pages[position]} if pages[position] is not None else {})
+    } for position, chunk in enumerate(chunks)]
+    if lexical_index is not None:
+        lexical_index.set_file(source_file, chunk_ids,
+                               [{**metadata, "text": chunk} for metadata, chunk in zip(metadata_list, chunks)])
+    
+    to_add = [chunk_id for chunk_id in chunk_ids if chunk_id not in existing]
+    print(f"📖 {source_file}: 新增 {len(to_add)}，位置更新 {len(moved)}，"
+          f"刪除 {len(to_delete)}，未變更 {len(chunk_ids) - len(to_add) - len(moved)}")
+    return [{
+        'id': chunk_id,
+        'text': chunks[desired[chunk_id]],
+        'metadata': metadata_list[desired[chunk_id]]
+    } for chunk_id in to_add]
+
+def record_upserted(index, manifest: Dict[str, Any], items: List[Dict[str, Any]]):
+    """上傳批次成功後記錄檢查點，下次執行從這裡繼續"""
+    with MANIFEST_LOCK:
+        for item in items:
+            metadata = item['metadata']
+            manifest['files'][metadata['source_file']]['chunks'][item['id']] = metadata['chunk_index']
+        checkpoint(index, manifest, force=False)
+
+def remove_file(index, source_file: str, manifest: Dict[str, Any]):
+    """刪除已從 data/ 移除之檔案的所有向量"""
+    existing = manifest['files'][source_file]['chunks']
+    chunk_ids = list(existing)
+    for start in range(0, len(chunk_ids), UPSERT_BATCH_SIZE):
+        batch_ids = chunk_ids[start:start + UPSERT_BATCH_SIZE]
+        with_retries(lambda: index.delete(ids=batch_ids), "刪除向量")
+        for chunk_id in batch_ids:
+            existing.pop(chunk_id, None)
+    del manifest['files'][source_file]
+    checkpoint(index, manifest)
+    print(f"🗑️  已移除 {source_file} 的 {len(chunk_ids)} 個向量")
+
+def main(full_rebuild: bool = False):
+    """
+    主函數：以增量方式同步 data/ 目錄與向量索引
+    
+    Args:
+        full_rebuild: 是否清除整個索引後重新匯入
+    """
     print("=" * 60)
     print("🚀 RAG 系統資料庫初始化")
     print("=" * 60)
@@ -68,22 +241,29 @@ def main():
     # 載入環境變數
     load_dotenv()
     
-    # 檢查環境變數
+    # 檢查環境變數（本地索引後端不需要 Pinecone 金鑰）
     pinecone_api_key = os.getenv('PINECONE_API_KEY')
-    if not pinecone_api_key or pinecone_api_key == 'your_pinecone_api_key_here':
+    if get_backend_name() == "pinecone" and (
+            not pinecone_api_key or pinecone_api_key == 'your_pinecone_api_key_here'):
         print("❌ 請在 .env 檔案中設定有效的 PINECONE_API_KEY")
         return
     
-    # 先清除向量資料庫
-    if not clear_index():
-        print("❌ 清除向量資料庫失敗，操作已取消")
-        return
+    # 完整重建時先清除向量資料庫
+    if full_rebuild:
+        if not clear_index():
+            print("❌ 清除向量資料庫失敗，操作已取消")
+            return
+        if os.path.exists(MANIFEST_PATH):
+            os.remove(MANIFEST_PATH)
+        lexical_index = LexicalIndex(get_lexical_index_path())
+        lexical_index.clear()
+        lexical_index.save()
     
     # 檢查是否有文件需要處理
     files_to_process = []
     
     # 檢查支援的文件格式 (.txt 和 .pdf)
-    for file in os.listdir('data'):
+    for file in sorted(os.listdir('data')):
         if file.endswith(('.txt', '.pdf')):
             files_to_process.append(os.path.join('data', file))
     
@@ -92,7 +272,7 @@ def main():
         print("請將您的 .txt 或 .pdf 文件放在 data/ 目錄中")
         return
     
-    print(f"📁 找到 {len(files_to_process)} 個文件需要處理:")
+    print(f"📁 找到 {len(files_to_process)} 個文件需要同步:")
     for file in files_to_process:
         print(f"   - {file}")
     
@@ -102,38 +282,99 @@ def main():
         print("❌ 操作已取消")
         return
     
-    # 處理每個文件
-    for file in files_to_process:
-        print(f"\n📖 正在處理文件: {file}")
-        print("-" * 40)
-        
-        try:
-            process_file(file, chunk_size=500, chunk_overlap=50)
-            print(f"✅ {file} 處理完成")
-        except Exception as e:
-            print(f"❌ 處理 {file} 時發生錯誤: {str(e)}")
+    index = create_or_connect_index()
+    if index is None:
+        print("❌ 無法創建或連接到向量索引，操作已取消")
+        return
+    
+    backend = get_backend_name()
+    index_key = f"{backend}:{getattr(index, 'path', INDEX_NAME)}"
+    manifest = load_manifest(index_key)
+    if manifest['files'] and index.describe_index_stats().get('total_vector_count', 0) == 0:
+        print("ℹ️  索引為空，忽略既有的匯入清單")
+        manifest = {'index': index_key, 'files': {}}
+    
+    # 已從 data/ 移除的檔案
+    current_files = {os.path.basename(file) for file in files_to_process}
+    for source_file in [name for name in manifest['files'] if name not in current_files]:
+        remove_file(index, source_file, manifest)
+    lexical_index = LexicalIndex(get_lexical_index_path())
+    lexical_index.retain_files(current_files)
+    
+    # 以管線同步所有文件：解析、分塊、嵌入與上傳重疊執行
+    pipeline = IngestPipeline(
+        index,
+        chunk=lambda text: chunk_text(text, chunk_size=500, chunk_overlap=50),
+        chunk_pages=lambda pages: chunk_pages(pages, chunk_size=500, chunk_overlap=50),
+        embed=generate_embeddings,
+        read_text=read_text_file,
+        file_workers=int(os.getenv('INGEST_FILE_WORKERS', '2')),
+        extract_workers=int(os.getenv('INGEST_EXTRACT_WORKERS', '0')) or None,
+        embed_batch_size=int(os.getenv('INGEST_EMBED_BATCH_SIZE', '64')),
+        upsert_batch_size=UPSERT_BATCH_SIZE,
+        upsert_concurrency=int(os.getenv('INGEST_UPSERT_CONCURRENCY', '4'))
+    )
+    report = pipeline.run(
+        files_to_process,
+        plan=lambda file_path, chunks: plan_file(index, os.path.basename(file_path), chunks, manifest,
+                                                 chunk_size=500, chunk_overlap=50,
+                                                 lexical_index=lexical_index,
+                                                 update_metadata=pipeline.update_metadata),
+        on_upserted=lambda items: record_upserted(index, manifest, items)
+    )
+    # 本地索引在這裡一次寫入磁碟
+    checkpoint(index, manifest)
+    
+    # 關鍵字索引不需嵌入，所有文件分塊後一次編譯倒排串列
+    lexical_index.save()
+    print(f"🔤 關鍵字索引已更新: {lexical_index.describe_index_stats()}")
+    
+    failed = []
+    for file, result in report['files'].items():
+        if result['error']:
+            failed.append(file)
+            print(f"❌ {file} 未完成: {result['error']}")
+        else:
+            print(f"✅ {file} 同步完成：{result['chunks']} 個文字塊，上傳 {result['upserted']} 個")
+    print_stage_report(report)
+    
+    # 近似最近鄰索引（IVF）在所有文件寫入後一次建立群集
+    if hasattr(index, 'build'):
+        print("\n🧭 正在建立 IVF 近似搜尋索引...")
+        index.build()
     
     print("\n" + "=" * 60)
-    print("🎉 資料庫初始化完成！")
+    if failed:
+        print(f"⚠️  {len(failed)} 個文件未完成，已完成的批次已記錄在 {MANIFEST_PATH}")
+        print("   重新執行 python init_db.py 即可從檢查點繼續")
+    else:
+        print("🎉 資料庫初始化完成！")
     print("=" * 60)
     print("現在您可以啟動 Flask 應用程式:")
     print("   python app.py")
     print("=" * 60)
 
 def test_connection():
-    """測試 Pinecone 連接"""
+    """測試向量資料庫連接"""
+    load_dotenv()
+    if get_backend_name() != "pinecone":
+        print("🔍 檢查本地向量索引...")
+        index = create_or_connect_index()
+        if index is None:
+            return False
+        print(f"📊 索引統計: {index.describe_index_stats()}")
+        return True
+    
     print("🔍 測試 Pinecone 連接...")
     
     try:
-        load_dotenv()
         pinecone_api_key = os.getenv('PINECONE_API_KEY')
         
         if not pinecone_api_key or pinecone_api_key == 'your_pinecone_api_key_here':
             print("❌ PINECONE_API_KEY 未設定")
             return False
         
-        pc = Pinecone(api_key=pinecone_api_key)
-        indexes = pc.list_indexes()
+        indexes = get_pinecone_client(pinecone_api_key).list_indexes()
         
         print(f"✅ Pinecone 連接成功")
         print(f"📊 可用索引: {[idx.name for idx in indexes]}")
@@ -144,7 +385,12 @@ def test_connection():
         return False
 
 if __name__ == "__main__":
-    if len(sys.argv) > 1 and sys.argv[1] == '--test':
+    parser = argparse.ArgumentParser(description="同步 data/ 目錄與向量資料庫")
+    parser.add_argument('--test', action='store_true', help="只測試向量資料庫連接")
+    parser.add_argument('--full', action='store_true', help="清除整個索引後重新匯入")
+    args = parser.parse_args()
+    
+    if args.test:
         test_connection()
     else:
-        main() 
\ No newline at end of file
+        main(full_rebuild=args.full) 
\ No newline at end of file
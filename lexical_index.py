@@ -0,0 +1,276 @@
+# 關鍵字（詞彙）索引
+# 教材為繁體中文，而 all-MiniLM-L6-v2 是英文模型，地名、朝代、法律名詞等精確詞彙常檢索不到。
+# 以中日韓文字的字元 bigram（英數字為整個單字）建立倒排索引，BM25 計分；
+# 倒排串列以連續的 NumPy 陣列（CSR 格式）儲存，查詢只需切片與一次 bincount，不需要嵌入模型
+
+import os
+import re
+import json
+import threading
+import unicodedata
+from collections import Counter
+from typing import List, Dict, Any, Optional, Iterable, Iterator, Sequence
+
+import numpy as np
+
+DEFAULT_LEXICAL_INDEX_PATH = "lexical_index"
+DEFAULT_RRF_K = 60
+
+# 中日韓文字連續片段，或英數字單字
+_TOKEN_RE = re.compile(r'[㐀-䶿一-鿿豈-﫿぀-ヿ가-힯]+|[0-9a-z]+')
+
+
+def tokenize(text: str) -> Iterator[str]:
+    """
+    將文字切為索引詞：中日韓文字片段產生重疊的字元 bigram（單一字元的片段保留單字），英數字為整個單字
+
+    Args:
+        text: 原始文字（以 NFKC 正規化並忽略大小寫）
+
+    Yields:
+        索引詞
+    """
+    text = unicodedata.normalize('NFKC', text or '').casefold()
+    for run in _TOKEN_RE.findall(text):
+        if len(run) == 1 or run.isascii():
+            yield run
+        else:
+            for i in range(len(run) - 1):
+                yield run[i:i + 2]
+
+
+class LexicalIndex:
+    """
+    BM25 倒排索引
+    文件依來源檔案分組儲存（documents.json），save() 時重新編譯倒排串列（postings.npz）：
+      terms   - 索引詞
+      offsets - 第 i 個詞的倒排串列位於 [offsets[i], offsets[i + 1])
+      rows    - 文件列號（int32）
+      impacts - 預先計算的 BM25 分數（idf × 詞頻飽和項，float32）
+    查詢結果的格式與向量索引相同（{'matches': [{'id', 'score', 'metadata'}]}），另附 coverage
+    """
+
+    DOCUMENTS_FILE = "documents.json"
+    POSTINGS_FILE = "postings.npz"
+
+    def __init__(self, path: str = DEFAULT_LEXICAL_INDEX_PATH, k1: float = 1.2, b: float = 0.75):
+        """
+        初始化索引
+
+        Args:
+            path: 索引目錄
+            k1: BM25 詞頻飽和參數
+            b: BM25 文件長度正規化參數
+        """
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._files: Dict[str, List[Dict[str, Any]]] = {}
+        self._terms: Dict[str, int] = {}
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._rows = np.zeros(0, dtype=np.int32)
+        self._impacts = np.zeros(0, dtype=np.float32)
+        self._ids: List[str] = []
+        self._metadata: List[Dict[str, Any]] = []
+        self._loaded_mtime = None
+        self.load()
+
+    # ---- 持久化 ----
+
+    @property
+    def _documents_path(self) -> str:
+        return os.path.join(self.path, self.DOCUMENTS_FILE)
+
+    @property
+    def _postings_path(self) -> str:
+        return os.path.join(self.path, self.POSTINGS_FILE)
+
+    def load(self):
+        """從磁碟載入文件與倒排串列"""
+        with self._lock:
+            if not (os.path.exists(self._documents_path) and os.path.exists(self._postings_path)):
+                return
+            mtime = os.path.getmtime(self._postings_path)
+            with open(self._documents_path, 'r', encoding='utf-8') as f:
+                files = json.load(f)['files']
+            with np.load(self._postings_path) as postings:
+                terms = postings['terms']
+                offsets, rows, impacts = postings['offsets'], postings['rows'], postings['impacts']
+            documents = [document for name in sorted(files) for document in files[name]]
+            if len(offsets) != len(terms) + 1 or (len(rows) and rows.max() >= len(documents)):
+                raise ValueError(f"關鍵字索引檔案不一致: {self.path}")
+            self._files = files
+            self._terms = {term: i for i, term in enumerate(terms.tolist())}
+            self._offsets, self._rows, self._impacts = offsets, rows, impacts
+            self._ids = [document['id'] for document in documents]
+            self._metadata = [document['metadata'] for document in documents]
+            self._loaded_mtime = mtime
+
+    def save(self):
+        """編譯倒排串列並寫回磁碟（先寫暫存檔再原子替換）"""
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            documents = [document for name in sorted(self._files) for document in self._files[name]]
+            terms, offsets, rows, impacts = self._compile([d['metadata'].get('text', '') for d in documents])
+
+            tmp_documents = self._documents_path + ".tmp"
+            tmp_postings = self._postings_path + ".tmp"
+            with open(tmp_documents, 'w', encoding='utf-8') as f:
+                json.dump({'files': self._files}, f, ensure_ascii=False)
+            with open(tmp_postings, 'wb') as f:
+                np.savez(f, terms=np.array(terms, dtype=str), offsets=offsets, rows=rows, impacts=impacts)
+            os.replace(tmp_documents, self._documents_path)
+            os.replace(tmp_postings, self._postings_path)
+            self.load()
+
+    def _compile(self, texts: List[str]):
+        """建立 CSR 格式的倒排串列，並預先計算每個 (詞, 文件) 的 BM25 分數"""
+        vocabulary: Dict[str, int] = {}
+        term_ids, doc_rows, frequencies = [], [], []
+        lengths = np.zeros(len(texts), dtype=np.float32)
+        for row, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            lengths[row] = sum(counts.values())
+            for term, count in counts.items():
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                doc_rows.append(row)
+                frequencies.append(count)
+
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        order = np.argsort(term_ids, kind='stable')  # 依詞分組，組內維持文件順序
+        term_ids = term_ids[order]
+        rows = np.asarray(doc_rows, dtype=np.int32)[order]
+        tf = np.asarray(frequencies, dtype=np.float32)[order]
+
+        df = np.bincount(term_ids, minlength=len(vocabulary)).astype(np.float32)
+        offsets = np.concatenate([[0], np.cumsum(df)]).astype(np.int64)
+        idf = np.log1p((len(texts) - df + 0.5) / (df + 0.5))
+        average_length = float(lengths.mean()) if len(texts) else 0.0
+        norm = self.k1 * (1 - self.b + self.b * lengths[rows] / max(average_length, 1.0))
+        impacts = (idf[term_ids] * tf * (self.k1 + 1) / (tf + norm)).astype(np.float32)
+        return list(vocabulary), offsets, rows, impacts
+
+    @property
+    def version(self) -> Optional[float]:
+        """索引版本（倒排串列檔案的修改時間）"""
+        return self._loaded_mtime
+
+    def refresh(self) -> bool:
+        """若索引檔案已被其他程序（例如 init_db.py）更新，則重新載入"""
+        try:
+            mtime = os.path.getmtime(self._postings_path)
+        except OSError:
+            return False
+        if mtime == self._loaded_mtime:
+            return False
+        try:
+            self.load()
+        except (OSError, ValueError, KeyError):
+            # 其他程序仍在寫入中，沿用目前已載入的索引
+            return False
+        return True
+
+    # ---- 文件維護（匯入時使用，save() 後生效） ----
+
+    def set_file(self, source_file: str, ids: Sequence[str], metadata_list: Sequence[Dict[str, Any]]):
+        """
+        以檔案目前的全部文字塊取代該檔案在索引中的文件
+
+        Args:
+            source_file: 來源檔名
+            ids: 文字塊 ID（與向量索引相同）
+            metadata_list: 元數據列表，需包含 'text'
+        """
+        with self._lock:
+            self._files[source_file] = [{'id': chunk_id, 'metadata': dict(metadata)}
+                                        for chunk_id, metadata in zip(ids, metadata_list)]
+
+    def remove_file(self, source_file: str):
+        """移除一個檔案的所有文件"""
+        with self._lock:
+            self._files.pop(source_file, None)
+
+    def retain_files(self, source_files: Iterable[str]):
+        """只保留指定檔案的文件（移除已從 data/ 刪除的檔案）"""
+        keep = set(source_files)
+        with self._lock:
+            for name in [name for name in self._files if name not in keep]:
+                del self._files[name]
+
+    def clear(self):
+        """移除所有文件"""
+        with self._lock:
+            self._files = {}
+
+    # ---- 查詢 ----
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def search(self, query: str, top_k: int = 3) -> Dict[str, Any]:
+        """
+        以 BM25 查詢
+
+        Args:
+            query: 查詢文字
+            top_k: 返回數量
+
+        Returns:
+            {'matches': [{'id', 'score', 'coverage', 'metadata'}, ...]}；
+            score 為 BM25 分數，coverage 為文件包含的查詢詞比例（0~1）
+        """
+        self.refresh()
+        with self._lock:
+            terms, offsets, rows, impacts = self._terms, self._offsets, self._rows, self._impacts
+            ids, metadata = self._ids, self._metadata
+        query_terms = set(tokenize(query))
+        spans = [(offsets[terms[term]], offsets[terms[term] + 1]) for term in query_terms if term in terms]
+        if not spans or top_k <= 0:
+            return {'matches': []}
+
+        # 只在出現過查詢詞的文件上累加，計算量與倒排串列長度成正比而非文件總數
+        hit_rows = np.concatenate([rows[start:end] for start, end in spans])
+        hit_impacts = np.concatenate([impacts[start:end] for start, end in spans])
+        candidates, inverse = np.unique(hit_rows, return_inverse=True)
+        scores = np.bincount(inverse, weights=hit_impacts)
+        matched_terms = np.bincount(inverse)
+
+        if top_k < len(candidates):
+            best = np.argpartition(-scores, top_k - 1)[:top_k]
+        else:
+            best = np.arange(len(candidates))
+        best = best[np.argsort(-scores[best], kind='stable')]
+        return {'matches': [{
+            'id': ids[candidates[i]],
+            'score': float(scores[i]),
+            'coverage': float(matched_terms[i] / len(query_terms)),
+            'metadata': dict(metadata[candidates[i]])
+        } for i in best]}
+
+    def describe_index_stats(self) -> Dict[str, Any]:
+        return {'total_document_count': len(self._ids), 'total_term_count': len(self._terms),
+                'total_posting_count': int(len(self._rows))}
+
+
+def reciprocal_rank_fusion(result_lists: Sequence[Sequence[str]], k: int = DEFAULT_RRF_K) -> List[tuple]:
+    """
+    以 reciprocal-rank fusion 合併多個排序結果：score = Σ 1 / (k + rank)
+
+    Args:
+        result_lists: 每個檢索器依分數排序的 ID 列表
+        k: 平滑常數，越大越降低前幾名的權重
+
+    Returns:
+        [(id, 融合分數), ...]，依融合分數由高到低
+    """
+    fused: Dict[str, float] = {}
+    for results in result_lists:
+        for rank, item_id in enumerate(results, 1):
+            fused[item_id] = fused.get(item_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+def get_lexical_index_path(path: Optional[str] = None) -> str:
+    """關鍵字索引目錄（參數優先，其次為環境變數 LEXICAL_INDEX_PATH）"""
+    return path or os.getenv('LEXICAL_INDEX_PATH', DEFAULT_LEXICAL_INDEX_PATH)
@@ -0,0 +1,573 @@
+# Gemini 呼叫的共用客戶端
+# 所有呼叫點（RAG 問答、串流、出題、題庫補題、簡答題評分）共用同一個客戶端，提供：
+#   - 每次呼叫的逾時（在工作執行緒中呼叫，逾時後請求執行緒立即返回）與整個請求的期限
+#   - 指數退避加隨機抖動（full jitter）的重試，等待時間不會超過期限
+#   - 熔斷器：連續失敗達門檻後在冷卻時間內直接失敗，呼叫端立即改用備援（摘錄式回答、簡單評分）
+#   - 可選的對沖請求：第一次呼叫超過指定時間仍未返回時再送出一次，採用先完成的結果
+#   - 每次呼叫前向共用的速率限制器（rate_limiter.py）預約 RPM / TPM 額度，額度不足時排隊等待
+# generate() 供執行緒呼叫端使用；agenerate() 為 asyncio 版本（asgi.py），以 Gemini 的非同步 API 呼叫，不佔用執行緒
+# 呼叫次數、重試、token 數與耗時記錄在 metrics 中
+
+import os
+import time
+import random
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from functools import partial
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from metrics import REGISTRY, STAGE_SECONDS, LLM_RETRIES, LLM_HEDGES, record_llm_call, count_tokens
+from rate_limiter import RateLimiter, RateLimitExceeded, get_rate_limiter
+
+
+class LLMError(Exception):
+    """LLM 呼叫失敗（重試用盡、逾時或熔斷），呼叫端應改用備援"""
+
+
+class LLMTimeoutError(LLMError):
+    """單次呼叫逾時或已超過整個請求的期限"""
+
+
+class CircuitOpenError(LLMError):
+    """熔斷器開啟中，未送出呼叫"""
+
+
+class LLMRateLimitedError(LLMError):
+    """速率限制的排隊時間會超過期限，未送出呼叫"""
+
+
+class LLMStreamInterruptedError(LLMError):
+    """串流在已產生部分文字後中斷，partial 為已產生的文字"""
+
+    def __init__(self, message: str, partial: str = ""):
+        super().__init__(message)
+        self.partial = partial
+
+
+class CircuitBreaker:
+    """
+    熔斷器
+    closed: 正常呼叫；連續失敗 failure_threshold 次後轉為 open
+    open: 直接拒絕呼叫；經過 reset_timeout 秒後轉為 half_open
+    half_open: 只放行一個試探呼叫，成功則回到 closed，失敗則重新 open
+              （試探呼叫超過 reset_timeout 仍無結果時，例如串流被中途放棄，再放行下一個）
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        """
+        初始化熔斷器
+
+        Args:
+            failure_threshold: 連續失敗幾次後開啟（0 表示停用熔斷）
+            reset_timeout: 開啟後多少秒允許試探呼叫
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._probe_started = 0.0
+        self._opened_count = 0
+        self._rejected = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._state = self.HALF_OPEN
+                self._probing = False
+            return self._state
+
+    def allow(self) -> bool:
+        """是否可以送出呼叫（half_open 時只放行一個）"""
+        if self.failure_threshold <= 0:
+            return True
+        state = self.state
+        with self._lock:
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and (
+                    not self._probing or time.monotonic() - self._probe_started >= self.reset_timeout):
+                self._probing = True
+                self._probe_started = time.monotonic()
+                return True
+            self._rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.failure_threshold > 0 and (
+                    self._state == self.HALF_OPEN or self._failures >= self.failure_threshold):
+                if self._state != self.OPEN:
+                    self._opened_count += 1
+                    print(f"🔌 LLM 熔斷器開啟（連續失敗 {self._failures} 次），{self.reset_timeout:g}s 內直接使用備援")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+    def stats(self) -> Dict[str, Any]:
+        state = self.state
+        with self._lock:
+            return {
+                'state': state,
+                'consecutive_failures': self._failures,
+                'opened': self._opened_count,
+                'rejected': self._rejected
+            }
+
+
+class LLMClient:
+    """
+    Gemini 呼叫的共用客戶端
+
+    使用方式:
+        client = LLMClient(lambda: rag_system.model)
+        text = client.generate(prompt, operation='exam_generate')
+    """
+
+    def __init__(self, model_factory: Callable[[], Any],
+                 timeout: float = 30.0,
+                 deadline: float = 60.0,
+                 max_attempts: int = 3,
+                 backoff_base: float = 0.5,
+                 backoff_max: float = 8.0,
+                 hedge_after: float = 0.0,
+                 max_concurrency: int = 16,
+                 breaker: Optional[CircuitBreaker] = None,
+                 rate_limiter: Optional[RateLimiter] = None):
+        """
+        初始化客戶端
+
+        Args:
+            model_factory: 返回 Gemini 模型的函式（模型延遲載入，fork 後重建）
+            timeout: 單次呼叫逾時（秒）
+            deadline: 整個請求（含重試與等待）的期限（秒）
+            max_attempts: 最多呼叫次數
+            backoff_base: 第一次重試前的最長等待（秒），之後每次加倍
+            backoff_max: 單次等待的上限（秒）
+            hedge_after: 呼叫超過此秒數仍未返回時送出對沖請求，0 表示停用
+            max_concurrency: 同時進行的呼叫數上限（工作執行緒數）；逾時而放棄等待、仍在執行的呼叫也計入
+            breaker: 熔斷器，預設連續失敗 5 次後開啟 30 秒
+            rate_limiter: 速率限制器，預設不限制
+        """
+        self.model_factory = model_factory
+        self.timeout = timeout
+        self.deadline = deadline
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_after = hedge_after
+        self.max_concurrency = max_concurrency
+        self.breaker = breaker or CircuitBreaker()
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self._pool = None
+        self._pool_pid = None
+        self._pool_lock = threading.Lock()
+        self._slots: Optional[threading.BoundedSemaphore] = None
+
+    @classmethod
+    def from_env(cls, model_factory: Callable[[], Any]) -> "LLMClient":
+        """依 LLM_* 環境變數建立客戶端（速率限制器為程序內所有呼叫點共用）"""
+        return cls(
+            model_factory,
+            timeout=float(os.getenv('LLM_TIMEOUT_SECONDS', '30')),
+            deadline=float(os.getenv('LLM_DEADLINE_SECONDS', '60')),
+            max_attempts=int(os.getenv('LLM_MAX_ATTEMPTS', '3')),
+            backoff_base=float(os.getenv('LLM_BACKOFF_BASE_SECONDS', '0.5')),
+            backoff_max=float(os.getenv('LLM_BACKOFF_MAX_SECONDS', '8')),
+            hedge_after=float(os.getenv('LLM_HEDGE_AFTER_MS', '0')) / 1000,
+            max_concurrency=int(os.getenv('LLM_MAX_CONCURRENCY', '16')),
+            breaker=CircuitBreaker(
+                failure_threshold=int(os.getenv('LLM_CIRCUIT_FAILURE_THRESHOLD', '5')),
+                reset_timeout=float(os.getenv('LLM_CIRCUIT_RESET_SECONDS', '30'))
+            ),
+            rate_limiter=get_rate_limiter()
+        )
+
+    @property
+    def available(self) -> bool:
+        """熔斷器是否允許呼叫（open 時返回 False，呼叫端可直接使用備援）"""
+        return self.breaker.failure_threshold <= 0 or self.breaker.state != CircuitBreaker.OPEN
+
+    def _get_pool(self) -> ThreadPoolExecutor:
+        # 執行緒無法跨 fork 存活，pre-fork 的 worker 第一次呼叫時各自建立
+        if self._pool is None or self._pool_pid != os.getpid():
+            with self._pool_lock:
+                if self._pool is None or self._pool_pid != os.getpid():
+                    self._pool = ThreadPoolExecutor(max_workers=self.max_concurrency,
+                                                    thread_name_prefix='llm-call')
+                    self._slots = threading.BoundedSemaphore(self.max_concurrency)
+                    self._pool_pid = os.getpid()
+        return self._pool
+
+    def _submit(self, pool: ThreadPoolExecutor, prompt: str, timeout: float, wait_seconds: float):
+        """
+        取得呼叫名額後送出 _invoke()
+
+        future.cancel() 無法中止執行中的呼叫：逾時放棄等待的呼叫會繼續佔用工作執行緒直到 Gemini 返回
+        （最多 timeout 秒）。名額在呼叫真正結束時才釋放，因此執行中的呼叫不會超過 max_concurrency，
+        送出的呼叫也不會排在卡住的執行緒後面、耗掉自己的逾時時間
+
+        Args:
+            wait_seconds: 等待名額的秒數，0 表示不等待
+
+        Returns:
+            Future；等待期間取不到名額時返回 None
+        """
+        slots = self._slots
+        acquired = slots.acquire(timeout=wait_seconds) if wait_seconds > 0 else slots.acquire(blocking=False)
+        if not acquired:
+            return None
+        future = pool.submit(self._invoke, prompt, timeout)
+        future.add_done_callback(lambda _: slots.release())
+        return future
+
+    def _settle_unused(self, prompt: str, estimated: int) -> Callable[[Any], None]:
+        """
+        未採用之呼叫（對沖輸家、逾時或失敗）的速率額度結算，作為 future / task 的 done callback
+        有回應時依實際用量修正，沒有回應（失敗或取消）時退還預約的 token
+        """
+        def settle(future):
+            if future.cancelled() or future.exception() is not None:
+                self.rate_limiter.settle(estimated, 0)
+            else:
+                response, text = future.result()
+                self.rate_limiter.settle(estimated, sum(count_tokens(prompt, response, text)))
+        return settle
+
+    def _backoff(self, attempt: int) -> float:
+        """第 attempt 次重試前的等待秒數（full jitter）"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1))))
+
+    def _invoke(self, prompt: str, timeout: float):
+        """在工作執行緒中呼叫模型並讀取回答文字（response.text 在被安全機制擋下時會拋出例外）"""
+        response = self.model_factory().generate_content(prompt, request_options={'timeout': timeout})
+        return response, response.text
+
+    def _acquire(self, prompt: str, operation: str, deadline_at: float) -> int:
+        """在期限內排隊取得速率額度，返回預約的 token 數"""
+        try:
+            return self.rate_limiter.acquire(prompt, operation, max_wait=max(0.0, deadline_at - time.monotonic()))
+        except RateLimitExceeded as e:
+            record_llm_call(operation, prompt, outcome='rate_limited')
+            raise LLMRateLimitedError(str(e)) from e
+
+    async def _ainvoke(self, prompt: str, timeout: float):
+        """以非同步 API 呼叫模型；模型沒有 generate_content_async 時改在執行緒中呼叫"""
+        model = self.model_factory()
+        if not hasattr(model, 'generate_content_async'):
+            return await asyncio.to_thread(self._invoke, prompt, timeout)
+        response = await model.generate_content_async(prompt, request_options={'timeout': timeout})
+        return response, response.text
+
+    async def _aacquire(self, prompt: str, operation: str, deadline_at: float) -> int:
+        """asyncio 版的 _acquire()：以 asyncio.sleep 排隊等待"""
+        reserve = partial(self.rate_limiter.reserve, prompt, operation,
+                          max_wait=max(0.0, deadline_at - time.monotonic()))
+        try:
+            if self.rate_limiter.backend == 'file':
+                # file 後端的 flock 與狀態檔讀寫會阻塞，不在事件迴圈上執行
+                estimated, wait_seconds = await asyncio.to_thread(reserve)
+            else:
+                estimated, wait_seconds = reserve()
+        except RateLimitExceeded as e:
+            record_llm_call(operation, prompt, outcome='rate_limited')
+            raise LLMRateLimitedError(str(e)) from e
+        if wait_seconds > 0:
+            await asyncio.sleep(wait_seconds)
+        return estimated
+
+    def _admit(self, operation: str, prompt: str, last_error: Optional[BaseException]):
+        """熔斷器開啟時拒絕呼叫"""
+        if not self.breaker.allow():
+            record_llm_call(operation, prompt, outcome='circuit_open')
+            raise CircuitOpenError("LLM 熔斷器開啟中") from last_error
+
+    def _on_failure(self, operation: str, prompt: str, error: BaseException, started: float,
+                    attempt: int, attempts: int):
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage='llm')
+        self.breaker.record_failure()
+        record_llm_call(operation, prompt, outcome='timeout' if isinstance(error, LLMTimeoutError) else 'error')
+        print(f"❌ Gemini 呼叫失敗 ({operation}，嘗試 {attempt + 1}/{attempts}): {str(error)}")
+
+    def _on_response(self, operation: str, prompt: str, response, text: str, estimated: int, started: float,
+                     attempt: int, attempts: int) -> bool:
+        """記錄回應並返回是否為有效回答"""
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage='llm')
+        # 有回應即代表服務可用，空白回答只重試不計入熔斷
+        self.breaker.record_success()
+        outcome = 'success' if text else 'empty'
+        self.rate_limiter.settle(estimated, record_llm_call(operation, prompt, response, text=text,
+                                                            outcome=outcome))
+        if not text:
+            print(f"⚠️ Gemini 回應為空 ({operation})，嘗試 {attempt + 1}/{attempts}")
+        return bool(text)
+
+    @staticmethod
+    def _final_error(operation: str, last_error: Optional[BaseException]) -> LLMError:
+        if isinstance(last_error, LLMTimeoutError) or last_error is None:
+            return LLMTimeoutError(f"LLM 呼叫超過期限 ({operation})")
+        return LLMError(f"LLM 呼叫失敗 ({operation}): {str(last_error)}")
+
+    def _call_once(self, prompt: str, operation: str, timeout: float, hedge: bool, estimated: int):
+        """
+        單次呼叫（可能包含一個對沖請求）
+
+        Args:
+            estimated: 主要呼叫預約的 token 數
+
+        Returns:
+            (回應, 回答文字, 採用之呼叫預約的 token 數)；其他呼叫的額度在結束時由 _settle_unused() 結算
+        """
+        pool = self._get_pool()
+        started = time.monotonic()
+        primary = self._submit(pool, prompt, timeout, timeout)
+        if primary is None:
+            self.rate_limiter.settle(estimated, 0)
+            raise LLMTimeoutError(f"LLM 呼叫名額 {timeout:.1f}s 內未釋放（{self.max_concurrency} 個呼叫執行中）")
+        futures = {primary: 'primary'}
+        reservations = {primary: estimated}
+        hedged = not (hedge and 0 < self.hedge_after < timeout)
+        winner = None
+        try:
+            while True:
+                remaining = timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    for future in futures:
+                        future.cancel()
+                    raise LLMTimeoutError(f"LLM 呼叫超過 {timeout:.1f}s 未返回")
+                wait_for = remaining if hedged else min(remaining, self.hedge_after - (time.monotonic() - started))
+                done, _ = wait(list(futures), timeout=max(0.0, wait_for), return_when=FIRST_COMPLETED)
+                for future in done:
+                    label = futures.pop(future)
+                    if future.exception() is None:
+                        for pending in futures:
+                            pending.cancel()
+                        if label == 'hedge':
+                            LLM_HEDGES.inc(operation=operation, outcome='won')
+                        winner = future
+                        return (*future.result(), reservations[future])
+                    if not futures:
+                        raise future.exception()
+                if not done and not hedged:
+                    # 第一次呼叫超過 hedge_after 仍未返回：速率額度與呼叫名額足夠時再送出一次，採用先完成的結果
+                    hedged = True
+                    hedge_estimated = self.rate_limiter.try_acquire(prompt, operation)
+                    if hedge_estimated is not None:
+                        future = self._submit(pool, prompt, remaining, 0)
+                        if future is None:
+                            self.rate_limiter.settle(hedge_estimated, 0)
+                        else:
+                            LLM_HEDGES.inc(operation=operation, outcome='sent')
+                            futures[future] = 'hedge'
+                            reservations[future] = hedge_estimated
+        finally:
+            for future, reserved in reservations.items():
+                if future is not winner:
+                    future.add_done_callback(self._settle_unused(prompt, reserved))
+
+    async def _acall_once(self, prompt: str, operation: str, timeout: float, hedge: bool, estimated: int):
+        """asyncio 版的 _call_once()（取消 task 即中止呼叫，不需要呼叫名額）"""
+        started = time.monotonic()
+        primary = asyncio.ensure_future(self._ainvoke(prompt, timeout))
+        tasks = {primary: 'primary'}
+        reservations = {primary: estimated}
+        hedged = not (hedge and 0 < self.hedge_after < timeout)
+        winner = None
+        try:
+            while True:
+                remaining = timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    raise LLMTimeoutError(f"LLM 呼叫超過 {timeout:.1f}s 未返回")
+                wait_for = remaining if hedged else min(remaining, self.hedge_after - (time.monotonic() - started))
+                done, _ = await asyncio.wait(list(tasks), timeout=max(0.0, wait_for),
+                                             return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    label = tasks.pop(task)
+                    if task.exception() is None:
+                        if label == 'hedge':
+                            LLM_HEDGES.inc(operation=operation, outcome='won')
+                        winner = task
+                        return (*task.result(), reservations[task])
+                    if not tasks:
+                        raise task.exception()
+                if not done and not hedged:
+                    hedged = True
+                    hedge_estimated = self.rate_limiter.try_acquire(prompt, operation)
+                    if hedge_estimated is not None:
+                        LLM_HEDGES.inc(operation=operation, outcome='sent')
+                        task = asyncio.ensure_future(self._ainvoke(prompt, remaining))
+                        tasks[task] = 'hedge'
+                        reservations[task] = hedge_estimated
+        finally:
+            for task in tasks:
+                task.cancel()
+            for task, reserved in reservations.items():
+                if task is not winner:
+                    task.add_done_callback(self._settle_unused(prompt, reserved))
+
+    def generate(self, prompt: str, operation: str = 'generate', deadline: Optional[float] = None,
+                 max_attempts: Optional[int] = None, hedge: bool = True) -> str:
+        """
+        呼叫 Gemini 並返回回答文字
+
+        Args:
+            prompt: 提示詞
+            operation: 呼叫用途（記錄於 metrics）
+            deadline: 整個請求的期限（秒），預設使用客戶端設定
+            max_attempts: 最多呼叫次數，預設使用客戶端設定
+            hedge: 是否允許對沖請求
+
+        Returns:
+            回答文字
+
+        Raises:
+            CircuitOpenError: 熔斷器開啟中
+            LLMRateLimitedError: 速率限制的排隊時間會超過期限
+            LLMTimeoutError: 超過期限
+            LLMError: 重試用盡（__cause__ 為最後一次的錯誤）
+        """
+        deadline_at = time.monotonic() + (self.deadline if deadline is None else deadline)
+        attempts = max_attempts or self.max_attempts
+        last_error: Optional[BaseException] = None
+        for attempt in range(attempts):
+            if attempt:
+                delay = self._backoff(attempt)
+                if time.monotonic() + delay >= deadline_at:
+                    break
+                LLM_RETRIES.inc(operation=operation)
+                time.sleep(delay)
+            self._admit(operation, prompt, last_error)
+            estimated = self._acquire(prompt, operation, deadline_at)
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                break
+            started = time.perf_counter()
+            try:
+                response, text, estimated = self._call_once(prompt, operation, min(self.timeout, remaining),
+                                                            hedge, estimated)
+            except Exception as e:
+                self._on_failure(operation, prompt, e, started, attempt, attempts)
+                last_error = e
+                continue
+            if self._on_response(operation, prompt, response, text, estimated, started, attempt, attempts):
+                return text
+            last_error = LLMError("Gemini 回應為空")
+        raise self._final_error(operation, last_error) from last_error
+
+    async def agenerate(self, prompt: str, operation: str = 'generate', deadline: Optional[float] = None,
+                        max_attempts: Optional[int] = None, hedge: bool = True) -> str:
+        """
+        asyncio 版的 generate()：等待（呼叫、退避、速率限制）期間不佔用執行緒
+
+        Args 與 Raises 同 generate()
+        """
+        deadline_at = time.monotonic() + (self.deadline if deadline is None else deadline)
+        attempts = max_attempts or self.max_attempts
+        last_error: Optional[BaseException] = None
+        for attempt in range(attempts):
+            if attempt:
+                delay = self._backoff(attempt)
+                if time.monotonic() + delay >= deadline_at:
+                    break
+                LLM_RETRIES.inc(operation=operation)
+                await asyncio.sleep(delay)
+            self._admit(operation, prompt, last_error)
+            estimated = await self._aacquire(prompt, operation, deadline_at)
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                break
+            started = time.perf_counter()
+            try:
+                response, text, estimated = await self._acall_once(prompt, operation,
+                                                                   min(self.timeout, remaining), hedge, estimated)
+            except Exception as e:
+                self._on_failure(operation, prompt, e, started, attempt, attempts)
+                last_error = e
+                continue
+            if self._on_response(operation, prompt, response, text, estimated, started, attempt, attempts):
+                return text
+            last_error = LLMError("Gemini 回應為空")
+        raise self._final_error(operation, last_error) from last_error
+
+    def stream(self, prompt: str, operation: str = 'stream', deadline: Optional[float] = None) -> Iterator[str]:
+        """
+        以串流方式呼叫 Gemini，逐段產生回答文字
+
+        串流在產生任何文字前失敗時改用 generate() 的重試流程；
+        已產生部分文字後失敗則拋出 LLMStreamInterruptedError（不重送，避免重複已送出的文字）
+
+        Args:
+            prompt: 提示詞
+            operation: 呼叫用途（記錄於 metrics）
+            deadline: 整個請求的期限（秒）
+
+        Raises:
+            LLMStreamInterruptedError: 已產生部分文字後串流中斷
+            LLMError: 熔斷器開啟或串流與重試都失敗（尚未產生任何文字時）
+        """
+        deadline = self.deadline if deadline is None else deadline
+        deadline_at = time.monotonic() + deadline
+        self._admit(operation, prompt, None)
+        estimated = self._acquire(prompt, operation, deadline_at)
+        emitted = False
+        parts, part = [], None
+        started = time.perf_counter()
+        try:
+            stream = self.model_factory().generate_content(
+                prompt, stream=True, request_options={'timeout': min(self.timeout, deadline)})
+            for part in stream:
+                text = part.text
+                if text:
+                    if not emitted:
+                        STAGE_SECONDS.observe(time.perf_counter() - started, stage='llm_first_token')
+                    emitted = True
+                    parts.append(text)
+                    yield text
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage='llm_stream')
+            self.breaker.record_success()
+            self.rate_limiter.settle(estimated, record_llm_call(operation, prompt, part, text="".join(parts)))
+        except Exception as e:
+            self.breaker.record_failure()
+            record_llm_call(operation, prompt, outcome='error')
+            print(f"❌ Gemini 串流查詢失敗: {str(e)}")
+            if emitted:
+                raise LLMStreamInterruptedError(f"Gemini 串流中斷: {str(e)}", "".join(parts)) from e
+            yield self.generate(prompt, operation, deadline=deadline_at - time.monotonic(), hedge=False)
+
+    def stats(self) -> Dict[str, Any]:
+        """熔斷器狀態與設定"""
+        return {
+            **self.breaker.stats(),
+            'timeout': self.timeout,
+            'deadline': self.deadline,
+            'max_attempts': self.max_attempts,
+            'hedge_after': self.hedge_after
+        }
+
+    def register_metrics(self):
+        """登錄熔斷器狀態指標（同名 collector 會被取代）"""
+        states = (CircuitBreaker.CLOSED, CircuitBreaker.HALF_OPEN, CircuitBreaker.OPEN)
+
+        def collect():
+            stats = self.breaker.stats()
+            return [
+                ('llm_circuit_state', 'gauge', "LLM circuit breaker state (1 for the current state)",
+                 [({'state': state}, 1 if stats['state'] == state else 0) for state in states]),
+                ('llm_circuit_rejected_total', 'counter', "LLM calls rejected while the circuit was open",
+                 [({}, stats['rejected'])]),
+            ]
+
+        REGISTRY.register_collector('llm_circuit', collect)
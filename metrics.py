@@ -0,0 +1,458 @@
+# 效能指標
+# 以 Prometheus 文字格式輸出（GET /metrics）：
+#   - 各階段耗時直方圖（嵌入、向量搜尋、上下文組裝、LLM 呼叫、JSON 解析、檔案讀取…）
+#   - HTTP 請求耗時直方圖
+#   - LLM 呼叫次數、重試次數與 token 數
+#   - 快取命中率等由各元件在輸出時提供的數值（collector）
+# 指標存在程序記憶體中。設定 METRICS_MULTIPROC_DIR 時（gunicorn 多個 worker 或多個 Uvicorn worker 時自動設定），
+# 每個 worker 定期將自己的指標寫入該目錄，/metrics 合併所有 worker 的指標並加上 worker（程序 ID）標籤
+
+import os
+import glob
+import json
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Any, Iterable, List, Optional, Sequence, Tuple
+
+from context_builder import estimate_tokens
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# collector 返回的樣本：(名稱, 類型, 說明, [(標籤, 數值), ...])
+Sample = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+# 輸出用的指標族：(名稱, 類型, 說明, [(樣本名稱, 標籤, 數值), ...])；直方圖的樣本名稱為 _bucket / _sum / _count
+Family = Tuple[str, str, str, List[Tuple[str, Dict[str, Any], float]]]
+
+# 多程序模式：各 worker 寫入指標快照的目錄與寫入間隔
+MULTIPROC_DIR_ENV = 'METRICS_MULTIPROC_DIR'
+SNAPSHOT_SECONDS = float(os.getenv('METRICS_SNAPSHOT_SECONDS', '5'))
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """只增不減的計數器（可帶標籤）"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def collect(self) -> Family:
+        with self._lock:
+            items = sorted(self._values.items())
+        return (self.name, 'counter', self.documentation,
+                [(self.name, dict(zip(self.labelnames, key)), value) for key, value in items])
+
+
+class Histogram:
+    """固定區間的直方圖（可帶標籤）；記錄落在每個上限以內的次數、總和與次數"""
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float] = LATENCY_BUCKETS,
+                 labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = list(buckets)
+        self.labelnames = tuple(labelnames)
+        self._series: Dict[Tuple[str, ...], Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0}
+            series['counts'][bisect_left(self.buckets, value)] += 1  # 最後一格為 +Inf
+            series['sum'] += value
+            series['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """量測區塊耗時（秒），例外時同樣記錄"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    def _cumulative(self, series: Dict[str, Any]) -> List[Tuple[float, int]]:
+        cumulative, result = 0, []
+        for bound, count in zip(self.buckets + [float('inf')], series['counts']):
+            cumulative += count
+            result.append((bound, cumulative))
+        return result
+
+    def snapshot(self, **labels) -> Dict[str, Any]:
+        """返回累積次數（le = 上限）、總和、次數與平均值"""
+        with self._lock:
+            series = self._series.get(self._key(labels)) or \
+                {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0}
+            buckets = {('+Inf' if bound == float('inf') else f"{bound:g}"): count
+                       for bound, count in self._cumulative(series)}
+            return {
+                'buckets': buckets,
+                'sum': series['sum'],
+                'count': series['count'],
+                'mean': series['sum'] / series['count'] if series['count'] else 0.0
+            }
+
+    def collect(self) -> Family:
+        with self._lock:
+            items = sorted((key, dict(series, counts=list(series['counts'])))
+                           for key, series in self._series.items())
+        samples = []
+        for key, series in items:
+            labels = dict(zip(self.labelnames, key))
+            for bound, count in self._cumulative(series):
+                samples.append((f"{self.name}_bucket", {**labels, 'le': _format_value(bound)}, count))
+            samples.append((f"{self.name}_sum", labels, series['sum']))
+            samples.append((f"{self.name}_count", labels, series['count']))
+        return self.name, 'histogram', self.documentation, samples
+
+
+class Registry:
+    """指標登錄表：固定的計數器與直方圖，加上輸出時才讀取數值的 collector"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+        self._collectors: Dict[str, Callable[[], Iterable[Sample]]] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """登錄指標（同名的指標會被取代，例如重新建立的 RAG 系統）"""
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, buckets: Sequence[float] = LATENCY_BUCKETS,
+                  labelnames: Sequence[str] = ()) -> Histogram:
+        return self.register(Histogram(name, documentation, buckets, labelnames))
+
+    def reset(self):
+        """清除計數器與直方圖的數值（fork 出的 worker 不沿用主程序預先載入時記錄的數值）"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            metric.reset()
+
+    def register_collector(self, name: str, collect: Callable[[], Iterable[Sample]]):
+        """登錄 collector（同名的會被取代）；collect() 在每次輸出時呼叫"""
+        with self._lock:
+            self._collectors[name] = collect
+
+    def collect(self) -> Tuple[List[Family], List[str]]:
+        """
+        讀取所有指標與 collector 的目前數值
+
+        Returns:
+            (指標族列表, 失敗的 collector 說明)
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors.items())
+        families: List[Family] = [metric.collect() for metric in metrics]
+        errors: List[str] = []
+        # 不同 collector 可能提供同名指標（例如各自的快取命中數），合併為同一組輸出
+        collected: Dict[str, Family] = {}
+        for collector_name, collect in collectors:
+            try:
+                samples = list(collect())
+            except Exception as e:
+                errors.append(f"collector {collector_name} failed: {str(e)}")
+                continue
+            for name, metric_type, documentation, values in samples:
+                collected.setdefault(name, (name, metric_type, documentation, []))[3].extend(
+                    (name, labels, value) for labels, value in values)
+        families.extend(collected.values())
+        return families, errors
+
+    def render(self) -> str:
+        """輸出 Prometheus 文字格式（只包含本程序的指標）"""
+        families, errors = self.collect()
+        return format_families(families, errors)
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'rag_stage_duration_seconds', "Duration of request processing stages",
+    labelnames=('stage',))
+REQUEST_SECONDS = REGISTRY.histogram(
+    'http_request_duration_seconds', "HTTP request duration until the response is returned",
+    labelnames=('endpoint', 'method', 'status'))
+LLM_REQUESTS = REGISTRY.counter(
+    'llm_requests_total', "LLM calls by operation and outcome", ('operation', 'outcome'))
+LLM_RETRIES = REGISTRY.counter(
+    'llm_retries_total', "LLM call retries by operation", ('operation',))
+LLM_HEDGES = REGISTRY.counter(
+    'llm_hedged_requests_total', "Hedged LLM requests sent and won by operation", ('operation', 'outcome'))
+LLM_RATE_LIMIT_WAIT = REGISTRY.histogram(
+    'llm_rate_limit_wait_seconds', "Time LLM calls waited in the rate limiter queue before admission",
+    buckets=(0, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60), labelnames=('operation',))
+LLM_RATE_LIMITED = REGISTRY.counter(
+    'llm_rate_limited_total', "LLM calls rejected because the rate limit wait exceeded their deadline",
+    ('operation',))
+LLM_TOKENS = REGISTRY.counter(
+    'llm_tokens_total', "LLM tokens by operation and kind (prompt / completion)", ('operation', 'kind'))
+
+
+def stage_timer(stage: str):
+    """
+    量測請求處理階段的耗時
+
+    使用方式:
+        with stage_timer('vector_search'):
+            index.query(...)
+    """
+    return STAGE_SECONDS.time(stage=stage)
+
+
+def record_llm_call(operation: str, prompt: str, response=None, text: Optional[str] = None,
+                    outcome: str = 'success') -> Optional[int]:
+    """
+    記錄一次 LLM 呼叫與 token 數（優先使用回應的 usage_metadata，沒有時以字數估計）
+
+    Args:
+        operation: 呼叫用途（rag_query、exam_generate、grade_short_answer…）
+        prompt: 提示詞
+        response: Gemini 回應
+        text: 回答文字（串流時為串接後的文字）
+        outcome: success、empty、error、timeout、circuit_open 或 rate_limited
+
+    Returns:
+        提示詞與回答的 token 總數（呼叫失敗時為 None）
+    """
+    LLM_REQUESTS.inc(operation=operation, outcome=outcome)
+    if outcome in ('error', 'timeout', 'circuit_open', 'rate_limited'):
+        return None
+    prompt_tokens, completion_tokens = count_tokens(prompt, response, text)
+    LLM_TOKENS.inc(prompt_tokens, operation=operation, kind='prompt')
+    LLM_TOKENS.inc(completion_tokens, operation=operation, kind='completion')
+    return prompt_tokens + completion_tokens
+
+
+def count_tokens(prompt: str, response=None, text: Optional[str] = None) -> Tuple[int, int]:
+    """
+    一次 LLM 呼叫的 (提示詞, 回答) token 數，優先使用回應的 usage_metadata，沒有時以字數估計（不記錄指標）
+    """
+    usage = getattr(response, 'usage_metadata', None)
+    prompt_tokens = getattr(usage, 'prompt_token_count', None)
+    completion_tokens = getattr(usage, 'candidates_token_count', None)
+    if not prompt_tokens:
+        prompt_tokens = estimate_tokens(prompt)
+    if not completion_tokens:
+        if text is None:
+            try:
+                text = response.text
+            except Exception:
+                text = ""
+        completion_tokens = estimate_tokens(text or "")
+    return prompt_tokens, completion_tokens
+
+
+def cache_samples(caches: Dict[str, Dict[str, Any]]) -> List[Sample]:
+    """
+    將各快取的 stats() 轉為命中、未命中次數與命中率
+
+    Args:
+        caches: {快取名稱: stats() 的結果}
+    """
+    hits, misses, ratios = [], [], []
+    for name, stats in caches.items():
+        hit_count = stats.get('hits', 0) + stats.get('disk_hits', 0)
+        miss_count = stats.get('misses', 0)
+        hits.append(({'cache': name}, hit_count))
+        misses.append(({'cache': name}, miss_count))
+        ratios.append(({'cache': name}, hit_count / (hit_count + miss_count) if hit_count + miss_count else 0.0))
+    return [
+        ('cache_hits_total', 'counter', "Cache hits", hits),
+        ('cache_misses_total', 'counter', "Cache misses", misses),
+        ('cache_hit_ratio', 'gauge', "Cache hit ratio since start", ratios),
+    ]
+
+
+def format_families(families: Iterable[Family], errors: Iterable[str] = ()) -> str:
+    """將指標族轉為 Prometheus 文字格式"""
+    lines: List[str] = [f"# {error}" for error in errors]
+    for name, metric_type, documentation, samples in families:
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for sample_name, labels, value in samples:
+            lines.append(f"{sample_name}{_format_labels(labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# ---- 多程序（pre-fork worker）彙整 ----
+
+_snapshot_thread: Optional[threading.Thread] = None
+_snapshot_pid: Optional[int] = None
+
+
+def multiprocess_dir() -> Optional[str]:
+    """多程序模式的快照目錄，未設定時為 None（只輸出本程序的指標）"""
+    return os.getenv(MULTIPROC_DIR_ENV) or None
+
+
+def _snapshot_path(directory: str, pid: int) -> str:
+    return os.path.join(directory, f"worker-{pid}.json")
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+def write_snapshot():
+    """將本程序目前的指標寫入快照目錄（先寫暫存檔再取代，讀取端不會讀到一半的檔案）"""
+    directory = multiprocess_dir()
+    if not directory:
+        return
+    families, _ = REGISTRY.collect()
+    os.makedirs(directory, exist_ok=True)
+    path = _snapshot_path(directory, os.getpid())
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(families, f)
+    os.replace(tmp_path, path)
+
+
+def start_snapshot_writer(interval: float = SNAPSHOT_SECONDS):
+    """
+    在背景定期寫入本程序的指標快照（fork 或 spawn 出的每個 worker 各執行一次；未設定快照目錄時不做任何事）
+
+    Args:
+        interval: 寫入間隔秒數
+    """
+    global _snapshot_thread, _snapshot_pid
+    if not multiprocess_dir() or (_snapshot_thread is not None and _snapshot_pid == os.getpid()):
+        return
+
+    def run():
+        while True:
+            try:
+                write_snapshot()
+            except Exception as e:
+                print(f"⚠️ 寫入指標快照失敗: {str(e)}")
+            time.sleep(interval)
+
+    _snapshot_pid = os.getpid()
+    _snapshot_thread = threading.Thread(target=run, name='metrics-snapshot', daemon=True)
+    _snapshot_thread.start()
+
+
+def remove_snapshot(pid: int):
+    """刪除已結束 worker 的快照（gunicorn child_exit 時呼叫）"""
+    directory = multiprocess_dir()
+    if directory:
+        try:
+            os.remove(_snapshot_path(directory, pid))
+        except OSError:
+            pass
+
+
+def reset_multiprocess_dir(directory: str):
+    """啟動伺服器前清空快照目錄（上次執行留下的 worker 快照）"""
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, 'worker-*.json*')):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def render_multiprocess(directory: str) -> str:
+    """
+    合併所有 worker 的指標：本程序使用即時數值，其他 worker 使用最近一次的快照（最多延遲 METRICS_SNAPSHOT_SECONDS）
+
+    Returns:
+        Prometheus 文字格式，每個樣本加上 worker（程序 ID）標籤
+    """
+    own_pid = os.getpid()
+    own_families, errors = REGISTRY.collect()
+    per_worker: List[Tuple[int, List[Family]]] = [(own_pid, own_families)]
+    for path in sorted(glob.glob(os.path.join(directory, 'worker-*.json'))):
+        try:
+            pid = int(os.path.basename(path)[len('worker-'):-len('.json')])
+        except ValueError:
+            continue
+        if pid == own_pid:
+            continue
+        if not _pid_alive(pid):
+            # worker 已結束（例如 max_requests 重啟）：它的計數不再輸出
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            continue
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                per_worker.append((pid, json.load(f)))
+        except (OSError, ValueError) as e:
+            errors.append(f"worker {pid} snapshot unreadable: {str(e)}")
+
+    merged: Dict[str, Family] = {}
+    for pid, families in per_worker:
+        for name, metric_type, documentation, samples in families:
+            family = merged.setdefault(name, (name, metric_type, documentation, []))
+            family[3].extend((sample_name, {'worker': str(pid), **labels}, value)
+                             for sample_name, labels, value in samples)
+    return format_families(merged.values(), errors)
+
+
+def render() -> str:
+    """輸出所有指標（Prometheus 文字格式）；多程序模式下包含所有 worker"""
+    directory = multiprocess_dir()
+    if directory:
+        return render_multiprocess(directory)
+    return REGISTRY.render()
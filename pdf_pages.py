@@ -0,0 +1,75 @@
+# PDF 逐頁解析
+# 以產生器一次返回一頁文字，pdfplumber 解析失敗的頁面才改用 PyPDF2，不需重新解析整份文件
+
+from typing import Iterator, Tuple, Optional
+
+# pdfplumber / PyPDF2 在第一次解析 PDF 時才匯入
+
+
+def count_pdf_pages(file_path: str) -> int:
+    """取得 PDF 頁數"""
+    import PyPDF2
+    import pdfplumber
+    try:
+        with pdfplumber.open(file_path) as pdf:
+            return len(pdf.pages)
+    except Exception:
+        with open(file_path, 'rb') as file:
+            return len(PyPDF2.PdfReader(file).pages)
+
+
+def iter_pdf_pages(file_path: str, start_page: int = 0,
+                   end_page: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+    """
+    逐頁解析 PDF
+
+    Args:
+        file_path: PDF 檔案路徑
+        start_page: 起始頁（從 0 起算）
+        end_page: 結束頁（不含），未指定時到最後一頁
+
+    Yields:
+        (頁碼（從 1 起算）, 頁面文字)；無法解析的頁面返回空字串
+    """
+    import PyPDF2
+    import pdfplumber
+    with open(file_path, 'rb') as file:
+        fallback = None
+
+        def fallback_text(page_index: int) -> str:
+            nonlocal fallback
+            if fallback is None:
+                fallback = PyPDF2.PdfReader(file)
+            try:
+                return fallback.pages[page_index].extract_text() or ""
+            except Exception as e:
+                print(f"⚠️ 無法解析 {file_path} 第 {page_index + 1} 頁: {str(e)}")
+                return ""
+
+        try:
+            pdf = pdfplumber.open(file_path)
+        except Exception as e:
+            print(f"pdfplumber 無法開啟 PDF，改用 PyPDF2: {str(e)}")
+            pdf = None
+
+        if pdf is None:
+            total = len(PyPDF2.PdfReader(file).pages)
+            for page_index in range(start_page, min(end_page or total, total)):
+                yield page_index + 1, fallback_text(page_index)
+            return
+
+        with pdf:
+            total = len(pdf.pages)
+            for page_index in range(start_page, min(end_page or total, total)):
+                page = pdf.pages[page_index]
+                try:
+                    text = page.extract_text() or ""
+                except Exception as e:
+                    print(f"pdfplumber 解析第 {page_index + 1} 頁失敗，改用 PyPDF2: {str(e)}")
+                    text = fallback_text(page_index)
+                finally:
+                    # 釋放頁面物件的解析快取，讓大型教材維持有限的記憶體用量
+                    close = getattr(page, 'close', None)
+                    if close:
+                        close()
+                yield page_index + 1, text
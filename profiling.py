@@ -0,0 +1,201 @@
+# 單一請求效能剖析
+# 管理員以標頭（X-Profile + X-Profile-Token）或查詢參數（?profile=...&profile_token=...）要求剖析某個請求，
+# 或設定 PROFILE_SAMPLE_RATE=N 隨機剖析 N 分之一的請求；結果寫入 logs/profiles/：
+#   sampling - 取樣式剖析（每隔數毫秒記錄堆疊），輸出 collapsed stack（.folded），
+#              可直接交給 flamegraph.pl、speedscope 或 inferno 產生火焰圖
+#   cprofile - cProfile 決定式剖析，輸出 pstats（.prof），可用 snakeviz 或 flameprof 檢視
+# 未設定 PROFILING_TOKEN 且 PROFILE_SAMPLE_RATE=0 時完全停用，每個請求只多一次布林判斷
+
+import os
+import re
+import sys
+import time
+import hmac
+import random
+import cProfile
+import threading
+from collections import Counter
+from typing import Dict, Optional
+
+MODES = ('sampling', 'cprofile')
+# 取樣時一併記錄的背景執行緒（查詢嵌入、簡答題評分、關鍵字搜尋與 LLM 呼叫在這些執行緒中執行；
+# ASGI 模式的檢索與檔案讀取在 asgi-blocking 執行緒中執行）
+HELPER_THREAD_PREFIXES = ('embedding-batcher', 'grading', 'lexical-search', 'llm-call', 'asgi-blocking')
+
+# cProfile 同一時間只能有一個在執行
+_cprofile_lock = threading.Lock()
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    取樣式剖析器
+    背景執行緒每隔 interval 秒讀取目標執行緒的堆疊（sys._current_frames），以 collapsed stack 格式累計次數；
+    目標執行緒本身不受影響，額外成本與取樣頻率成正比
+    """
+
+    def __init__(self, thread_id: int, interval: float = 0.005,
+                 helper_prefixes: tuple = HELPER_THREAD_PREFIXES):
+        """
+        初始化剖析器
+
+        Args:
+            thread_id: 處理請求的執行緒 ID
+            interval: 取樣間隔（秒）
+            helper_prefixes: 一併取樣的背景執行緒名稱前綴
+        """
+        self.thread_id = thread_id
+        self.interval = interval
+        self.helper_prefixes = helper_prefixes
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profiler-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _targets(self) -> Dict[int, str]:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        targets = {self.thread_id: 'request'}
+        for ident, name in names.items():
+            if ident != self.thread_id and name.startswith(self.helper_prefixes):
+                targets[ident] = name
+        return targets
+
+    def _run(self):
+        targets = self._targets()
+        last_refresh = time.monotonic()
+        while not self._stop.wait(self.interval):
+            if time.monotonic() - last_refresh > 0.5:
+                targets, last_refresh = self._targets(), time.monotonic()
+            frames = sys._current_frames()
+            self.samples += 1
+            for ident, root in targets.items():
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                self.stacks[";".join([root] + stack[::-1])] += 1
+
+    def write(self, path: str):
+        """寫入 collapsed stack 檔案（每行：堆疊;以;分號;分隔 次數）"""
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class ProfileSession:
+    """一個請求的剖析過程；stop() 後寫入檔案"""
+
+    def __init__(self, mode: str, path: str, interval: float):
+        self.mode = mode
+        self.path = path
+        self.started = time.perf_counter()
+        self._profile = None
+        self._sampler = None
+        if mode == 'cprofile' and _cprofile_lock.acquire(blocking=False):
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            # 已有其他請求正在使用 cProfile 時改用取樣
+            self.mode = 'sampling'
+            self.path = os.path.splitext(path)[0] + '.folded'
+            self._sampler = SamplingProfiler(threading.get_ident(), interval)
+            self._sampler.start()
+
+    def stop(self) -> str:
+        """停止剖析並寫入檔案，返回檔案路徑"""
+        if self._profile is not None:
+            self._profile.disable()
+            try:
+                self._profile.dump_stats(self.path)
+            finally:
+                _cprofile_lock.release()
+        else:
+            self._sampler.stop()
+            self._sampler.write(self.path)
+        print(f"🔬 已剖析請求（{self.mode}，{time.perf_counter() - self.started:.3f}s）: {self.path}")
+        return self.path
+
+
+class RequestProfiler:
+    """依請求標頭、查詢參數或隨機取樣決定是否剖析請求"""
+
+    def __init__(self, output_dir: str = os.path.join('logs', 'profiles'), token: Optional[str] = None,
+                 sample_rate: int = 0, default_mode: str = 'sampling', interval_ms: float = 5.0):
+        """
+        初始化
+
+        Args:
+            output_dir: 剖析檔案目錄
+            token: 管理員權杖；未設定時不接受手動要求剖析
+            sample_rate: 隨機剖析 1/N 的請求，0 表示停用
+            default_mode: 隨機剖析與未指定模式時使用的模式（sampling 或 cprofile）
+            interval_ms: 取樣間隔（毫秒）
+        """
+        self.output_dir = output_dir
+        self.token = token or None
+        self.sample_rate = sample_rate
+        self.default_mode = default_mode if default_mode in MODES else 'sampling'
+        self.interval = interval_ms / 1000
+        self.enabled = bool(self.token) or sample_rate > 0
+
+    @classmethod
+    def from_env(cls) -> "RequestProfiler":
+        """依環境變數 PROFILING_TOKEN、PROFILE_SAMPLE_RATE、PROFILE_MODE、PROFILE_DIR 建立"""
+        return cls(
+            output_dir=os.getenv('PROFILE_DIR', os.path.join('logs', 'profiles')),
+            token=os.getenv('PROFILING_TOKEN'),
+            sample_rate=int(os.getenv('PROFILE_SAMPLE_RATE', '0')),
+            default_mode=os.getenv('PROFILE_MODE', 'sampling'),
+            interval_ms=float(os.getenv('PROFILE_SAMPLE_INTERVAL_MS', '5'))
+        )
+
+    def requested_mode(self, headers, args) -> Optional[str]:
+        """
+        判斷此請求是否要剖析
+
+        Args:
+            headers: 請求標頭
+            args: 查詢參數
+
+        Returns:
+            剖析模式，不剖析時返回 None
+        """
+        requested = headers.get('X-Profile') or args.get('profile')
+        if requested and self.token:
+            token = headers.get('X-Profile-Token') or args.get('profile_token') or ''
+            if hmac.compare_digest(token.encode('utf-8'), self.token.encode('utf-8')):
+                return requested if requested in MODES else self.default_mode
+            print("⚠️ 剖析權杖不正確，忽略剖析要求")
+        if self.sample_rate > 0 and random.randrange(self.sample_rate) == 0:
+            return self.default_mode
+        return None
+
+    def start(self, mode: str, name: str) -> ProfileSession:
+        """
+        開始剖析目前執行緒處理的請求
+
+        Args:
+            mode: sampling 或 cprofile
+            name: 請求名稱（用於檔名，例如路由路徑）
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        slug = re.sub(r'[^0-9A-Za-z]+', '-', name).strip('-') or 'root'
+        timestamp = time.strftime('%Y%m%d-%H%M%S')
+        extension = '.prof' if mode == 'cprofile' else '.folded'
+        path = os.path.join(self.output_dir,
+                            f"{timestamp}-{int(time.time() * 1000) % 1000:03d}-{slug}-{os.getpid()}{extension}")
+        return ProfileSession(mode, path, self.interval)
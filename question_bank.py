@@ -0,0 +1,347 @@
+# 題庫
+# 依教材預先生成並保存經過驗證的考題，讓 /exam/generate 直接從題庫抽題；題庫不足時於背景補充
+
+import os
+import json
+import random
+import hashlib
+import threading
+import queue
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Dict, Any, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows：沒有 flock，只保證單一程序內的一致性
+    fcntl = None
+
+QUESTION_TYPES = ('choice', 'fill', 'short', 'true_false')
+CHUNK_SIZE = 500
+
+
+def build_question_prompt(content_text: str, num_questions: int) -> str:
+    """
+    生成出題用的提示詞
+
+    Args:
+        content_text: 教材片段（已加上「內容 n:」編號）
+        num_questions: 題目數量
+
+    Returns:
+        完整的提示詞
+    """
+    return f"""
+請基於以下內容生成 {num_questions} 道考試題目。每道題目包含：
+1. 題目內容
+2. 題目類型（choice: 選擇題, fill: 填空題, short: 簡答題, true_false: 是非題）
+3. 正確答案
+4. 選項（如果是選擇題）
+5. 解析
+內容：
+{content_text}
+請以 JSON 格式返回，格式如下：
+{{
+    "questions": [
+        {{
+            "id": 1,
+            "type": "choice",
+            "question": "題目內容",
+            "options": ["A. 選項1", "B. 選項2", "C. 選項3", "D. 選項4"],
+            "correct_answer": "A",
+            "explanation": "解析說明"
+        }}
+    ]
+}}
+"""
+
+
+def parse_questions_response(response_text: str) -> List[Dict[str, Any]]:
+    """
+    從 LLM 回應中擷取 JSON 題目列表
+
+    Raises:
+        ValueError: 回應中找不到可解析的 JSON
+    """
+    start_idx = response_text.find('{')
+    end_idx = response_text.rfind('}') + 1
+    if start_idx < 0 or end_idx <= start_idx:
+        raise ValueError("回應中沒有 JSON 內容")
+    result = json.loads(response_text[start_idx:end_idx])
+    return result.get('questions', [])
+
+
+@contextmanager
+def file_lock(path: str, blocking: bool = True) -> Iterator[bool]:
+    """
+    跨程序檔案鎖（pre-fork 的多個 worker 共用同一個題庫目錄）
+
+    Yields:
+        是否取得鎖；blocking=False 且鎖已被其他程序持有時為 False
+    """
+    if fcntl is None:
+        yield True
+        return
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def validate_question(question: Dict[str, Any]) -> bool:
+    """檢查題目欄位是否完整，避免把格式錯誤的題目存入題庫"""
+    if not isinstance(question, dict) or question.get('type') not in QUESTION_TYPES:
+        return False
+    for field in ('question', 'correct_answer'):
+        if not isinstance(question.get(field), str) or not question[field].strip():
+            return False
+    if question['type'] == 'choice':
+        options = question.get('options')
+        if not isinstance(options, list) or len(options) < 2:
+            return False
+    return True
+
+
+class QuestionBank:
+    """
+    持久化題庫
+    每份教材一個 JSON 檔，以教材內容雜湊區分版本（教材更新後舊題庫自動失效）；
+    每道題目記錄其來源片段位置，補題時優先使用尚未出過題的片段。抽出的題目會從題庫移除。
+    讀寫都持有檔案鎖，並在檔案被其他程序修改後重新載入，多個 worker 可共用同一個題庫目錄
+    """
+
+    def __init__(self, bank_dir: str = "question_bank"):
+        """
+        初始化題庫
+
+        Args:
+            bank_dir: 題庫目錄
+        """
+        self.bank_dir = bank_dir
+        self._lock = threading.Lock()
+        self._banks: Dict[str, Dict[str, Any]] = {}
+        self._versions: Dict[str, Optional[tuple]] = {}
+
+    def _bank_path(self, file_name: str) -> str:
+        digest = hashlib.sha1(file_name.encode('utf-8')).hexdigest()
+        return os.path.join(self.bank_dir, f"{digest}.json")
+
+    @contextmanager
+    def _locked(self, file_name: str) -> Iterator[None]:
+        with self._lock, file_lock(self._bank_path(file_name) + ".lock"):
+            yield
+
+    def top_up_lock(self, file_name: str):
+        """補題鎖（非阻塞）：同一份教材同時只由一個程序補題"""
+        return file_lock(self._bank_path(file_name) + ".topup.lock", blocking=False)
+
+    @staticmethod
+    def _file_version(path: str) -> Optional[tuple]:
+        """檔案版本（每次儲存都以新檔案替換，inode 會改變）"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _load(self, file_name: str, content_sha256: str) -> Dict[str, Any]:
+        """載入教材的題庫（檔案被其他程序修改時重新讀取）；不存在或教材已變更時返回空題庫"""
+        path = self._bank_path(file_name)
+        version = self._file_version(path)
+        bank = self._banks.get(file_name)
+        if bank is None or self._versions.get(file_name) != version:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    bank = json.load(f)
+            except (OSError, ValueError):
+                bank = None
+            self._versions[file_name] = version
+        if bank is None or bank.get('content_sha256') != content_sha256:
+            bank = {'file_name': file_name, 'content_sha256': content_sha256,
+                    'questions': [], 'used_offsets': []}
+        self._banks[file_name] = bank
+        return bank
+
+    def _save(self, bank: Dict[str, Any]):
+        os.makedirs(self.bank_dir, exist_ok=True)
+        path = self._bank_path(bank['file_name'])
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(bank, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+        self._versions[bank['file_name']] = self._file_version(path)
+
+    def count(self, file_name: str, content_sha256: str) -> int:
+        """題庫中可用的題目數量"""
+        with self._locked(file_name):
+            return len(self._load(file_name, content_sha256)['questions'])
+
+    def used_offsets(self, file_name: str, content_sha256: str) -> List[int]:
+        """已經出過題的片段位置"""
+        with self._locked(file_name):
+            return list(self._load(file_name, content_sha256)['used_offsets'])
+
+    def add(self, file_name: str, content_sha256: str, questions: List[Dict[str, Any]],
+            chunk_offsets: List[int]):
+        """
+        加入題目
+
+        Args:
+            file_name: 教材檔名
+            content_sha256: 教材內容雜湊
+            questions: 已驗證的題目
+            chunk_offsets: 本次出題使用的片段位置
+        """
+        with self._locked(file_name):
+            bank = self._load(file_name, content_sha256)
+            for question in questions:
+                bank['questions'].append({'question': question, 'chunk_offsets': chunk_offsets})
+            bank['used_offsets'] = sorted(set(bank['used_offsets']) | set(chunk_offsets))
+            self._save(bank)
+
+    def take(self, file_name: str, content_sha256: str, num_questions: int) -> Optional[List[Dict[str, Any]]]:
+        """
+        隨機抽出題目（抽出的題目從題庫移除）
+
+        Returns:
+            重新編號的題目列表；題庫數量不足時返回 None
+        """
+        with self._locked(file_name):
+            bank = self._load(file_name, content_sha256)
+            if len(bank['questions']) < num_questions:
+                return None
+            picked = set(random.sample(range(len(bank['questions'])), num_questions))
+            questions = [entry['question'] for i, entry in enumerate(bank['questions']) if i in picked]
+            bank['questions'] = [entry for i, entry in enumerate(bank['questions']) if i not in picked]
+            self._save(bank)
+
+        random.shuffle(questions)
+        return [{**question, 'id': i + 1} for i, question in enumerate(questions)]
+
+
+class QuestionBankBuilder:
+    """
+    背景補題器
+    以單一背景執行緒處理補題請求：從教材中挑選片段、呼叫 LLM 出題、驗證後存入題庫，直到達到目標數量
+    """
+
+    def __init__(self, bank: QuestionBank, document_cache, generate: Callable[[str], str],
+                 data_dir: str = "data", target_size: int = 30, low_watermark: int = 10,
+                 chunks_per_request: int = 5):
+        """
+        初始化補題器
+
+        Args:
+            bank: 題庫
+            document_cache: 文件解析快取（提供教材長度、片段與內容雜湊）
+            generate: 以提示詞呼叫 LLM 並返回文字的函式
+            data_dir: 教材目錄
+            target_size: 每份教材補題的目標數量
+            low_watermark: 題目數量低於此值時觸發補題
+            chunks_per_request: 每次呼叫 LLM 使用的片段數量（每個片段出一題）
+        """
+        self.bank = bank
+        self.document_cache = document_cache
+        self.generate = generate
+        self.data_dir = data_dir
+        self.target_size = target_size
+        self.low_watermark = low_watermark
+        self.chunks_per_request = chunks_per_request
+        self._queue: "queue.Queue[str]" = queue.Queue()
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='question-bank-builder', daemon=True)
+        self._thread.start()
+
+    def _file_path(self, file_name: str) -> str:
+        return os.path.join(self.data_dir, file_name)
+
+    def content_sha256(self, file_name: str) -> Optional[str]:
+        """教材目前的內容雜湊（由文件解析快取提供）"""
+        return self.document_cache.get_sha256(self._file_path(file_name))
+
+    def request_top_up(self, file_name: str, force: bool = False):
+        """題庫低於水位（或 force）時排入補題；同一教材不會重複排隊"""
+        sha256 = self.content_sha256(file_name)
+        if sha256 is None:
+            return
+        if not force and self.bank.count(file_name, sha256) >= self.low_watermark:
+            return
+        with self._pending_lock:
+            if file_name in self._pending:
+                return
+            self._pending.add(file_name)
+        self._queue.put(file_name)
+
+    def prefill(self):
+        """為教材目錄中的所有檔案排入補題"""
+        for file_name in sorted(os.listdir(self.data_dir)):
+            if file_name.endswith(('.txt', '.pdf')):
+                self.request_top_up(file_name, force=True)
+
+    def _run(self):
+        while True:
+            file_name = self._queue.get()
+            try:
+                self.top_up(file_name)
+            except Exception as e:
+                print(f"❌ 題庫補題失敗 ({file_name}): {str(e)}")
+            finally:
+                with self._pending_lock:
+                    self._pending.discard(file_name)
+
+    def _pick_offsets(self, file_name: str, sha256: str, total_chars: int) -> List[int]:
+        """優先挑選尚未出過題的片段，全部用過後再隨機重複"""
+        offsets = list(range(0, total_chars, CHUNK_SIZE))
+        unused = sorted(set(offsets) - set(self.bank.used_offsets(file_name, sha256)))
+        pool = unused if len(unused) >= self.chunks_per_request else offsets
+        return sorted(random.sample(pool, min(self.chunks_per_request, len(pool))))
+
+    def top_up(self, file_name: str, max_attempts: int = 3) -> int:
+        """
+        補題直到達到目標數量；其他程序正在為同一份教材補題時直接略過
+
+        Returns:
+            本次新增的題目數量
+        """
+        with self.bank.top_up_lock(file_name) as acquired:
+            if not acquired:
+                return 0
+            return self._top_up(file_name, max_attempts)
+
+    def _top_up(self, file_name: str, max_attempts: int) -> int:
+        file_path = self._file_path(file_name)
+        sha256 = self.content_sha256(file_name)
+        total_chars = self.document_cache.get_length(file_path)
+        if sha256 is None or not total_chars:
+            return 0
+
+        added, failures = 0, 0
+        while self.bank.count(file_name, sha256) < self.target_size and failures < max_attempts:
+            offsets = self._pick_offsets(file_name, sha256, total_chars)
+            chunks = [self.document_cache.get_slice(file_path, offset, CHUNK_SIZE) for offset in offsets]
+            content_text = "\n\n".join([f"內容 {i+1}: {chunk}" for i, chunk in enumerate(chunks)])
+            try:
+                questions = parse_questions_response(
+                    self.generate(build_question_prompt(content_text, len(chunks))))
+            except Exception as e:
+                failures += 1
+                print(f"⚠️ 題庫出題失敗 ({file_name}, 嘗試 {failures}/{max_attempts}): {str(e)}")
+                continue
+
+            valid = [question for question in questions if validate_question(question)]
+            if not valid:
+                failures += 1
+                continue
+            self.bank.add(file_name, sha256, valid, offsets)
+            added += len(valid)
+
+        print(f"📚 題庫補充完成: {file_name} 新增 {added} 題，"
+              f"目前 {self.bank.count(file_name, sha256)} 題")
+        return added
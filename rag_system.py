@@ -1,75 +1,265 @@
 import os
 import json
-from typing import List, Dict, Any, Optional
-from sentence_transformers import SentenceTransformer
-from pinecone import Pinecone
-import google.generativeai as genai
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Iterator, Tuple
+import numpy as np
 import time
+from vector_index import create_vector_index, get_backend_name
+from clients import get_pinecone_client, get_gemini_model
+from embeddings import get_embedding_model, is_loaded as embedding_model_loaded
+from embedding_cache import EmbeddingCache
+from embedding_batcher import EmbeddingBatcher
+from answer_cache import SemanticAnswerCache
+from context_builder import ContextBuilder, split_sentences
+from metrics import REGISTRY, stage_timer, cache_samples
+from llm_client import LLMClient, LLMError, LLMStreamInterruptedError
+from lexical_index import LexicalIndex, reciprocal_rank_fusion, get_lexical_index_path, DEFAULT_RRF_K
+
+GEMINI_FAILURE_MESSAGE = "抱歉，無法從 Gemini 獲取回答。請稍後再試。"
+EXTRACTIVE_ANSWER_HEADER = "⚠️ AI 服務暫時無法使用，以下為教材中與問題最相關的內容："
+STREAM_INTERRUPTED_NOTICE = "\n\n⚠️ AI 回答中途中斷，以上內容可能不完整，請重新查詢。"
 
 class RAGSystem:
     """
     RAG (Retrieval-Augmented Generation) 系統
-    結合 Pinecone 向量搜尋和 Gemini LLM 生成回答
+    結合向量搜尋（Pinecone 或本地索引）和 Gemini LLM 生成回答
     """
     
     def __init__(self, 
-                 pinecone_api_key: str,
+                 pinecone_api_key: Optional[str],
                  gemini_api_key: str,
                  pinecone_env: str = "us-east-1",
-                 index_name: str = "text-chunks-index"):
+                 index_name: str = "text-chunks-index",
+                 vector_backend: Optional[str] = None,
+                 local_index_path: Optional[str] = None):
         """
         初始化 RAG 系統
         
         Args:
-            pinecone_api_key: Pinecone API 金鑰
+            pinecone_api_key: Pinecone API 金鑰（本地後端可為 None）
             gemini_api_key: Gemini API 金鑰
             pinecone_env: Pinecone 環境
             index_name: Pinecone 索引名稱
+            vector_backend: 向量後端 "pinecone" 或 "local"，預設讀取環境變數 VECTOR_BACKEND
+            local_index_path: 本地索引目錄，預設讀取環境變數 LOCAL_INDEX_PATH
         """
         self.pinecone_api_key = pinecone_api_key
         self.gemini_api_key = gemini_api_key
         self.pinecone_env = pinecone_env
         self.index_name = index_name
+        self.vector_backend = get_backend_name(vector_backend)
+        self.local_index_path = local_index_path
+        self.embedding_cache = EmbeddingCache(maxsize=int(os.getenv('EMBEDDING_CACHE_SIZE', '1024')))
+        self.answer_cache = SemanticAnswerCache(
+            similarity_threshold=float(os.getenv('ANSWER_CACHE_SIMILARITY', '0.95')),
+            ttl_seconds=float(os.getenv('ANSWER_CACHE_TTL', '600')),
+            maxsize=int(os.getenv('ANSWER_CACHE_SIZE', '256'))
+        )
+        # 同時到達的查詢合併為一次 encode()；批次上限設為 0 或 1 時停用，直接逐筆編碼
+        batch_max_size = int(os.getenv('EMBEDDING_BATCH_MAX_SIZE', '32'))
+        self.embedding_batcher = EmbeddingBatcher(
+            self._encode_batch,
+            max_batch_size=batch_max_size,
+            max_wait_ms=float(os.getenv('EMBEDDING_BATCH_MAX_WAIT_MS', '5')),
+            timeout_ms=float(os.getenv('EMBEDDING_BATCH_TIMEOUT_MS', '2000'))
+        ) if batch_max_size > 1 else None
+        if self.embedding_batcher is not None:
+            REGISTRY.register(self.embedding_batcher.queue_depth)
+            REGISTRY.register(self.embedding_batcher.batch_size)
+        REGISTRY.register_collector('rag_caches', lambda: cache_samples({
+            'embedding': self.embedding_cache.stats(),
+            'answer': self.answer_cache.stats()
+        }))
+        # 關鍵字索引（init_db.py 匯入時建立）：與向量搜尋並行查詢並以 RRF 合併，嵌入模型無法使用時單獨使用
+        self.lexical_index = LexicalIndex(get_lexical_index_path()) \
+            if os.getenv('HYBRID_SEARCH', 'true').lower() == 'true' else None
+        self.rrf_k = int(os.getenv('RRF_K', str(DEFAULT_RRF_K)))
+        # init_db.py 的匯入清單：任何向量後端重新匯入時都會改寫，用來判斷語意回答快取是否失效
+        self.ingest_manifest_path = os.getenv('INGEST_MANIFEST', 'ingest_manifest.json')
+        # 向量搜尋失敗、只有關鍵字結果時的相關性門檻（查詢詞覆蓋率，與餘弦相似度的門檻分開設定）
+        self.lexical_coverage_threshold = float(os.getenv('LEXICAL_COVERAGE_THRESHOLD', '0.6'))
+        self.context_builder = ContextBuilder(
+            max_tokens=int(os.getenv('CONTEXT_MAX_TOKENS', '1500')),
+            score_cliff=float(os.getenv('CONTEXT_SCORE_CLIFF', '0.2'))
+        )
+        self._search_pool = None
+        self._search_pool_pid = None
         
-        # 初始化組件
-        self._initialize_pinecone()
-        self._initialize_gemini()
-        self._initialize_embedding_model()
+        # 向量索引在建構時連接（索引不存在時立即失敗）；Gemini 與嵌入模型在第一次使用或 warm_up() 時才載入
+        self._model = None
+        self._init_lock = threading.Lock()
+        # 所有 Gemini 呼叫共用的客戶端：逾時、期限、退避重試與熔斷
+        self.llm = LLMClient.from_env(lambda: self.model)
+        self.llm.register_metrics()
+        self._initialize_vector_store()
     
-    def _initialize_pinecone(self):
-        """初始化 Pinecone 客戶端"""
+    def _initialize_vector_store(self):
+        """初始化向量索引（Pinecone 或本地索引）"""
         try:
-            self.pc = Pinecone(api_key=self.pinecone_api_key)
-            self.index = self.pc.Index(self.index_name)
-            print(f"✅ Pinecone 初始化成功，連接到索引: {self.index_name}")
+            self.pc = None
+            if self.vector_backend == "pinecone":
+                self.pc = get_pinecone_client(self.pinecone_api_key)
+            # Pinecone 索引 handle 在同一程序內共用（連線池與 TLS 連線在請求之間重用）
+            self.index = create_vector_index(
+                self.vector_backend,
+                index_name=self.index_name,
+                pinecone_api_key=self.pinecone_api_key,
+                local_index_path=self.local_index_path
+            )
+            print(f"✅ 向量索引初始化成功 ({self.vector_backend})，連接到索引: {self.index_name}")
         except Exception as e:
-            print(f"❌ Pinecone 初始化失敗: {str(e)}")
+            print(f"❌ 向量索引初始化失敗: {str(e)}")
             raise
     
     def _initialize_gemini(self):
         """初始化 Gemini LLM"""
         try:
-            genai.configure(api_key=self.gemini_api_key)
-            # 使用免費的 gemini-2.5-flash 模型
-            self.model = genai.GenerativeModel('gemini-2.5-flash')
+            # 使用免費的 gemini-2.5-flash 模型（同一程序內共用）
+            self.model = get_gemini_model(self.gemini_api_key, 'gemini-2.5-flash')
             print("✅ Gemini LLM 初始化成功")
         except Exception as e:
             print(f"❌ Gemini 初始化失敗: {str(e)}")
             raise
     
-    def _initialize_embedding_model(self):
-        """初始化嵌入模型"""
+    @property
+    def model(self):
+        """Gemini 模型（第一次使用時匯入 google.generativeai 並初始化）"""
+        if self._model is None:
+            with self._init_lock:
+                if self._model is None:
+                    self._initialize_gemini()
+        return self._model
+    
+    @model.setter
+    def model(self, value):
+        self._model = value
+    
+    @property
+    def embedding_model(self):
+        """嵌入模型（第一次使用時載入，同一程序內共用）"""
         try:
-            print("正在載入嵌入模型...")
-            self.embedding_model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
-            print("✅ 嵌入模型載入完成")
+            return get_embedding_model()
         except Exception as e:
             print(f"❌ 嵌入模型載入失敗: {str(e)}")
             raise
     
+    @property
+    def is_warm(self) -> bool:
+        """Gemini 與嵌入模型是否都已載入"""
+        return self._model is not None and embedding_model_loaded()
+    
+    def warm_up(self, gemini: bool = True, encode: bool = True):
+        """
+        預先載入模型，讓第一個請求不必等待
+        
+        Args:
+            gemini: 是否初始化 Gemini 模型
+            encode: 是否執行一次編碼（初始化 torch 運算執行緒）；pre-fork 的主程序只載入權重，不執行編碼
+        """
+        started = time.perf_counter()
+        if gemini:
+            self.model
+        embedding_model = self.embedding_model
+        if encode:
+            embedding_model.encode(["warm up"], convert_to_numpy=True)
+        print(f"🔥 模型預熱完成，耗時 {time.perf_counter() - started:.2f}s")
+    
+    def reset_after_fork(self):
+        """
+        在 fork 出的 worker 中重建不可跨程序共用的連線：Pinecone 的 HTTP 連線池與 Gemini 客戶端
+        （clients.py 依程序 ID 區分快取，worker 會建立自己的連線）。
+        嵌入模型權重與本地索引（mmap）維持與主程序共用
+        """
+        self._model = None
+        if self.vector_backend == "pinecone":
+            self._initialize_vector_store()
+    
+    def embed_query(self, query: str) -> np.ndarray:
+        """
+        生成查詢向量（相同的正規化查詢直接使用快取，不經過嵌入模型）
+        
+        Args:
+            query: 查詢文字
+        
+        Returns:
+            float32 查詢向量
+        """
+        return self.embedding_cache.get_or_compute(query, self._compute_query_embedding)
+    
+    def _compute_query_embedding(self, text: str) -> np.ndarray:
+        """快取未命中時計算查詢向量（經過微批次處理器時包含排隊等待時間）"""
+        with stage_timer('embed'):
+            if self.embedding_batcher is None:
+                return self._encode_batch([text])[0]
+            # 等待超過 EMBEDDING_BATCH_TIMEOUT_MS 時改為直接編碼，不會無限期等待背景執行緒
+            return self.embedding_batcher.encode(text)
+    
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        """以一次 encode() 生成多個查詢向量"""
+        return self.embedding_model.encode(texts, batch_size=len(texts), convert_to_numpy=True)
+    
+    def _get_search_pool(self) -> ThreadPoolExecutor:
+        # 執行緒無法跨 fork 存活，pre-fork 的 worker 第一次查詢時各自建立
+        if self._search_pool is None or self._search_pool_pid != os.getpid():
+            with self._init_lock:
+                if self._search_pool is None or self._search_pool_pid != os.getpid():
+                    self._search_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='lexical-search')
+                    self._search_pool_pid = os.getpid()
+        return self._search_pool
+    
+    def _vector_search(self, query: str, top_k: int) -> List[Dict[str, Any]]:
+        """生成查詢向量並執行向量搜尋"""
+        query_embedding = self.embed_query(query).tolist()
+        with stage_timer('vector_search'):
+            return self.index.query(vector=query_embedding, top_k=top_k, include_metadata=True)['matches']
+    
+    def _lexical_search(self, query: str, top_k: int) -> List[Dict[str, Any]]:
+        """執行關鍵字搜尋"""
+        with stage_timer('lexical_search'):
+            return self.lexical_index.search(query, top_k)['matches']
+    
+    def _fuse_matches(self, vector_matches: Optional[List[Dict[str, Any]]],
+                      lexical_matches: List[Dict[str, Any]], top_k: int) -> List[Dict[str, Any]]:
+        """
+        以 reciprocal-rank fusion 合併向量與關鍵字結果
+        
+        Returns:
+            依融合分數排序的 match 列表。向量搜尋成功時 score 為餘弦相似度，只由關鍵字找到的文字塊不在向量候選中，
+            其相似度不會高於最後一個向量候選，以該值作為 score；向量搜尋失敗時 score 為查詢詞覆蓋率。
+            score_type 標示為 cosine 或 lexical_coverage
+        """
+        vector_by_id = {match['id']: match for match in vector_matches or []}
+        # 只由關鍵字找到的文字塊的餘弦相似度上限
+        vector_floor = min((match['score'] for match in vector_matches or []), default=0.0)
+        lexical_by_id = {match['id']: match for match in lexical_matches}
+        fused = reciprocal_rank_fusion(
+            [[match['id'] for match in vector_matches or []], [match['id'] for match in lexical_matches]],
+            k=self.rrf_k
+        )
+        matches = []
+        for chunk_id, rrf_score in fused[:top_k]:
+            vector_match, lexical_match = vector_by_id.get(chunk_id), lexical_by_id.get(chunk_id)
+            if vector_matches is None:
+                score = lexical_match['coverage']
+            else:
+                score = vector_match['score'] if vector_match else vector_floor
+            matches.append({
+                'id': chunk_id,
+                'score': score,
+                'score_type': 'lexical_coverage' if vector_matches is None else 'cosine',
+                'metadata': (vector_match or lexical_match)['metadata'],
+                'vector_score': vector_match['score'] if vector_match else None,
+                'lexical_score': lexical_match['score'] if lexical_match else None,
+                'rrf_score': rrf_score
+            })
+        return matches
+    
     def retrieve_similar_chunks(self, query: str, top_k: int = 3) -> List[Dict[str, Any]]:
         """
-        從 Pinecone 檢索最相似的文字塊
+        檢索最相似的文字塊：向量搜尋與關鍵字搜尋並行執行後以 RRF 合併；
+        嵌入模型或向量索引無法使用時只使用關鍵字搜尋
         
         Args:
             query: 查詢文字
@@ -79,19 +269,25 @@ class RAGSystem:
             相似文字塊列表
         """
         try:
-            # 生成查詢向量
-            query_embedding = self.embedding_model.encode([query]).tolist()[0]
-            
-            # 執行向量搜尋
-            results = self.index.query(
-                vector=query_embedding,
-                top_k=top_k,
-                include_metadata=True
-            )
+            if self.lexical_index is not None:
+                self.lexical_index.refresh()
+            hybrid = self.lexical_index is not None and len(self.lexical_index) > 0
+            if not hybrid:
+                matches = self._vector_search(query, top_k)
+            else:
+                # 各自多取候選，合併後再截取 top_k
+                candidates = top_k * 4
+                lexical_future = self._get_search_pool().submit(self._lexical_search, query, candidates)
+                try:
+                    vector_matches = self._vector_search(query, candidates)
+                except Exception as e:
+                    print(f"⚠️ 向量檢索失敗，改用關鍵字檢索: {str(e)}")
+                    vector_matches = None
+                matches = self._fuse_matches(vector_matches, lexical_future.result(), top_k)
             
             # 提取相關信息
             retrieved_chunks = []
-            for match in results['matches']:
+            for match in matches:
                 chunk_info = {
                     'id': match['id'],
                     'score': match['score'],
@@ -100,6 +296,9 @@ class RAGSystem:
                     'chunk_index': match['metadata'].get('chunk_index', -1),
                     'metadata': match['metadata']
                 }
+                if hybrid:
+                    chunk_info.update(vector_score=match['vector_score'], lexical_score=match['lexical_score'],
+                                      rrf_score=match['rrf_score'], score_type=match['score_type'])
                 retrieved_chunks.append(chunk_info)
             
             print(f"✅ 成功檢索到 {len(retrieved_chunks)} 個相關文字塊")
@@ -124,8 +323,9 @@ class RAGSystem:
         
         context_parts = []
         for i, chunk in enumerate(chunks, 1):
+            label = "關鍵字覆蓋率" if chunk.get('score_type') == 'lexical_coverage' else "相似度"
             context_part = f"""
-=== 相關資訊 {i} (相似度: {chunk['score']:.4f}) ===
+=== 相關資訊 {i} ({label}: {chunk['score']:.4f}) ===
 來源: {chunk['source_file']}
 內容: {chunk['text']}
 """
@@ -163,36 +363,52 @@ class RAGSystem:
 """
         return prompt
     
-    def query_gemini(self, prompt: str, max_retries: int = 3) -> str:
+    def extractive_answer(self, chunks: List[Dict[str, Any]], max_chunks: int = 3,
+                          max_chars: int = 150) -> str:
         """
-        向 Gemini 發送查詢並獲取回答
+        LLM 無法使用時的備援回答：直接摘錄相似度最高的文字塊開頭幾句
         
         Args:
-            prompt: 完整的提示詞
-            max_retries: 最大重試次數
+            chunks: 檢索到的文字塊（依相似度排序）
+            max_chunks: 摘錄的文字塊數量
+            max_chars: 每個文字塊摘錄的字數上限
         
         Returns:
-            Gemini 的回答
+            摘錄式回答
         """
-        for attempt in range(max_retries):
-            try:
-                response = self.model.generate_content(prompt)
-                
-                if response.text:
-                    return response.text
-                else:
-                    print(f"⚠️ Gemini 回應為空，嘗試 {attempt + 1}/{max_retries}")
-                    
-            except Exception as e:
-                print(f"❌ Gemini 查詢失敗 (嘗試 {attempt + 1}/{max_retries}): {str(e)}")
-                if attempt < max_retries - 1:
-                    time.sleep(2)  # 等待2秒後重試
-                    
-        return "抱歉，無法從 Gemini 獲取回答。請稍後再試。"
+        lines = [EXTRACTIVE_ANSWER_HEADER, ""]
+        for i, chunk in enumerate(chunks[:max_chunks], 1):
+            excerpt = ""
+            for sentence in split_sentences(chunk['text'].strip()):
+                if excerpt and len(excerpt) + len(sentence) > max_chars:
+                    break
+                excerpt += sentence
+            excerpt = " ".join(excerpt.split())[:max_chars]
+            lines.append(f"{i}. {excerpt}（來源: {chunk['source_file']}）")
+        return "\n".join(lines)
     
-    def query(self, query: str, top_k: int = 3, similarity_threshold: float = 0.5) -> Dict[str, Any]:
+    def invalidate_caches(self):
+        """重新匯入資料後清除回答快取"""
+        self.answer_cache.invalidate()
+    
+    def data_version(self) -> Tuple[Any, ...]:
         """
-        執行完整的 RAG 查詢流程
+        目前資料的版本：向量索引、關鍵字索引與匯入清單的版本（修改時間）
+        Pinecone 沒有本地檔案可比較，重新匯入由 init_db.py 改寫的匯入清單與關鍵字索引反映
+        
+        Returns:
+            任一部分改變即不同的版本值
+        """
+        try:
+            manifest_mtime = os.path.getmtime(self.ingest_manifest_path)
+        except OSError:
+            manifest_mtime = None
+        lexical_version = self.lexical_index.version if self.lexical_index is not None else None
+        return getattr(self.index, 'version', None), lexical_version, manifest_mtime
+    
+    def _prepare_query(self, query: str, top_k: int, similarity_threshold: float) -> Dict[str, Any]:
+        """
+        執行檢索、相似度檢查與回答快取查詢
         
         Args:
             query: 用戶查詢
@@ -200,7 +416,7 @@ class RAGSystem:
             similarity_threshold: 相似度閾值，低於此值視為不相關
         
         Returns:
-            包含檢索結果和 LLM 回答的字典
+            查詢結果字典；若已包含 'answer'（無相關內容或快取命中）則不需呼叫 LLM
         """
         print(f"🔍 開始 RAG 查詢: {query}")
         
@@ -219,6 +435,10 @@ class RAGSystem:
             }
         
         # 3. 檢查最高相似度是否達到閾值
+        #    向量搜尋失敗、只有關鍵字結果時改以查詢詞覆蓋率與 LEXICAL_COVERAGE_THRESHOLD 判斷
+        #    （覆蓋率與餘弦相似度不能比較：只有一個 bigram 的查詢出現在任何文字塊時覆蓋率即為 1）
+        if retrieved_chunks[0].get('score_type') == 'lexical_coverage':
+            similarity_threshold = self.lexical_coverage_threshold
         max_similarity = max(chunk['score'] for chunk in retrieved_chunks)
         print(f"📊 最高相似度: {max_similarity:.4f} (閾值: {similarity_threshold})")
         
@@ -232,23 +452,157 @@ class RAGSystem:
                 'has_context': False
             }
         
-        # 4. 格式化上下文
-        context = self.format_context(retrieved_chunks)
-        
-        # 5. 生成提示詞
-        prompt = self.generate_prompt(query, context)
-        
-        # 6. 查詢 Gemini LLM
-        answer = self.query_gemini(prompt)
-        
-        # 7. 整理結果
+        # 4. 組裝上下文：截斷低分文字塊、合併相鄰文字塊並限制在 token 預算內
+        with stage_timer('context_build'):
+            blocks, context_stats = self.context_builder.build(query, retrieved_chunks)
+            context = self.format_context(blocks)
+        print(f"✂️ 上下文 {context_stats['original_tokens']} → {context_stats['context_tokens']} tokens"
+              f"（節省 {context_stats['saved_ratio']:.0%}）")
         result = {
             'query': query,
             'retrieved_chunks': retrieved_chunks,
             'context': context,
-            'answer': answer,
+            'context_stats': context_stats,
             'success': True,
-            'has_context': True
+            'has_context': True,
+            'cached': False
+        }
+        
+        # 5. 語意回答快取：相同上下文下的近似問題直接返回先前的回答
+        # 任何後端重新匯入資料後（匯入清單或索引改變），先前快取的回答全部失效
+        self.answer_cache.sync_index_version(self.data_version())
+        try:
+            cached = self.answer_cache.lookup(self.embed_query(query),
+                                              [chunk['id'] for chunk in retrieved_chunks])
+        except Exception as e:
+            print(f"⚠️ 無法生成查詢向量，略過回答快取: {str(e)}")
+            cached = None
+        if cached:
+            print(f"♻️ 使用快取回答 (相似度: {cached['similarity']:.4f})")
+            result.update(answer=cached['answer'], cached=True)
+        
+        return result
+    
+    def _remember_answer(self, result: Dict[str, Any], answer: str):
+        """將成功取得的 LLM 回答寫入語意回答快取"""
+        if answer and answer != GEMINI_FAILURE_MESSAGE:
+            try:
+                query_embedding = self.embed_query(result['query'])
+            except Exception:
+                return
+            self.answer_cache.store(
+                query_embedding,
+                [chunk['id'] for chunk in result['retrieved_chunks']],
+                answer,
+                result['query']
+            )
+    
+    def query(self, query: str, top_k: int = 3, similarity_threshold: float = 0.5) -> Dict[str, Any]:
+        """
+        執行完整的 RAG 查詢流程
+        
+        Args:
+            query: 用戶查詢
+            top_k: 檢索的文字塊數量
+            similarity_threshold: 相似度閾值，低於此值視為不相關
+        
+        Returns:
+            包含檢索結果和 LLM 回答的字典
+        """
+        result = self._prepare_query(query, top_k, similarity_threshold)
+        if 'answer' in result:
+            return result
+        
+        # 6. 生成提示詞並查詢 Gemini LLM；無法使用（重試用盡、逾時或熔斷）時改用摘錄式回答
+        prompt = self.generate_prompt(query, result['context'])
+        try:
+            answer = self.llm.generate(prompt, operation='rag_query')
+            self._remember_answer(result, answer)
+        except LLMError as e:
+            answer = self._fallback_answer(result, e)
+        
+        result['answer'] = answer
+        return result
+    
+    async def aquery(self, query: str, top_k: int = 3, similarity_threshold: float = 0.5) -> Dict[str, Any]:
+        """
+        asyncio 版的 query()：檢索與上下文組裝（嵌入編碼、向量搜尋）在執行緒池中執行，
+        Gemini 呼叫以非同步 API 等待，不佔用執行緒
+        
+        Args 與 Returns 同 query()
+        """
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(None, self._prepare_query, query, top_k, similarity_threshold)
+        if 'answer' in result:
+            return result
+        
+        prompt = self.generate_prompt(query, result['context'])
+        try:
+            answer = await self.llm.agenerate(prompt, operation='rag_query')
+            self._remember_answer(result, answer)
+        except LLMError as e:
+            answer = self._fallback_answer(result, e)
+        
+        result['answer'] = answer
+        return result
+    
+    def _fallback_answer(self, result: Dict[str, Any], error: LLMError) -> str:
+        """Gemini 無法使用時以摘錄式回答取代"""
+        print(f"⚠️ Gemini 無法使用，改用摘錄式回答: {str(error)}")
+        result['fallback'] = 'extractive'
+        return self.extractive_answer(result['retrieved_chunks'])
+    
+    def stream_query(self, query: str, top_k: int = 3,
+                     similarity_threshold: float = 0.5) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        串流版的 RAG 查詢：先產生檢索結果，再逐段產生 LLM 回答
+        
+        Args:
+            query: 用戶查詢
+            top_k: 檢索的文字塊數量
+            similarity_threshold: 相似度閾值，低於此值視為不相關
+        
+        Yields:
+            (事件名稱, 資料)：'chunks' 檢索結果、'token' 回答片段、'done' 完整回答
+            （串流中途中斷時 done 的 truncated 為 True，回答不會寫入語意快取）
+        """
+        result = self._prepare_query(query, top_k, similarity_threshold)
+        yield 'chunks', {
+            'query': query,
+            'retrieved_chunks': result['retrieved_chunks'],
+            'has_context': len(result['retrieved_chunks']) > 0
         }
         
-        return result 
\ No newline at end of file
+        if 'answer' in result:
+            yield 'token', {'text': result['answer']}
+        else:
+            prompt = self.generate_prompt(query, result['context'])
+            parts = []
+            try:
+                for text in self.llm.stream(prompt, operation='rag_stream'):
+                    parts.append(text)
+                    yield 'token', {'text': text}
+            except LLMStreamInterruptedError as e:
+                # 已送出部分文字：保留並標示回答不完整
+                print(f"⚠️ {str(e)}")
+                result['truncated'] = True
+                parts.append(STREAM_INTERRUPTED_NOTICE)
+                yield 'token', {'text': STREAM_INTERRUPTED_NOTICE}
+            except LLMError as e:
+                # 尚未產生任何文字
+                parts = [self._fallback_answer(result, e)]
+                yield 'token', {'text': parts[0]}
+            result['answer'] = "".join(parts)
+            # 只快取完整的 Gemini 回答
+            if 'fallback' not in result and not result.get('truncated'):
+                self._remember_answer(result, result['answer'])
+        
+        yield 'done', {
+            'answer': result['answer'],
+            'success': result['success'],
+            'has_context': len(result['retrieved_chunks']) > 0,
+            'cached': result.get('cached', False),
+            'fallback': result.get('fallback'),
+            'truncated': result.get('truncated', False),
+            'context_stats': result.get('context_stats')
+        }
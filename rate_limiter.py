@@ -0,0 +1,213 @@
+# Gemini 呼叫的速率限制
+# 以兩個 token bucket 同時限制每分鐘請求數（RPM）與每分鐘 token 數（TPM），所有呼叫點共用：
+#   - 呼叫前預約額度：額度足夠立即放行，不足時預先扣除並計算需要等待的時間，
+#     呼叫端等待該時間後送出（先預約先放行，不會一起醒來再搶一次）
+#   - token 數呼叫前以提示詞長度加上預期回答長度估計，呼叫後依實際用量補扣或退還
+#   - memory 後端只限制單一程序；file 後端把額度存在本機檔案並以 flock 保護，
+#     讓 gunicorn 的多個 worker（以及同一台機器上的批次腳本）共用同一份額度
+# 排隊等待時間記錄在 llm_rate_limit_wait_seconds
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Iterator, Optional, Tuple
+
+from context_builder import estimate_tokens
+from metrics import LLM_RATE_LIMIT_WAIT, LLM_RATE_LIMITED
+from question_bank import file_lock
+
+DEFAULT_STATE_PATH = os.path.join('cache', 'llm_rate_limit.json')
+
+
+class RateLimitExceeded(Exception):
+    """等待額度的時間會超過呼叫端的期限"""
+
+
+class RateLimiter:
+    """
+    RPM / TPM 雙 token bucket 限制器
+
+    使用方式:
+        limiter = RateLimiter(requests_per_minute=60, tokens_per_minute=100000)
+        estimated = limiter.acquire(prompt, operation='rag_query', max_wait=30)
+        ...呼叫 Gemini...
+        limiter.settle(estimated, actual_tokens)
+    """
+
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0,
+                 backend: str = 'memory', state_path: str = DEFAULT_STATE_PATH,
+                 completion_tokens: int = 500):
+        """
+        初始化限制器
+
+        Args:
+            requests_per_minute: 每分鐘請求數上限（0 表示不限制）
+            tokens_per_minute: 每分鐘 token 數上限（0 表示不限制）
+            backend: memory（單一程序）或 file（同一台機器的所有程序共用）
+            state_path: file 後端的狀態檔路徑
+            completion_tokens: 估計 token 數時預期的回答長度
+        """
+        if backend not in ('memory', 'file'):
+            raise ValueError(f"不支援的速率限制後端: {backend}（可用：memory、file）")
+        self.limits = {'requests': float(requests_per_minute), 'tokens': float(tokens_per_minute)}
+        self.backend = backend
+        self.state_path = state_path
+        self.completion_tokens = completion_tokens
+        self.enabled = any(limit > 0 for limit in self.limits.values())
+        # memory 後端的狀態；file 後端每次從檔案讀取
+        self._state: Optional[Dict[str, float]] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "RateLimiter":
+        """依環境變數 LLM_RPM、LLM_TPM、LLM_RATE_LIMIT_BACKEND、LLM_RATE_LIMIT_PATH 建立"""
+        return cls(
+            requests_per_minute=float(os.getenv('LLM_RPM', '0')),
+            tokens_per_minute=float(os.getenv('LLM_TPM', '0')),
+            backend=os.getenv('LLM_RATE_LIMIT_BACKEND', 'memory').lower(),
+            state_path=os.getenv('LLM_RATE_LIMIT_PATH', DEFAULT_STATE_PATH),
+            completion_tokens=int(os.getenv('LLM_EXPECTED_COMPLETION_TOKENS', '500'))
+        )
+
+    def _full_state(self, now: float) -> Dict[str, float]:
+        return {**self.limits, 'updated': now}
+
+    def _load(self, now: float) -> Dict[str, float]:
+        if self.backend == 'memory':
+            return self._state or self._full_state(now)
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            return {name: float(state[name]) for name in ('requests', 'tokens', 'updated')}
+        except (OSError, ValueError, KeyError, TypeError):
+            # 第一次使用或狀態檔損毀：從滿額度開始
+            return self._full_state(now)
+
+    def _save(self, state: Dict[str, float]):
+        if self.backend == 'memory':
+            self._state = state
+            return
+        with open(self.state_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        with self._lock, file_lock(self.state_path + '.lock') if self.backend == 'file' else nullcontext():
+            yield
+
+    def _update(self, costs: Dict[str, float], max_wait: Optional[float]) -> Optional[float]:
+        """
+        補充額度後預約 costs；需要等待超過 max_wait 時不預約
+
+        Returns:
+            需要等待的秒數，未預約時為 None
+        """
+        with self._locked():
+            now = time.time()
+            state = self._load(now)
+            elapsed = max(0.0, now - state['updated'])
+            wait = 0.0
+            for name, limit in self.limits.items():
+                if limit <= 0:
+                    continue
+                rate = limit / 60
+                state[name] = min(limit, state[name] + elapsed * rate)
+                # 單次用量超過整分鐘額度時以額度上限計，避免永遠無法放行
+                cost = min(costs.get(name, 0), limit)
+                if cost > state[name]:
+                    wait = max(wait, (cost - state[name]) / rate)
+            state['updated'] = now
+            if max_wait is not None and wait > max_wait:
+                self._save(state)
+                return None
+            for name, limit in self.limits.items():
+                if limit > 0:
+                    state[name] -= min(costs.get(name, 0), limit)
+            self._save(state)
+            return wait
+
+    def estimate(self, prompt: str) -> int:
+        """估計一次呼叫的 token 數（提示詞加上預期的回答長度）"""
+        return estimate_tokens(prompt) + self.completion_tokens
+
+    def acquire(self, prompt: str, operation: str = 'generate', max_wait: Optional[float] = None) -> int:
+        """
+        預約一次呼叫的額度，必要時等待
+
+        Args:
+            prompt: 提示詞（用於估計 token 數）
+            operation: 呼叫用途（記錄於 metrics）
+            max_wait: 最多等待秒數，None 表示不限
+
+        Returns:
+            預約的 token 數（呼叫完成後傳給 settle()）
+
+        Raises:
+            RateLimitExceeded: 需要等待的時間超過 max_wait
+        """
+        estimated, wait = self.reserve(prompt, operation, max_wait)
+        if wait > 0:
+            time.sleep(wait)
+        return estimated
+
+    def reserve(self, prompt: str, operation: str = 'generate',
+                max_wait: Optional[float] = None) -> Tuple[int, float]:
+        """
+        預約額度但不等待（asyncio 呼叫端以 asyncio.sleep 等待返回的秒數）
+
+        Returns:
+            (預約的 token 數, 需要等待的秒數)
+
+        Raises:
+            RateLimitExceeded: 需要等待的時間超過 max_wait
+        """
+        estimated = self.estimate(prompt)
+        if not self.enabled:
+            return estimated, 0.0
+        wait = self._update({'requests': 1, 'tokens': estimated}, max_wait)
+        if wait is None:
+            LLM_RATE_LIMITED.inc(operation=operation)
+            raise RateLimitExceeded(f"Gemini 速率限制：等待時間超過 {max_wait:.1f}s")
+        LLM_RATE_LIMIT_WAIT.observe(wait, operation=operation)
+        return estimated, wait
+
+    def try_acquire(self, prompt: str, operation: str = 'generate') -> Optional[int]:
+        """不等待的 acquire()：額度足夠時預約並返回 token 數，否則返回 None"""
+        try:
+            return self.acquire(prompt, operation, max_wait=0.0)
+        except RateLimitExceeded:
+            return None
+
+    def settle(self, estimated: int, actual: Optional[int]):
+        """
+        依實際 token 數修正預約的額度（多用的補扣，少用的退還）
+
+        Args:
+            estimated: acquire() 返回的 token 數
+            actual: 實際用量，未知時不修正
+        """
+        if not self.enabled or self.limits['tokens'] <= 0 or actual is None or actual == estimated:
+            return
+        self._update({'tokens': actual - estimated}, None)
+
+    def stats(self) -> Dict[str, float]:
+        """目前剩餘的額度（未補充前的數值）"""
+        with self._locked():
+            state = self._load(time.time())
+        return {name: state[name] for name, limit in self.limits.items() if limit > 0}
+
+
+_shared_limiter: Optional[RateLimiter] = None
+_shared_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """取得所有 Gemini 呼叫點共用的限制器（同一程序內只建立一次）"""
+    global _shared_limiter
+    if _shared_limiter is None:
+        with _shared_lock:
+            if _shared_limiter is None:
+                _shared_limiter = RateLimiter.from_env()
+    return _shared_limiter
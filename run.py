@@ -5,8 +5,17 @@ RAG 系統啟動腳本
 
 import os
 import sys
+import argparse
+import importlib.util
 from dotenv import load_dotenv
 
+def module_available(name: str) -> bool:
+    """檢查套件是否已安裝（不匯入套件本身）"""
+    try:
+        return importlib.util.find_spec(name) is not None
+    except ModuleNotFoundError:
+        return False
+
 def check_environment():
     """檢查環境設定"""
     print("🔍 檢查環境設定...")
@@ -14,11 +23,13 @@ def check_environment():
     # 載入環境變數
     load_dotenv()
     
-    # 檢查必要的環境變數
+    # 檢查必要的環境變數（本地索引後端不需要 Pinecone 金鑰）
     required_vars = {
         'PINECONE_API_KEY': 'Pinecone API 金鑰',
         'GEMINI_API_KEY': 'Gemini API 金鑰'
     }
+    if os.getenv('VECTOR_BACKEND', 'pinecone').strip().lower() != 'pinecone':
+        required_vars.pop('PINECONE_API_KEY')
     
     missing_vars = []
     for var, description in required_vars.items():
@@ -36,7 +47,52 @@ def check_environment():
     print("✅ 環境變數檢查通過")
     return True
 
-def main():
+def run_production():
+    """
+    以 Gunicorn pre-fork 模式啟動：主程序預先載入模型後 fork 多個 worker（設定見 gunicorn.conf.py）
+    以 exec 取代目前程序，讓 Gunicorn 直接接收 HUP / TERM 等訊號
+    """
+    if not module_available('gunicorn'):
+        print("❌ 生產模式需要 gunicorn，請執行: pip install -r requirements.txt")
+        sys.exit(1)
+    
+    config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gunicorn.conf.py')
+    print(f"\n🌐 以生產模式啟動（{os.getenv('GUNICORN_WORKERS', '2')} 個 worker，"
+          f"每個 {os.getenv('GUNICORN_THREADS', '4')} 執行緒）...")
+    print("=" * 60)
+    sys.stdout.flush()
+    os.execvp(sys.executable, [sys.executable, '-m', 'gunicorn', '--config', config_path, 'app:app'])
+
+def run_asgi():
+    """
+    以 Uvicorn 啟動 ASGI 版本（asgi.py）：/query、/exam/generate、/exam/grade 以 asyncio 處理，
+    單一程序即可同時等待大量 Gemini 回應；以 exec 取代目前程序
+    """
+    missing = [name for name in ('uvicorn', 'starlette', 'a2wsgi') if not module_available(name)]
+    if missing:
+        print(f"❌ ASGI 模式需要 {', '.join(missing)}，請執行: pip install -r requirements.txt")
+        sys.exit(1)
+    
+    workers = os.getenv('UVICORN_WORKERS', '1')
+    if int(workers) > 1:
+        # 多個 worker 時，/metrics 合併各 worker 寫入此目錄的指標快照
+        import tempfile
+        from metrics import reset_multiprocess_dir
+        os.environ['METRICS_MULTIPROC_DIR'] = (os.getenv('METRICS_MULTIPROC_DIR')
+                                               or os.path.join(tempfile.gettempdir(), 'rag-metrics'))
+        reset_multiprocess_dir(os.environ['METRICS_MULTIPROC_DIR'])
+    print(f"\n🌐 以 ASGI 模式啟動（{workers} 個 Uvicorn worker）...")
+    print("=" * 60)
+    sys.stdout.flush()
+    os.execvp(sys.executable, [
+        sys.executable, '-m', 'uvicorn', 'asgi:app',
+        '--host', os.getenv('APP_HOST', '0.0.0.0'),
+        '--port', os.getenv('APP_PORT', '5002'),
+        '--workers', workers,
+        '--timeout-keep-alive', '5'
+    ])
+
+def main(production: bool = False, asgi: bool = False):
     """主函數"""
     print("=" * 60)
     print("🚀 RAG 智能問答系統")
@@ -46,20 +102,22 @@ def main():
     if not check_environment():
         sys.exit(1)
     
-    # 檢查依賴
-    try:
-        import flask
-        import pinecone
-        import sentence_transformers
-        import google.generativeai
-        print("✅ 所有依賴已安裝")
-    except ImportError as e:
-        print(f"❌ 缺少依賴: {e}")
+    # 檢查依賴（只確認套件存在，不實際匯入 torch 等大型套件）
+    missing = [name for name in ('flask', 'pinecone', 'sentence_transformers', 'google.generativeai')
+               if not module_available(name)]
+    if missing:
+        print(f"❌ 缺少依賴: {', '.join(missing)}")
         print("請執行: pip install -r requirements.txt")
         sys.exit(1)
+    print("✅ 所有依賴已安裝")
+    
+    if asgi:
+        run_asgi()
+    if production:
+        run_production()
     
     # 啟動應用程式
-    print("\n🌐 啟動 Flask 應用程式...")
+    print("\n🌐 啟動 Flask 開發伺服器...")
     print("=" * 60)
     
     # 設定 Flask 環境變數
@@ -68,14 +126,27 @@ def main():
     
     # 導入並啟動應用程式
     try:
-        from app import app
+        from app import app, warm_up
         print("✅ 應用程式載入成功")
         print("🌍 訪問地址: http://localhost:5002")
         print("=" * 60)
+        # 在背景載入模型；debug 模式下只在實際提供服務的重新載入子程序中執行
+        if os.environ.get('WERKZEUG_RUN_MAIN') == 'true' and \
+                os.getenv('WARM_UP_ON_START', 'true').lower() == 'true':
+            warm_up()
         app.run(debug=True, host='0.0.0.0', port=5002)
     except Exception as e:
         print(f"❌ 應用程式啟動失敗: {str(e)}")
         sys.exit(1)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="啟動 RAG 智能問答系統")
+    parser.add_argument('--production', action='store_true',
+                        default=os.getenv('SERVER_MODE', '').lower() == 'production',
+                        help="以 Gunicorn pre-fork 模式啟動（預設讀取環境變數 SERVER_MODE）")
+    parser.add_argument('--asgi', action='store_true',
+                        default=os.getenv('SERVER_MODE', '').lower() == 'asgi',
+                        help="以 Uvicorn 啟動 ASGI 版本（SERVER_MODE=asgi）")
+    args = parser.parse_args()
+    main(production=args.production, asgi=args.asgi) 
\ No newline at end of file
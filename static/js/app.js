@@ -142,6 +142,19 @@ class RAGApp {
         // 顯示載入狀態
         this.showLoading();
         
+        // 瀏覽器支援串流讀取時，改用 Server-Sent Events 逐段顯示回答
+        if (window.ReadableStream && window.TextDecoder) {
+            try {
+                await this.handleStreamingQuery(query);
+            } catch (error) {
+                console.error('查詢錯誤:', error);
+                this.showError('網路錯誤，請稍後再試');
+            } finally {
+                this.hideLoading();
+            }
+            return;
+        }
+        
         try {
             const response = await fetch('/query', {
                 method: 'POST',
@@ -166,6 +179,73 @@ class RAGApp {
         }
     }
 
+    async handleStreamingQuery(query) {
+        const response = await fetch('/query/stream', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ query: query })
+        });
+        
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder('utf-8');
+        let buffer = '';
+        let answer = '';
+        
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) {
+                break;
+            }
+            buffer += decoder.decode(value, { stream: true });
+            
+            // SSE 訊息以空行分隔
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const message = this.parseServerSentEvent(buffer.slice(0, boundary));
+                buffer = buffer.slice(boundary + 2);
+                if (!message) {
+                    continue;
+                }
+                
+                if (message.event === 'chunks') {
+                    this.hideLoading();
+                    this.displayResults({ ...message.data, answer: '' });
+                    this.playAudioBtn.style.display = 'none';
+                } else if (message.event === 'token') {
+                    answer += message.data.text;
+                    this.answerContent.innerHTML = this.formatAnswer(answer);
+                } else if (message.event === 'done') {
+                    this.answerContent.innerHTML = this.formatAnswer(message.data.answer);
+                    this.updateDatabaseStatus(message.data.has_context);
+                    this.playAudioBtn.style.display = 'inline-block';
+                    this.updateAudioButtonState();
+                } else if (message.event === 'error') {
+                    this.showError(message.data.error || '查詢失敗');
+                }
+            }
+        }
+    }
+
+    parseServerSentEvent(block) {
+        let event = 'message';
+        const dataLines = [];
+        
+        block.split('\n').forEach(line => {
+            if (line.startsWith('event:')) {
+                event = line.slice(6).trim();
+            } else if (line.startsWith('data:')) {
+                dataLines.push(line.slice(5).trim());
+            }
+        });
+        
+        if (dataLines.length === 0) {
+            return null;
+        }
+        return { event: event, data: JSON.parse(dataLines.join('\n')) };
+    }
+
     showLoading() {
         this.loadingSection.style.display = 'block';
         this.resultsSection.style.display = 'none';
@@ -6,15 +6,18 @@
 
 # 2. 匯入必要的函式庫
 import os
-import uuid
-from typing import List, Dict, Any
+import hashlib
+from bisect import bisect_right
+from typing import List, Dict, Any, Iterable, Iterator, Tuple, Optional
 import numpy as np
-from sentence_transformers import SentenceTransformer
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from pinecone import Pinecone, ServerlessSpec, CloudProvider, AwsRegion
 import time
-import PyPDF2
-import pdfplumber
+from vector_index import create_vector_index, get_backend_name, flush_index
+from pdf_pages import iter_pdf_pages
+from lexical_index import LexicalIndex, get_lexical_index_path
+from embeddings import get_embedding_model
+from ingest_pipeline import IngestPipeline, print_stage_report
+import clients
+# sentence_transformers、torch、pinecone 與 langchain 在第一次使用時才匯入，匯入本模組不會載入模型
 
 # 3. 設定 API 金鑰和環境變數
 from dotenv import load_dotenv
@@ -23,20 +26,37 @@ load_dotenv()
 PINECONE_API_KEY = os.getenv('PINECONE_API_KEY')
 PINECONE_ENV = "us-east-1"
 
-# 4. 初始化 Pinecone 客戶端
-pc = Pinecone(api_key=PINECONE_API_KEY)
+# 4. Pinecone 客戶端（僅在使用 Pinecone 後端時建立，見 clients.py）
+def get_pinecone_client():
+    """取得共用的 Pinecone 客戶端（首次呼叫時建立）"""
+    return clients.get_pinecone_client(PINECONE_API_KEY)
 
 # 5. 設定索引名稱和維度
 INDEX_NAME = "text-chunks-index"
 DIMENSION = 384  # sentence-transformers/all-MiniLM-L6-v2 的向量維度
 
-# 6. 創建或連接 Pinecone 索引
-def create_or_connect_index():
-    """創建或連接到 Pinecone 索引"""
+# 6. 創建或連接向量索引
+def create_or_connect_index(backend: str = None):
+    """
+    創建或連接到向量索引
+    
+    Args:
+        backend: "pinecone" 或 "local"，未指定時讀取環境變數 VECTOR_BACKEND
+    
+    Returns:
+        向量索引物件，失敗時返回 None
+    """
+    backend = get_backend_name(backend)
     try:
-        # 檢查索引是否已存在
-        existing_indexes = pc.list_indexes()
-        if INDEX_NAME not in [idx.name for idx in existing_indexes]:
+        if backend != "pinecone":
+            index = create_vector_index(backend, index_name=INDEX_NAME, dimension=DIMENSION)
+            print(f"成功連接到本地索引: {index.path}")
+            return index
+        
+        from pinecone import ServerlessSpec, CloudProvider, AwsRegion
+        pc = get_pinecone_client()
+        # 檢查索引是否已存在（確認過的索引不再呼叫 list_indexes()）
+        if not clients.index_exists(INDEX_NAME, PINECONE_API_KEY):
             print(f"創建新索引: {INDEX_NAME}")
             pc.create_index(
                 name=INDEX_NAME,
@@ -49,21 +69,19 @@ def create_or_connect_index():
             )
             # 等待索引初始化完成
             time.sleep(10)
+            clients.remember_index(INDEX_NAME, PINECONE_API_KEY)
         else:
             print(f"索引 {INDEX_NAME} 已存在，正在連接...")
         
-        # 連接到索引
-        index = pc.Index(INDEX_NAME)
+        # 連接到索引（共用的 handle，連線池在呼叫之間重用）
+        index = clients.get_pinecone_index(INDEX_NAME, PINECONE_API_KEY)
         print(f"成功連接到索引: {INDEX_NAME}")
         return index
     except Exception as e:
         print(f"創建或連接索引時發生錯誤: {str(e)}")
         return None
 
-# 7. 初始化文字嵌入模型
-print("正在載入嵌入模型...")
-embedding_model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
-print("嵌入模型載入完成!")
+# 7. 文字嵌入模型（第一次生成向量時才載入，見 embeddings.get_embedding_model）
 
 # 8. 文字分塊函式
 def chunk_text(text: str, chunk_size: int = 500, chunk_overlap: int = 50) -> List[str]:
@@ -78,15 +96,74 @@ def chunk_text(text: str, chunk_size: int = 500, chunk_overlap: int = 50) -> Lis
     Returns:
         分割後的文字塊列表
     """
-    text_splitter = RecursiveCharacterTextSplitter(
+    text_splitter = _make_text_splitter(chunk_size, chunk_overlap)
+    
+    chunks = text_splitter.split_text(text)
+    return chunks
+
+def _make_text_splitter(chunk_size: int, chunk_overlap: int):
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    return RecursiveCharacterTextSplitter(
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap,
         length_function=len,
         separators=["\n\n", "\n", "。", ".", "!", "?", ";", ",", " ", ""]
     )
+
+# 8.1. 逐頁分塊函式
+def chunk_pages(pages: Iterable[Tuple[int, str]], chunk_size: int = 500, chunk_overlap: int = 50,
+                window_chars: int = None) -> Iterator[Tuple[str, int]]:
+    """
+    逐頁分塊：頁面文字依序進入有限大小的緩衝區，累積到 window_chars 後分塊並輸出完整的文字塊，
+    最後一個（可能未完整的）文字塊留在緩衝區與下一頁接續，整份文件不需同時放在記憶體中
     
-    chunks = text_splitter.split_text(text)
-    return chunks
+    Args:
+        pages: (頁碼, 頁面文字) 的可迭代物件，例如 iter_pdf_pages() 的輸出
+        chunk_size: 每個塊的最大字符數
+        chunk_overlap: 塊之間的重疊字符數
+        window_chars: 緩衝區分塊門檻，預設為 chunk_size 的 8 倍
+    
+    Yields:
+        (文字塊, 文字塊起始位置所在的頁碼)
+    """
+    text_splitter = _make_text_splitter(chunk_size, chunk_overlap)
+    window_chars = window_chars or chunk_size * 8
+    buffer = ""
+    page_offsets: List[int] = []
+    page_numbers: List[int] = []
+    
+    def split_buffer(final: bool) -> Iterator[Tuple[str, int]]:
+        nonlocal buffer, page_offsets, page_numbers
+        chunks = text_splitter.split_text(buffer)
+        position = 0
+        for chunk in (chunks if final else chunks[:-1]):
+            found = buffer.find(chunk, position)
+            position = found if found >= 0 else position
+            yield chunk, page_numbers[max(0, bisect_right(page_offsets, position) - 1)]
+        if final or not chunks:
+            return
+        
+        # 保留最後一個文字塊，與下一頁接續
+        found = buffer.find(chunks[-1], position)
+        tail_start = found if found >= 0 else position
+        first = max(0, bisect_right(page_offsets, tail_start) - 1)
+        buffer = buffer[tail_start:]
+        page_offsets = [0] + [offset - tail_start for offset in page_offsets[first + 1:]]
+        page_numbers = page_numbers[first:]
+    
+    for page_number, page_text in pages:
+        if not page_text:
+            continue
+        if buffer:
+            buffer += "\n"
+        page_offsets.append(len(buffer))
+        page_numbers.append(page_number)
+        buffer += page_text
+        if len(buffer) >= window_chars:
+            yield from split_buffer(final=False)
+    
+    if buffer.strip():
+        yield from split_buffer(final=True)
 
 # 9. 生成向量函式
 def generate_embeddings(texts: List[str]) -> List[List[float]]:
@@ -99,7 +176,7 @@ def generate_embeddings(texts: List[str]) -> List[List[float]]:
     Returns:
         嵌入向量列表
     """
-    embeddings = embedding_model.encode(texts, convert_to_numpy=True)
+    embeddings = get_embedding_model().encode(texts, convert_to_numpy=True)
     return embeddings.tolist()
 
 # 10. 讀取文字檔案函式
@@ -136,28 +213,9 @@ def read_pdf_file(file_path: str) -> str:
         PDF 內容文字
     """
     try:
-        content = ""
-        
-        # 嘗試使用 pdfplumber (更好的文字提取)
-        try:
-            with pdfplumber.open(file_path) as pdf:
-                for page in pdf.pages:
-                    page_text = page.extract_text()
-                    if page_text:
-                        content += page_text + "\n"
-            print(f"使用 pdfplumber 成功讀取 PDF: {file_path}")
-        except Exception as e:
-            print(f"pdfplumber 讀取失敗，嘗試使用 PyPDF2: {str(e)}")
-            
-            # 備用方案：使用 PyPDF2
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                for page in pdf_reader.pages:
-                    page_text = page.extract_text()
-                    if page_text:
-                        content += page_text + "\n"
-            print(f"使用 PyPDF2 成功讀取 PDF: {file_path}")
-        
+        # 逐頁解析（pdfplumber 失敗的頁面改用 PyPDF2），最後一次串接
+        content = "\n".join(page_text for _, page_text in iter_pdf_pages(file_path) if page_text)
+        print(f"成功讀取 PDF: {file_path}")
         return content.strip()
         
     except FileNotFoundError:
@@ -188,25 +246,70 @@ def read_file(file_path: str) -> str:
         print(f"不支援的檔案格式: {file_extension}")
         return ""
 
+# 10.3. 逐塊讀取檔案
+def iter_file_chunks(file_path: str, chunk_size: int = 500,
+                     chunk_overlap: int = 50) -> Iterator[Tuple[str, Optional[int]]]:
+    """
+    讀取檔案並分塊；PDF 逐頁解析後直接送入分塊器，不先組成完整文字
+    
+    Args:
+        file_path: 檔案路徑
+        chunk_size: 分塊大小
+        chunk_overlap: 分塊重疊
+    
+    Yields:
+        (文字塊, 頁碼)；TXT 檔案沒有頁碼，返回 None
+    """
+    if file_path.lower().endswith('.pdf'):
+        yield from chunk_pages(iter_pdf_pages(file_path), chunk_size=chunk_size,
+                               chunk_overlap=chunk_overlap)
+        return
+    for chunk in chunk_text(read_file(file_path), chunk_size=chunk_size, chunk_overlap=chunk_overlap):
+        yield chunk, None
+
+# 10.4. 文字塊 ID
+def make_chunk_ids(source_file: str, chunks: List[str]) -> List[str]:
+    """
+    依檔名與文字塊內容產生確定性的向量 ID（相同內容重新匯入時 ID 不變，可比對差異）
+    
+    Args:
+        source_file: 來源檔名
+        chunks: 文字塊列表
+    
+    Returns:
+        向量 ID 列表；同一檔案中重複出現的相同文字塊會加上出現次序區分
+    """
+    file_hash = hashlib.sha1(source_file.encode('utf-8')).hexdigest()[:12]
+    occurrences = {}
+    ids = []
+    for chunk in chunks:
+        occurrence = occurrences.get(chunk, 0)
+        occurrences[chunk] = occurrence + 1
+        chunk_hash = hashlib.sha256(f"{occurrence}:{chunk}".encode('utf-8')).hexdigest()[:24]
+        ids.append(f"{file_hash}-{chunk_hash}")
+    return ids
+
 # 11. 儲存到 Pinecone 函式
 def store_to_pinecone(index, chunks: List[str], embeddings: List[List[float]], 
-                     metadata_list: List[Dict[str, Any]] = None):
+                     metadata_list: List[Dict[str, Any]] = None, ids: List[str] = None):
     """
-    將向量和元數據儲存到 Pinecone
+    將向量和元數據儲存到向量索引
     
     Args:
-        index: Pinecone 索引物件
+        index: 向量索引物件
         chunks: 文字塊列表
         embeddings: 嵌入向量列表
         metadata_list: 元數據列表
+        ids: 向量 ID 列表，未指定時依來源檔名與內容產生
     """
     if metadata_list is None:
         metadata_list = [{"text": chunk} for chunk in chunks]
+    if ids is None:
+        ids = make_chunk_ids(metadata_list[0].get("source_file", "") if metadata_list else "", chunks)
     
     # 準備要上傳的向量
     vectors_to_upsert = []
-    for i, (chunk, embedding, metadata) in enumerate(zip(chunks, embeddings, metadata_list)):
-        vector_id = str(uuid.uuid4())
+    for i, (vector_id, chunk, embedding, metadata) in enumerate(zip(ids, chunks, embeddings, metadata_list)):
         vectors_to_upsert.append({
             "id": vector_id,
             "values": embedding,
@@ -226,60 +329,79 @@ def store_to_pinecone(index, chunks: List[str], embeddings: List[List[float]],
             print(f"成功上傳批次 {i//batch_size + 1}/{(len(vectors_to_upsert)-1)//batch_size + 1}")
         except Exception as e:
             print(f"上傳批次時發生錯誤: {str(e)}")
+    # 本地索引的變更在所有批次完成後一次寫入磁碟
+    flush_index(index)
 
 # 12. 主要處理函式
-def process_file(file_path: str, chunk_size: int = 500, chunk_overlap: int = 50):
+def process_file(file_path: str, chunk_size: int = 500, chunk_overlap: int = 50, index=None):
     """
     處理檔案的主要函式（支援 TXT 和 PDF）
+    與 init_db.py 使用相同的匯入管線：PDF 逐頁解析、分塊、批次嵌入與並行上傳重疊執行
     
     Args:
         file_path: 檔案路徑
         chunk_size: 分塊大小
         chunk_overlap: 分塊重疊
+        index: 目標向量索引，未指定時依 VECTOR_BACKEND 創建或連接
     """
     print("="*50)
     print("開始處理檔案...")
     print("="*50)
     
     # 創建或連接索引
-    index = create_or_connect_index()
     if index is None:
-        print("無法創建或連接到 Pinecone 索引，程式終止")
+        index = create_or_connect_index()
+    if index is None:
+        print("無法創建或連接到向量索引，程式終止")
         return
     
-    # 讀取檔案
-    print(f"正在讀取檔案: {file_path}")
-    text_content = read_file(file_path)
-    if not text_content:
-        print("檔案內容為空或讀取失敗")
-        return
+    source_file = os.path.basename(file_path)
+    lexical_index = LexicalIndex(get_lexical_index_path())
     
-    print(f"檔案讀取成功，總字符數: {len(text_content)}")
-    
-    # 文字分塊
-    print("正在進行文字分塊...")
-    chunks = chunk_text(text_content, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-    print(f"分塊完成，總共生成 {len(chunks)} 個文字塊")
-    
-    # 生成嵌入向量
-    print("正在生成嵌入向量...")
-    embeddings = generate_embeddings(chunks)
-    print(f"向量生成完成，向量維度: {len(embeddings[0])}")
-    
-    # 準備元數據
-    metadata_list = [
-        {
-            "source_file": os.path.basename(file_path),
-            "chunk_size": chunk_size,
-            "chunk_overlap": chunk_overlap,
-            "text_length": len(chunk)
-        }
-        for chunk in chunks
-    ]
-    
-    # 儲存到 Pinecone
-    print("正在儲存到 Pinecone...")
-    store_to_pinecone(index, chunks, embeddings, metadata_list)
+    def plan(_, chunk_pairs: List[Tuple[str, Optional[int]]]) -> List[Dict[str, Any]]:
+        """分塊完成後準備元數據，並更新關鍵字索引（與向量索引使用相同的文字塊 ID）"""
+        chunks = [chunk for chunk, _ in chunk_pairs]
+        print(f"分塊完成，總共生成 {len(chunks)} 個文字塊")
+        chunk_ids = make_chunk_ids(source_file, chunks)
+        metadata_list = [
+            {
+                "source_file": source_file,
+                "chunk_size": chunk_size,
+                "chunk_overlap": chunk_overlap,
+                "text_length": len(chunk),
+                "chunk_index": i,
+                **({"page": page} if page is not None else {})
+            }
+            for i, (chunk, page) in enumerate(chunk_pairs)
+        ]
+        lexical_index.set_file(source_file, chunk_ids,
+                               [{**metadata, "text": chunk} for chunk, metadata in zip(chunks, metadata_list)])
+        return [{'id': chunk_id, 'text': chunk, 'metadata': metadata}
+                for chunk_id, chunk, metadata in zip(chunk_ids, chunks, metadata_list)]
+    
+    # 讀取、分塊、嵌入與上傳
+    print(f"正在讀取並匯入檔案: {file_path}")
+    pipeline = IngestPipeline(
+        index,
+        chunk=lambda text: chunk_text(text, chunk_size=chunk_size, chunk_overlap=chunk_overlap),
+        chunk_pages=lambda pages: chunk_pages(pages, chunk_size=chunk_size, chunk_overlap=chunk_overlap),
+        embed=generate_embeddings,
+        read_text=read_text_file,
+        file_workers=1,
+        extract_workers=int(os.getenv('INGEST_EXTRACT_WORKERS', '0')) or None,
+        embed_batch_size=int(os.getenv('INGEST_EMBED_BATCH_SIZE', '64')),
+        upsert_concurrency=int(os.getenv('INGEST_UPSERT_CONCURRENCY', '4'))
+    )
+    report = pipeline.run([file_path], plan=plan, on_upserted=lambda items: None)
+    result = report['files'][file_path]
+    # 本地索引的變更一次寫入磁碟
+    flush_index(index)
+    if result['error']:
+        print(f"處理檔案時發生錯誤: {result['error']}")
+        return
+    lexical_index.save()
+    print(f"上傳完成：{result['upserted']}/{result['chunks']} 個文字塊")
+    print_stage_report(report)
     
     # 驗證儲存結果
     stats = index.describe_index_stats()
@@ -290,19 +412,24 @@ def process_file(file_path: str, chunk_size: int = 500, chunk_overlap: int = 50)
     print("="*50)
 
 # 13. 查詢函式 (用於測試)
-def query_similar_texts(query_text: str, top_k: int = 5):
+def query_similar_texts(query_text: str, top_k: int = 5, index=None):
     """
     查詢相似文字
     
     Args:
         query_text: 查詢文字
         top_k: 返回最相似的前k個結果
+        index: 目標向量索引，未指定時依 VECTOR_BACKEND 連接
     """
     try:
-        index = pc.Index(INDEX_NAME)
+        if index is None:
+            if get_backend_name() == "pinecone":
+                index = clients.get_pinecone_index(INDEX_NAME, PINECONE_API_KEY)
+            else:
+                index = create_or_connect_index()
         
         # 生成查詢向量
-        query_embedding = embedding_model.encode([query_text]).tolist()[0]
+        query_embedding = get_embedding_model().encode([query_text]).tolist()[0]
         
         # 執行查詢
         results = index.query(
@@ -325,6 +452,15 @@ def query_similar_texts(query_text: str, top_k: int = 5):
 
 # 14. 使用範例
 if __name__ == "__main__":
+    print("\n" + "="*60)
+    print("程式載入完成！")
+    print("="*60)
+    print("使用說明:")
+    print("1. 執行 process_text_file('your_file.txt') 來處理您的文字檔案")
+    print("2. 執行 query_similar_texts('您的查詢') 來搜尋相似文字")
+    print("3. 請確保將 'your_file.txt' 替換為您實際的檔案路徑")
+    print("="*60)
+    
     # 使用方法 1: 處理單個文字檔案
     # 請將 'your_text_file.txt' 替換為您的實際檔案路徑
     # process_text_file('your_text_file.txt', chunk_size=500, chunk_overlap=50)
@@ -352,13 +488,4 @@ if __name__ == "__main__":
     print("\n" + "="*50)
     print("測試查詢功能...")
     print("="*50)
-    query_similar_texts("機器學習", top_k=3)
-
-print("\n" + "="*60)
-print("程式載入完成！")
-print("="*60)
-print("使用說明:")
-print("1. 執行 process_text_file('your_file.txt') 來處理您的文字檔案")
-print("2. 執行 query_similar_texts('您的查詢') 來搜尋相似文字")
-print("3. 請確保將 'your_file.txt' 替換為您實際的檔案路徑")
-print("="*60)
\ No newline at end of file
+    query_similar_texts("機器學習", top_k=3)
\ No newline at end of file
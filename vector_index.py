@@ -0,0 +1,646 @@
+# 向量索引後端
+# 提供與 Pinecone Index 相容的最小介面，並實作本地 NumPy 記憶體映射索引（精確搜尋與 IVF 近似搜尋）
+
+import os
+import json
+import threading
+from abc import ABC, abstractmethod
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+# 預設設定
+DEFAULT_BACKEND = "pinecone"
+DEFAULT_LOCAL_INDEX_PATH = "local_index"
+DIMENSION = 384  # sentence-transformers/all-MiniLM-L6-v2 的向量維度
+
+
+class VectorIndex(ABC):
+    """
+    向量索引介面
+    方法簽名沿用 Pinecone Index（upsert / query / delete / describe_index_stats），
+    讓 RAGSystem、RAGRetriever 與 vectorStore 可以不分後端直接呼叫
+    """
+
+    @abstractmethod
+    def upsert(self, vectors: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """新增或更新向量"""
+
+    @abstractmethod
+    def query(self, vector: List[float], top_k: int = 3,
+              include_metadata: bool = True) -> Dict[str, Any]:
+        """查詢最相似的向量"""
+
+    @abstractmethod
+    def delete(self, ids: Optional[List[str]] = None, delete_all: bool = False) -> Dict[str, Any]:
+        """刪除向量"""
+
+    @abstractmethod
+    def update(self, id: str, values: Optional[List[float]] = None,
+               set_metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """更新單一向量的值或部分元數據"""
+
+    def update_metadata(self, ids: List[str], metadata_list: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        批次合併多個向量的部分元數據
+
+        Args:
+            ids: 向量 id 列表
+            metadata_list: 對應的要合併欄位
+        """
+        for vector_id, metadata in zip(ids, metadata_list):
+            self.update(id=vector_id, set_metadata=metadata)
+        return {}
+
+    @abstractmethod
+    def describe_index_stats(self) -> Dict[str, Any]:
+        """取得索引統計資訊"""
+
+    def flush(self) -> bool:
+        """
+        將尚未寫入磁碟的變更持久化
+
+        Returns:
+            是否實際寫入（沒有待寫入的變更時為 False）
+        """
+        return False
+
+
+class LocalVectorIndex(VectorIndex):
+    """
+    本地餘弦相似度索引
+    向量以連續的 float32 矩陣儲存（已正規化），搭配 chunk id 與元數據陣列；
+    磁碟上的矩陣以 memory-map 方式載入，查詢為單次矩陣乘法，無需任何外部服務。
+    upsert / update / delete 只修改記憶體中的資料（矩陣預留容量，追加時不必複製整個矩陣），
+    呼叫 flush() 或 save() 時才寫回磁碟
+    """
+
+    BACKEND = "local"
+    VECTORS_FILE = "vectors.npy"
+    META_FILE = "metadata.json"
+
+    def __init__(self, path: str = DEFAULT_LOCAL_INDEX_PATH, dimension: int = DIMENSION):
+        """
+        初始化本地索引
+
+        Args:
+            path: 索引目錄
+            dimension: 向量維度
+        """
+        self.path = path
+        self.dimension = dimension
+        self._lock = threading.RLock()
+        self._vectors = np.zeros((0, dimension), dtype=np.float32)
+        self._ids: List[str] = []
+        self._metadata: List[Dict[str, Any]] = []
+        self._id_to_row: Dict[str, int] = {}
+        self._loaded_mtime = None
+        # 可寫入的矩陣緩衝區（_vectors 為其前 n 列的檢視），尚未修改時為 None
+        self._buffer: Optional[np.ndarray] = None
+        self._dirty = False
+        self.load()
+
+    # ---- 持久化 ----
+
+    @property
+    def _vectors_path(self) -> str:
+        return os.path.join(self.path, self.VECTORS_FILE)
+
+    @property
+    def _meta_path(self) -> str:
+        return os.path.join(self.path, self.META_FILE)
+
+    def load(self):
+        """從磁碟載入索引（向量矩陣以唯讀 memory-map 開啟）"""
+        with self._lock:
+            if not (os.path.exists(self._vectors_path) and os.path.exists(self._meta_path)):
+                return
+            with open(self._meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            vectors = np.load(self._vectors_path, mmap_mode='r')
+            if vectors.ndim != 2 or vectors.shape[0] != len(meta['ids']):
+                raise ValueError(f"本地索引檔案不一致: {self.path}")
+            self.dimension = vectors.shape[1]
+            self._vectors = vectors
+            self._ids = list(meta['ids'])
+            self._metadata = list(meta['metadata'])
+            self._id_to_row = {vector_id: row for row, vector_id in enumerate(self._ids)}
+            self._loaded_mtime = os.path.getmtime(self._meta_path)
+            self._buffer = None
+            self._dirty = False
+
+    def save(self):
+        """將索引寫回磁碟（先寫暫存檔再原子替換），並重新以 memory-map 載入"""
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            tmp_vectors = self._vectors_path + ".tmp.npy"
+            tmp_meta = self._meta_path + ".tmp"
+            np.save(tmp_vectors, np.ascontiguousarray(self._vectors, dtype=np.float32))
+            with open(tmp_meta, 'w', encoding='utf-8') as f:
+                json.dump({'ids': self._ids, 'metadata': self._metadata}, f, ensure_ascii=False)
+            os.replace(tmp_vectors, self._vectors_path)
+            os.replace(tmp_meta, self._meta_path)
+            self.load()
+
+    def flush(self) -> bool:
+        """有尚未寫入的變更時寫回磁碟"""
+        with self._lock:
+            if not self._dirty:
+                return False
+            self.save()
+            return True
+
+    @property
+    def dirty(self) -> bool:
+        """是否有尚未寫入磁碟的變更"""
+        return self._dirty
+
+    def _mark_dirty(self):
+        self._dirty = True
+
+    def _reserve(self, rows: int) -> np.ndarray:
+        """
+        取得至少 rows 列的可寫入緩衝區；容量不足時倍增擴充並複製現有向量，
+        連續追加的總複製量與向量數成正比
+        """
+        buffer = self._buffer
+        if buffer is None or buffer.shape[0] < rows:
+            current = buffer.shape[0] if buffer is not None else self._vectors.shape[0]
+            capacity = max(rows, 2 * current, 1024)
+            new_buffer = np.empty((capacity, self.dimension), dtype=np.float32)
+            new_buffer[:self._vectors.shape[0]] = self._vectors
+            self._buffer = buffer = new_buffer
+        return buffer
+
+    @property
+    def version(self) -> Optional[float]:
+        """索引版本（磁碟檔案的修改時間），重新寫入索引時會改變"""
+        return self._loaded_mtime
+
+    def refresh(self) -> bool:
+        """若索引檔案已被其他程序（例如 init_db.py）更新，則重新載入"""
+        if self._dirty:
+            # 本程序有尚未寫入的變更，不以磁碟上的舊版本覆蓋
+            return False
+        try:
+            mtime = os.path.getmtime(self._meta_path)
+        except OSError:
+            return False
+        if mtime == self._loaded_mtime:
+            return False
+        try:
+            self.load()
+        except (OSError, ValueError):
+            # 其他程序仍在寫入中，沿用目前已載入的索引
+            return False
+        return True
+
+    # ---- Pinecone 相容介面 ----
+
+    def upsert(self, vectors: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        新增或更新向量
+
+        Args:
+            vectors: [{'id': str, 'values': List[float], 'metadata': dict}, ...]
+
+        Returns:
+            {'upserted_count': int}
+        """
+        if not vectors:
+            return {'upserted_count': 0}
+        return self.upsert_arrays(
+            [str(v['id']) for v in vectors],
+            np.asarray([v['values'] for v in vectors], dtype=np.float32),
+            [dict(v.get('metadata') or {}) for v in vectors]
+        )
+
+    def upsert_arrays(self, ids: List[str], values: np.ndarray,
+                      metadata_list: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        以陣列形式批次新增或更新向量（大量建立索引時避免轉換成 Python 列表）
+
+        Args:
+            ids: 向量 id 列表
+            values: 形狀為 (n, dimension) 的向量矩陣
+            metadata_list: 元數據列表
+
+        Returns:
+            {'upserted_count': int}
+        """
+        values = np.asarray(values, dtype=np.float32)
+        if values.ndim != 2 or values.shape[1] != self.dimension:
+            raise ValueError(f"向量維度不符，預期 {self.dimension}，收到 {values.shape[-1]}")
+        values = _normalize_rows(values)
+
+        with self._lock:
+            rows = np.empty(len(ids), dtype=np.int64)
+            for i, (vector_id, metadata) in enumerate(zip(ids, metadata_list)):
+                row = self._id_to_row.get(vector_id)
+                if row is None:
+                    row = self._id_to_row[vector_id] = len(self._ids)
+                    self._ids.append(vector_id)
+                    self._metadata.append(metadata)
+                else:
+                    # 既有的 id，或同一批次內重複的新 id（後者覆蓋前者）
+                    self._metadata[row] = metadata
+                rows[i] = row
+            buffer = self._reserve(len(self._ids))
+            buffer[rows] = values
+            self._vectors = buffer[:len(self._ids)]
+            self._mark_dirty()
+
+        return {'upserted_count': len(ids)}
+
+    def query(self, vector: List[float], top_k: int = 3,
+              include_metadata: bool = True) -> Dict[str, Any]:
+        """
+        以餘弦相似度查詢最相似的向量
+
+        Args:
+            vector: 查詢向量
+            top_k: 返回數量
+            include_metadata: 是否附帶元數據
+
+        Returns:
+            {'matches': [{'id', 'score', 'metadata'}, ...]}，格式與 Pinecone 相同
+        """
+        self.refresh()
+        with self._lock:
+            matrix, ids, metadata = self._vectors, self._ids, self._metadata
+        if len(ids) == 0 or top_k <= 0:
+            return {'matches': []}
+
+        query_vector = _normalize_rows(np.asarray(vector, dtype=np.float32).reshape(1, -1))[0]
+        scores = matrix @ query_vector
+        rows = _top_k_rows(scores, top_k)
+        return {'matches': [_make_match(ids, metadata, row, scores[row], include_metadata)
+                            for row in rows]}
+
+    def delete(self, ids: Optional[List[str]] = None, delete_all: bool = False) -> Dict[str, Any]:
+        """
+        刪除向量
+
+        Args:
+            ids: 要刪除的 id 列表
+            delete_all: 是否清空整個索引
+        """
+        with self._lock:
+            if delete_all:
+                keep = []
+            else:
+                remove = set(ids or [])
+                keep = [row for row, vector_id in enumerate(self._ids) if vector_id not in remove]
+            self._vectors = np.array(self._vectors[keep], dtype=np.float32).reshape(-1, self.dimension)
+            self._buffer = self._vectors
+            self._ids = [self._ids[row] for row in keep]
+            self._metadata = [self._metadata[row] for row in keep]
+            self._id_to_row = {vector_id: row for row, vector_id in enumerate(self._ids)}
+            self._mark_dirty()
+        return {}
+
+    def update(self, id: str, values: Optional[List[float]] = None,
+               set_metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        更新單一向量的值或部分元數據（與 Pinecone Index.update 相同）
+
+        Args:
+            id: 向量 id
+            values: 新的向量值，None 表示不變
+            set_metadata: 要合併進元數據的欄位
+        """
+        with self._lock:
+            row = self._id_to_row.get(id)
+            if row is None:
+                raise KeyError(f"找不到向量: {id}")
+            if set_metadata:
+                self._metadata[row] = {**self._metadata[row], **set_metadata}
+            if values is not None:
+                buffer = self._reserve(len(self._ids))
+                buffer[row] = _normalize_rows(np.asarray(values, dtype=np.float32).reshape(1, -1))[0]
+                self._vectors = buffer[:len(self._ids)]
+            self._mark_dirty()
+        return {}
+
+    def update_metadata(self, ids: List[str], metadata_list: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        批次合併多個向量的部分元數據（一次取得鎖，變更在 flush() 時一起寫入）
+
+        Args:
+            ids: 向量 id 列表
+            metadata_list: 對應的要合併欄位
+        """
+        with self._lock:
+            missing = [vector_id for vector_id in ids if vector_id not in self._id_to_row]
+            if missing:
+                raise KeyError(f"找不到向量: {', '.join(missing[:5])}")
+            for vector_id, metadata in zip(ids, metadata_list):
+                row = self._id_to_row[vector_id]
+                self._metadata[row] = {**self._metadata[row], **metadata}
+            if ids:
+                self._mark_dirty()
+        return {}
+
+    def describe_index_stats(self) -> Dict[str, Any]:
+        """取得索引統計資訊"""
+        return {
+            'dimension': self.dimension,
+            'total_vector_count': len(self._ids),
+            'backend': self.BACKEND,
+            'path': self.path
+        }
+
+
+class IVFVectorIndex(LocalVectorIndex):
+    """
+    倒排檔（IVF）近似最近鄰索引
+    以球面 k-means 把向量分成 nlist 個群集，查詢時只掃描與查詢最接近的 nprobe 個群集；
+    每個群集的向量依群集順序連續存放，掃描時為連續記憶體的矩陣乘法。
+    向量數不超過 exact_threshold 時直接使用精確搜尋。
+    群集只由 build() 建立（init_db.py 匯入後執行），查詢時若群集結構不存在或已過期則改用精確搜尋，
+    不會在請求中訓練 k-means
+    """
+
+    BACKEND = "ivf"
+    IVF_FILE = "ivf.npz"
+    IVF_VECTORS_FILE = "ivf_vectors.npy"
+
+    def __init__(self, path: str = DEFAULT_LOCAL_INDEX_PATH, dimension: int = DIMENSION,
+                 nlist: Optional[int] = None, nprobe: int = 8, train_iters: int = 10,
+                 train_sample: int = 50000, exact_threshold: int = 2000, seed: int = 0):
+        """
+        初始化 IVF 索引
+
+        Args:
+            path: 索引目錄
+            dimension: 向量維度
+            nlist: 群集數量，None 表示依向量數自動決定（約 4 * sqrt(n)）
+            nprobe: 查詢時掃描的群集數量，越大召回率越高、延遲越長
+            train_iters: k-means 迭代次數
+            train_sample: k-means 訓練時抽樣的向量數
+            exact_threshold: 向量數不超過此值時使用精確搜尋
+            seed: 隨機種子
+        """
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_iters = train_iters
+        self.train_sample = train_sample
+        self.exact_threshold = exact_threshold
+        self.seed = seed
+        self._ivf = None
+        self._ivf_mtime = None
+        self._warned_stale = False
+        super().__init__(path, dimension)
+
+    @property
+    def _ivf_path(self) -> str:
+        return os.path.join(self.path, self.IVF_FILE)
+
+    @property
+    def _ivf_vectors_path(self) -> str:
+        return os.path.join(self.path, self.IVF_VECTORS_FILE)
+
+    def load(self):
+        """載入索引，並在 IVF 結構與目前資料一致時一併載入"""
+        with self._lock:
+            super().load()
+            self._ivf = self._load_ivf()
+
+    def _mark_dirty(self):
+        # 資料已變更，群集結構過期
+        super()._mark_dirty()
+        self._ivf = None
+
+    def refresh(self) -> bool:
+        """重新載入已更新的索引；索引未變但其他程序剛建立好群集結構時載入群集"""
+        if super().refresh():
+            return True
+        if self._ivf is not None or self._dirty:
+            return False
+        try:
+            mtime = os.path.getmtime(self._ivf_path)
+        except OSError:
+            return False
+        if mtime == self._ivf_mtime:
+            return False
+        with self._lock:
+            try:
+                self._ivf = self._load_ivf()
+            except (OSError, ValueError, KeyError):
+                # 其他程序仍在寫入中
+                return False
+        return self._ivf is not None
+
+    def _load_ivf(self) -> Optional[Dict[str, np.ndarray]]:
+        """從磁碟載入 IVF 結構；若不存在或已過期則返回 None"""
+        if not (os.path.exists(self._ivf_path) and os.path.exists(self._ivf_vectors_path)):
+            return None
+        self._ivf_mtime = os.path.getmtime(self._ivf_path)
+        with np.load(self._ivf_path) as data:
+            if (int(data['count']) != len(self._ids)
+                    or float(data['source_mtime']) != self._loaded_mtime):
+                return None
+            ivf = {key: data[key] for key in ('centroids', 'offsets', 'order')}
+        ivf['vectors'] = np.load(self._ivf_vectors_path, mmap_mode='r')
+        return ivf
+
+    def build(self) -> Optional[Dict[str, np.ndarray]]:
+        """
+        訓練群集中心並建立倒排列表，結果寫入磁碟供其他程序直接載入
+
+        Returns:
+            IVF 結構；向量數不足時返回 None（使用精確搜尋）
+        """
+        with self._lock:
+            # 群集結構以磁碟上的版本為準，先寫入尚未持久化的變更
+            self.flush()
+            matrix = np.asarray(self._vectors, dtype=np.float32)
+            n = matrix.shape[0]
+            if n <= self.exact_threshold:
+                self._ivf = None
+                return None
+
+            nlist = min(n, self.nlist or max(1, int(4 * np.sqrt(n))))
+            centroids = _spherical_kmeans(matrix, nlist, self.train_iters,
+                                          self.train_sample, self.seed)
+            assignments = _assign_to_centroids(matrix, centroids)
+            order = np.argsort(assignments, kind='stable')
+            counts = np.bincount(assignments, minlength=nlist)
+            offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+            os.makedirs(self.path, exist_ok=True)
+            np.save(self._ivf_vectors_path, np.ascontiguousarray(matrix[order]))
+            np.savez(self._ivf_path, centroids=centroids, offsets=offsets, order=order,
+                     count=n, source_mtime=self._loaded_mtime or 0.0)
+            self._ivf = self._load_ivf()
+            return self._ivf
+
+    def query(self, vector: List[float], top_k: int = 3,
+              include_metadata: bool = True, nprobe: Optional[int] = None) -> Dict[str, Any]:
+        """
+        近似最近鄰查詢
+
+        Args:
+            vector: 查詢向量
+            top_k: 返回數量
+            include_metadata: 是否附帶元數據
+            nprobe: 本次查詢掃描的群集數量，預設使用建立索引時的設定
+
+        Returns:
+            {'matches': [{'id', 'score', 'metadata'}, ...]}
+        """
+        self.refresh()
+        with self._lock:
+            matrix, ids, metadata, ivf = self._vectors, self._ids, self._metadata, self._ivf
+            if ivf is None and len(ids) > self.exact_threshold and not self._warned_stale:
+                self._warned_stale = True
+                print(f"⚠️ IVF 群集結構不存在或已過期，暫時使用精確搜尋（執行 python init_db.py 重新建立）: {self.path}")
+        if len(ids) == 0 or top_k <= 0:
+            return {'matches': []}
+
+        query_vector = _normalize_rows(np.asarray(vector, dtype=np.float32).reshape(1, -1))[0]
+        if ivf is None:
+            scores = matrix @ query_vector
+            rows = _top_k_rows(scores, top_k)
+            return {'matches': [_make_match(ids, metadata, row, scores[row], include_metadata)
+                                for row in rows]}
+
+        offsets = ivf['offsets']
+        probe = _top_k_rows(ivf['centroids'] @ query_vector, nprobe or self.nprobe)
+        candidate_rows, candidate_scores = [], []
+        for cluster in probe:
+            start, end = offsets[cluster], offsets[cluster + 1]
+            if start == end:
+                continue
+            candidate_scores.append(ivf['vectors'][start:end] @ query_vector)
+            candidate_rows.append(ivf['order'][start:end])
+        if not candidate_rows:
+            return {'matches': []}
+
+        scores = np.concatenate(candidate_scores)
+        rows = np.concatenate(candidate_rows)
+        best = _top_k_rows(scores, top_k)
+        return {'matches': [_make_match(ids, metadata, rows[i], scores[i], include_metadata)
+                            for i in best]}
+
+    def describe_index_stats(self) -> Dict[str, Any]:
+        """取得索引統計資訊（nlist 為目前群集結構的群集數，未建立時為 0）"""
+        ivf = self._ivf
+        return {
+            **super().describe_index_stats(),
+            'ivf_built': ivf is not None,
+            'nlist': int(ivf['centroids'].shape[0]) if ivf is not None else 0,
+            'nprobe': self.nprobe
+        }
+
+
+def flush_index(index) -> bool:
+    """
+    將索引尚未寫入磁碟的變更持久化（Pinecone 等寫入即時生效的索引沒有 flush()，不需處理）
+
+    Returns:
+        是否實際寫入
+    """
+    flush = getattr(index, 'flush', None)
+    return bool(flush()) if flush is not None else False
+
+
+def _assign_to_centroids(matrix: np.ndarray, centroids: np.ndarray,
+                         batch_size: int = 8192) -> np.ndarray:
+    """將每個向量分配到內積最大的群集中心（分批計算以限制記憶體用量）"""
+    assignments = np.empty(matrix.shape[0], dtype=np.int64)
+    for start in range(0, matrix.shape[0], batch_size):
+        batch = np.asarray(matrix[start:start + batch_size], dtype=np.float32)
+        assignments[start:start + batch_size] = np.argmax(batch @ centroids.T, axis=1)
+    return assignments
+
+
+def _spherical_kmeans(matrix: np.ndarray, nlist: int, iters: int,
+                      sample_size: int, seed: int) -> np.ndarray:
+    """以抽樣向量訓練球面 k-means（中心點保持單位長度，對應餘弦相似度）"""
+    rng = np.random.default_rng(seed)
+    n = matrix.shape[0]
+    sample_rows = np.sort(rng.choice(n, size=min(n, max(sample_size, nlist)), replace=False))
+    sample = np.asarray(matrix[sample_rows], dtype=np.float32)
+    centroids = sample[rng.choice(sample.shape[0], size=nlist, replace=False)].copy()
+
+    for _ in range(iters):
+        assignments = _assign_to_centroids(sample, centroids)
+        order = np.argsort(assignments, kind='stable')
+        sorted_assignments = assignments[order]
+        starts = np.flatnonzero(np.r_[True, sorted_assignments[1:] != sorted_assignments[:-1]])
+        sums = np.zeros_like(centroids)
+        sums[sorted_assignments[starts]] = np.add.reduceat(sample[order], starts, axis=0)
+
+        # 空群集以隨機樣本重新播種
+        empty = np.flatnonzero(np.bincount(assignments, minlength=nlist) == 0)
+        if len(empty):
+            sums[empty] = sample[rng.choice(sample.shape[0], size=len(empty), replace=False)]
+        centroids = _normalize_rows(sums)
+
+    return centroids
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """將每一列正規化為單位向量，使內積等於餘弦相似度"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32, copy=False)
+
+
+def _top_k_rows(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """取出分數最高的 top_k 個列索引（依分數由高到低）"""
+    if top_k >= scores.shape[0]:
+        return np.argsort(-scores)
+    candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+    return candidates[np.argsort(-scores[candidates])]
+
+
+def _make_match(ids: List[str], metadata: List[Dict[str, Any]], row: int,
+                score: float, include_metadata: bool) -> Dict[str, Any]:
+    """組成與 Pinecone 相同格式的查詢結果"""
+    match = {'id': ids[row], 'score': float(score)}
+    match['metadata'] = dict(metadata[row]) if include_metadata else {}
+    return match
+
+
+def get_backend_name(backend: Optional[str] = None) -> str:
+    """取得向量後端名稱（參數優先，其次為環境變數 VECTOR_BACKEND）"""
+    return (backend or os.getenv('VECTOR_BACKEND') or DEFAULT_BACKEND).strip().lower()
+
+
+def create_vector_index(backend: Optional[str] = None,
+                        index_name: str = "text-chunks-index",
+                        pinecone_client=None,
+                        pinecone_api_key: Optional[str] = None,
+                        local_index_path: Optional[str] = None,
+                        dimension: int = DIMENSION):
+    """
+    依設定建立向量索引
+
+    Args:
+        backend: "pinecone"、"local" 或 "ivf"，未指定時讀取環境變數 VECTOR_BACKEND
+        index_name: Pinecone 索引名稱
+        pinecone_client: 已建立的 Pinecone 客戶端；未指定時使用 clients.py 共用的索引 handle
+        pinecone_api_key: Pinecone API 金鑰（未指定客戶端時使用）
+        local_index_path: 本地索引目錄，未指定時讀取環境變數 LOCAL_INDEX_PATH
+        dimension: 向量維度
+
+    Returns:
+        具備 upsert / query / delete / describe_index_stats 的索引物件
+    """
+    backend = get_backend_name(backend)
+    if backend in ("local", "ivf"):
+        path = local_index_path or os.getenv('LOCAL_INDEX_PATH', DEFAULT_LOCAL_INDEX_PATH)
+        if backend == "ivf":
+            nlist = os.getenv('IVF_NLIST')
+            return IVFVectorIndex(path, dimension=dimension,
+                                  nlist=int(nlist) if nlist else None,
+                                  nprobe=int(os.getenv('IVF_NPROBE', '8')))
+        return LocalVectorIndex(path, dimension=dimension)
+    if backend == "pinecone":
+        if pinecone_client is not None:
+            return pinecone_client.Index(index_name)
+        from clients import get_pinecone_index
+        return get_pinecone_index(index_name, pinecone_api_key)
+    raise ValueError(f"不支援的向量後端: {backend}")